@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Adaptive bitrate controller driven by WebRTC sender stats
+
+Reads RTT, packet loss and the receiver's bandwidth estimate (REMB/TWCC)
+from whipclientsink's webrtcbin stats and steers the encoder bitrate, and
+the output resolution when the bitrate gets too thin for it, between the
+configured bounds.
+
+Replay a recorded stats trace (JSONL, one sample per line):
+    python3 abr.py replay /app/logs/abr-trace.jsonl --max-bitrate 5000
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# Output resolutions the controller may step through, largest first
+RESOLUTION_LADDER = ["1920x1080", "1280x720", "960x540", "854x480", "640x360"]
+
+# Bits per pixel per frame below which a resolution looks blocky, and the
+# (higher) level the next resolution up must reach before stepping back up
+MIN_BITS_PER_PIXEL = 0.04
+STEP_UP_BITS_PER_PIXEL = 0.07
+
+DEFAULT_SETTINGS = {
+    "min_bitrate": 1000,
+    "max_bitrate": 5000,
+    "max_resolution": "1280x720",
+    "fps": 60,
+    # Loss fraction that counts as congestion / as heavy congestion
+    "loss_threshold": 0.02,
+    "heavy_loss_threshold": 0.10,
+    # RTT above the path's best RTT that counts as queue build-up
+    "rtt_rise_ms": 80,
+    # Consecutive clean samples before probing upwards
+    "increase_after": 3,
+    "resolution_up_after": 10,
+}
+
+
+def _pixels(resolution):
+    width, height = str(resolution).lower().split("x")
+    return int(width) * int(height)
+
+
+def find_stats(stats, stats_type):
+    """Yield every nested stats entry of the given webrtcbin type"""
+    if isinstance(stats, dict):
+        if str(stats.get("type", "")) == stats_type:
+            yield stats
+        for value in stats.values():
+            yield from find_stats(value, stats_type)
+    elif isinstance(stats, list):
+        for value in stats:
+            yield from find_stats(value, stats_type)
+
+
+def extract_sample(stats, timestamp=None):
+    """Reduce a webrtcbin stats tree to one controller sample.
+
+    The worst viewer wins: highest RTT, highest loss, lowest estimate.
+    Returns None when the stats hold no remote reports yet.
+    """
+    rtts = []
+    losses = []
+    estimates = []
+
+    for report in find_stats(stats, "remote-inbound-rtp"):
+        if "round-trip-time" in report:
+            rtts.append(float(report["round-trip-time"]) * 1000)
+        if "fraction-lost" in report:
+            losses.append(float(report["fraction-lost"]))
+
+    for pair in find_stats(stats, "candidate-pair"):
+        if "current-round-trip-time" in pair and not rtts:
+            rtts.append(float(pair["current-round-trip-time"]) * 1000)
+        if pair.get("available-outgoing-bitrate"):
+            estimates.append(float(pair["available-outgoing-bitrate"]) / 1000)
+
+    # REMB/TWCC estimates surfaced by the transport or webrtcsink's
+    # congestion controller
+    for transport in find_stats(stats, "transport"):
+        for key in ("remb-bitrate", "twcc-estimate", "bitrate-estimate"):
+            if transport.get(key):
+                estimates.append(float(transport[key]) / 1000)
+
+    if not rtts and not losses:
+        return None
+
+    return {
+        "t": time.time() if timestamp is None else timestamp,
+        "rtt_ms": max(rtts) if rtts else None,
+        "loss": max(losses) if losses else 0.0,
+        "estimate_kbps": min(estimates) if estimates else None,
+    }
+
+
+class BitrateController:
+    """AIMD bitrate control with a resolution ladder.
+
+    Each update() takes one stats sample and returns the new
+    {"bitrate", "resolution"} target when it changed, otherwise None.
+    """
+
+    def __init__(self, settings=None, bitrate=None, resolution=None):
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        max_pixels = _pixels(self.settings["max_resolution"])
+        self.ladder = [r for r in RESOLUTION_LADDER if _pixels(r) <= max_pixels]
+        if self.settings["max_resolution"] not in self.ladder:
+            self.ladder.insert(0, self.settings["max_resolution"])
+
+        self.bitrate = self._clamp(bitrate or self.settings["max_bitrate"])
+        resolution = resolution or self.settings["max_resolution"]
+        self.level = self.ladder.index(resolution) if resolution in self.ladder else 0
+        self.base_rtt = None
+        self.clean_samples = 0
+        self.applied = (self.bitrate, self.level)
+
+    @property
+    def resolution(self):
+        return self.ladder[self.level]
+
+    def _clamp(self, bitrate):
+        return int(
+            max(
+                self.settings["min_bitrate"], min(self.settings["max_bitrate"], bitrate)
+            )
+        )
+
+    def _bits_per_pixel(self, bitrate, resolution):
+        return bitrate * 1000 / (_pixels(resolution) * self.settings["fps"])
+
+    def update(self, sample):
+        s = self.settings
+        applied_bitrate, applied_level = self.applied
+        rtt = sample.get("rtt_ms")
+        loss = sample.get("loss") or 0.0
+        estimate = sample.get("estimate_kbps")
+
+        if rtt is not None:
+            self.base_rtt = rtt if self.base_rtt is None else min(self.base_rtt, rtt)
+        rtt_rising = (
+            rtt is not None
+            and self.base_rtt is not None
+            and rtt - self.base_rtt > s["rtt_rise_ms"]
+        )
+
+        bitrate = self.bitrate
+        if loss >= s["heavy_loss_threshold"]:
+            bitrate *= 0.7
+            self.clean_samples = 0
+        elif loss >= s["loss_threshold"] or rtt_rising:
+            bitrate *= 0.85
+            self.clean_samples = 0
+        else:
+            self.clean_samples += 1
+            if self.clean_samples >= s["increase_after"]:
+                bitrate = bitrate * 1.08 + 100
+
+        # Never push past what the receiver says the path can carry
+        if estimate:
+            bitrate = min(bitrate, estimate * 0.95)
+        self.bitrate = self._clamp(bitrate)
+
+        # Resolution follows the bitrate, with hysteresis between steps
+        if (
+            self.level < len(self.ladder) - 1
+            and self._bits_per_pixel(self.bitrate, self.resolution) < MIN_BITS_PER_PIXEL
+        ):
+            self.level += 1
+            self.clean_samples = 0
+        elif (
+            self.level > 0
+            and self.clean_samples >= s["resolution_up_after"]
+            and self._bits_per_pixel(self.bitrate, self.ladder[self.level - 1])
+            >= STEP_UP_BITS_PER_PIXEL
+        ):
+            self.level -= 1
+            self.clean_samples = 0
+
+        # Small drifts accumulate here until they are worth an encoder update
+        if self.level != applied_level or abs(self.bitrate - applied_bitrate) >= max(
+            50, applied_bitrate * 0.05
+        ):
+            self.applied = (self.bitrate, self.level)
+            return {"bitrate": self.bitrate, "resolution": self.resolution}
+        return None
+
+
+def load_trace(path):
+    """Read a JSONL stats trace"""
+    samples = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                samples.append(json.loads(line))
+    return samples
+
+
+def replay(samples, settings=None, bitrate=None):
+    """Run the controller over a recorded trace and summarise the result"""
+    controller = BitrateController(settings, bitrate=bitrate)
+    timeline = []
+    changes = 0
+    over_estimate = 0
+    started = time.perf_counter()
+
+    for sample in samples:
+        if controller.update(sample):
+            changes += 1
+        estimate = sample.get("estimate_kbps")
+        if estimate and controller.bitrate > estimate:
+            over_estimate += 1
+        timeline.append(
+            {
+                "t": sample.get("t"),
+                "bitrate": controller.bitrate,
+                "resolution": controller.resolution,
+                "loss": sample.get("loss"),
+                "rtt_ms": sample.get("rtt_ms"),
+            }
+        )
+
+    elapsed = time.perf_counter() - started
+    bitrates = [point["bitrate"] for point in timeline] or [0]
+    return {
+        "samples": len(samples),
+        "changes": changes,
+        "mean_bitrate": sum(bitrates) / len(bitrates),
+        "min_bitrate": min(bitrates),
+        "max_bitrate": max(bitrates),
+        "over_estimate_fraction": over_estimate / len(samples) if samples else 0,
+        "resolutions": sorted({point["resolution"] for point in timeline}),
+        "update_us": elapsed / len(samples) * 1e6 if samples else 0,
+        "timeline": timeline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Adaptive bitrate controller")
+    sub = parser.add_subparsers(dest="command", required=True)
+    replay_parser = sub.add_parser("replay", help="replay recorded stats traces")
+    replay_parser.add_argument("traces", nargs="+", type=Path)
+    replay_parser.add_argument("--min-bitrate", type=int)
+    replay_parser.add_argument("--max-bitrate", type=int)
+    replay_parser.add_argument("--max-resolution")
+    replay_parser.add_argument("--fps", type=int)
+    replay_parser.add_argument(
+        "--timeline", action="store_true", help="include the per-sample timeline"
+    )
+    args = parser.parse_args()
+
+    settings = {
+        key: getattr(args, key)
+        for key in ("min_bitrate", "max_bitrate", "max_resolution", "fps")
+        if getattr(args, key) is not None
+    }
+    results = {}
+    for trace in args.traces:
+        result = replay(load_trace(trace), settings)
+        if not args.timeline:
+            result.pop("timeline")
+        results[str(trace)] = result
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Encoder benchmark for the streaming presets
+
+Runs each preset's encoder (with the same properties the pipeline builder
+uses) over a deterministic videotestsrc pattern or a recorded Y4M clip at
+the configured resolution, FPS and bitrate, and reports JSON:
+encode FPS, per-frame encoder latency percentiles, CPU% per core, peak RSS
+and PSNR/SSIM of the encoded stream against the source.
+
+    python3 benchmark.py                          # every preset, 600 frames
+    python3 benchmark.py vp9 --set vp9:cpu-used=6 --set vp9:threads=2
+    python3 benchmark.py av1-optiplex --clip gameplay.y4m --realtime
+"""
+
+import argparse
+import json
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import psutil
+
+import pipeline_builder
+from gst_engine import GST_AVAILABLE, Gst
+
+DEFAULT_CONFIG = {
+    "resolution": "1280x720",
+    "fps": 60,
+    "bitrate": 5000,
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def build_source(config, frames, clip=None, realtime=False, pattern="smpte"):
+    """Deterministic raw I420 source at the configured size and rate"""
+    width, height = pipeline_builder.parse_resolution(config["resolution"])
+    caps = (
+        f"video/x-raw,format=I420,width={width},height={height},"
+        f"framerate={int(config['fps'])}/1"
+    )
+    if clip:
+        source = f"filesrc location={shlex.quote(str(clip))} ! y4mdec"
+        if realtime:
+            source += " ! identity sync=true"
+        return f"{source} ! videoscale ! videorate ! videoconvert ! {caps}"
+    return (
+        f"videotestsrc num-buffers={frames} pattern={pattern} "
+        f"is-live={'true' if realtime else 'false'} ! {caps}"
+    )
+
+
+def build_encode_pipeline(script_id, config, source, output_path, overrides=None):
+    """Source -> encoder (preset settings) -> Matroska file"""
+    encoder = pipeline_builder.ENCODERS[script_id]
+    properties = {
+        **pipeline_builder.encoder_properties(script_id, config),
+        **(overrides or {}),
+    }
+    elements = [source]
+    if encoder["format"] != "I420":
+        elements.append(f"videoconvert ! video/x-raw,format={encoder['format']}")
+    elements.append(
+        f"{encoder['element']} name=venc "
+        f"{pipeline_builder.format_properties(properties)}"
+    )
+    if encoder["parser"]:
+        elements.append(encoder["parser"])
+    elements.append(f"matroskamux ! filesink location={shlex.quote(str(output_path))}")
+    return " ! ".join(elements)
+
+
+class LatencyProbe:
+    """Per-frame time spent inside the encoder, matched by PTS"""
+
+    def __init__(self, encoder):
+        self.pending = {}
+        self.latencies = []
+        self.frames_in = 0
+        encoder.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self._in)
+        encoder.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._out)
+
+    def _in(self, pad, info):
+        self.frames_in += 1
+        self.pending[info.get_buffer().pts] = time.perf_counter()
+        return Gst.PadProbeReturn.OK
+
+    def _out(self, pad, info):
+        started = self.pending.pop(info.get_buffer().pts, None)
+        if started is not None:
+            self.latencies.append((time.perf_counter() - started) * 1000)
+        return Gst.PadProbeReturn.OK
+
+
+class ResourceSampler(threading.Thread):
+    """Tracks peak RSS of this process while the encode runs"""
+
+    def __init__(self, interval=0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak_rss = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+
+def run_encode(description):
+    """Play a pipeline to EOS and measure it"""
+    pipeline = Gst.parse_launch(description)
+    probe = LatencyProbe(pipeline.get_by_name("venc"))
+    process = psutil.Process()
+    sampler = ResourceSampler()
+
+    psutil.cpu_percent(percpu=True)
+    cpu_before = process.cpu_times()
+    sampler.start()
+    started = time.perf_counter()
+    pipeline.set_state(Gst.State.PLAYING)
+
+    message = pipeline.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR
+    )
+    elapsed = time.perf_counter() - started
+    per_core = psutil.cpu_percent(percpu=True)
+    cpu_after = process.cpu_times()
+    sampler.stop()
+    pipeline.set_state(Gst.State.NULL)
+
+    if message.type == Gst.MessageType.ERROR:
+        err, _ = message.parse_error()
+        raise RuntimeError(err.message)
+
+    process_cpu = (cpu_after.user - cpu_before.user) + (
+        cpu_after.system - cpu_before.system
+    )
+    return {
+        "frames": probe.frames_in,
+        "seconds": round(elapsed, 3),
+        "encode_fps": round(probe.frames_in / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            f"p{pct}": round(percentile(probe.latencies, pct), 2)
+            for pct in (50, 90, 95, 99)
+            if probe.latencies
+        },
+        "cpu_percent_per_core": per_core,
+        "process_cpu_percent": round(process_cpu / elapsed * 100, 1),
+        "peak_rss_mb": round(sampler.peak_rss / 1024 / 1024, 1),
+    }
+
+
+def measure_quality(reference_source, encoded_path):
+    """PSNR/SSIM of the encoded file against the regenerated source"""
+    reference = subprocess.Popen(
+        ["gst-launch-1.0", "-q"]
+        + shlex.split(f"{reference_source} ! y4menc ! fdsink fd=1"),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    result = subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-i",
+            str(encoded_path),
+            "-f",
+            "yuv4mpegpipe",
+            "-i",
+            "pipe:0",
+            "-lavfi",
+            "[0:v]split[a][b];[1:v]split[c][d];[a][c]psnr;[b][d]ssim",
+            "-f",
+            "null",
+            "-",
+        ],
+        stdin=reference.stdout,
+        capture_output=True,
+        text=True,
+    )
+    reference.stdout.close()
+    reference.wait()
+
+    quality = {"psnr": None, "ssim": None}
+    match = re.search(r"PSNR .*average:([\d.]+|inf)", result.stderr)
+    if match:
+        quality["psnr"] = float(match.group(1))
+    match = re.search(r"SSIM .*All:([\d.]+)", result.stderr)
+    if match:
+        quality["ssim"] = float(match.group(1))
+    return quality
+
+
+def benchmark_preset(script_id, config, args, overrides, workdir):
+    encoder = pipeline_builder.ENCODERS[script_id]
+    if Gst.ElementFactory.find(encoder["element"]) is None:
+        return {"skipped": f"{encoder['element']} not available"}
+
+    source = build_source(config, args.frames, args.clip, args.realtime)
+    output = Path(workdir) / f"{script_id}.mkv"
+    result = {
+        "encoder": encoder["element"],
+        "properties": {**encoder["properties"], **overrides},
+        **config,
+    }
+    try:
+        result.update(
+            run_encode(
+                build_encode_pipeline(script_id, config, source, output, overrides)
+            )
+        )
+        seconds = result["frames"] / int(config["fps"])
+        result["bitrate_kbps"] = (
+            round(output.stat().st_size * 8 / seconds / 1000, 1) if seconds else None
+        )
+        if not args.no_quality:
+            result.update(
+                measure_quality(build_source(config, args.frames, args.clip), output)
+            )
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def parse_overrides(values):
+    """--set vp9:cpu-used=6 -> {"vp9": {"cpu-used": "6"}}"""
+    overrides = {}
+    for value in values:
+        script_id, _, assignment = value.partition(":")
+        key, _, prop_value = assignment.partition("=")
+        if not key or not prop_value:
+            raise ValueError(f"Expected <preset>:<property>=<value>, got {value}")
+        overrides.setdefault(script_id, {})[key] = prop_value
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the encoder presets")
+    parser.add_argument(
+        "presets",
+        nargs="*",
+        help=f"presets to run (default: all of {', '.join(pipeline_builder.ENCODERS)})",
+    )
+    parser.add_argument("--config", type=Path, help="stream_config.json to read")
+    parser.add_argument("--resolution")
+    parser.add_argument("--fps", type=int)
+    parser.add_argument("--bitrate", type=int)
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--clip", type=Path, help="Y4M clip instead of videotestsrc")
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="feed frames at the configured FPS (CPU at real load) "
+        "instead of as fast as possible",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="PRESET:PROPERTY=VALUE",
+        help="override an encoder property, e.g. vp9:cpu-used=6",
+    )
+    parser.add_argument("--no-quality", action="store_true", help="skip PSNR/SSIM")
+    parser.add_argument("--output", type=Path, help="write JSON here too")
+    args = parser.parse_args()
+
+    if not GST_AVAILABLE:
+        print("ERROR: PyGObject with GStreamer 1.0 introspection is required")
+        return 1
+
+    config = dict(DEFAULT_CONFIG)
+    if args.config and args.config.exists():
+        config.update(
+            {
+                k: v
+                for k, v in json.loads(args.config.read_text()).items()
+                if k in DEFAULT_CONFIG
+            }
+        )
+    for key in DEFAULT_CONFIG:
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+
+    overrides = parse_overrides(args.set)
+    presets = args.presets or sorted(pipeline_builder.ENCODERS)
+    unknown = [p for p in presets if p not in pipeline_builder.ENCODERS]
+    if unknown:
+        parser.error(f"unknown presets: {', '.join(unknown)}")
+    report = {
+        "host": {
+            "cpu_count": psutil.cpu_count(),
+            "cpu_freq_mhz": getattr(psutil.cpu_freq(), "current", None),
+        },
+        "source": str(args.clip) if args.clip else "videotestsrc",
+        "realtime": args.realtime,
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="stream-bench-") as workdir:
+        for script_id in presets:
+            print(f"Benchmarking {script_id}...", file=sys.stderr)
+            report["results"][script_id] = benchmark_preset(
+                script_id, config, args, overrides.get(script_id, {}), workdir
+            )
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        args.output.write_text(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
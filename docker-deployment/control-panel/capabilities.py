@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Capability probe for the streaming presets
+
+Finds out once which GStreamer elements are installed, which encoders
+actually work (hardware encoders get a two-frame test encode, so a VA-API
+or NVENC element without a usable device counts as unavailable) and what
+modes the capture device offers. The result is cached on disk keyed by the
+GStreamer registry and plugin directory mtimes plus the capture device, so
+stream starts skip gst-inspect and v4l2-ctl entirely and the probe only
+runs again when plugins change.
+
+    python3 capabilities.py                # probe (or load the cache) and print
+    python3 capabilities.py --force        # ignore the cache
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pipeline_builder
+
+CACHE_VERSION = 3
+
+# Elements every preset needs besides its encoder chain
+COMMON_ELEMENTS = [
+    "v4l2src",
+    "videoconvert",
+    "videoscale",
+    "videorate",
+    "whipclientsink",
+    "pulsesrc",
+    "audioconvert",
+    "audioresample",
+    "opusenc",
+    "rtpopuspay",
+]
+
+PLUGIN_DIRS = [
+    "/usr/lib/x86_64-linux-gnu/gstreamer-1.0",
+    "/usr/lib/aarch64-linux-gnu/gstreamer-1.0",
+    "/usr/lib64/gstreamer-1.0",
+    "/usr/lib/gstreamer-1.0",
+    "/usr/local/lib/gstreamer-1.0",
+]
+
+# `gst-inspect-1.0` lines: "plugin:  element: Long name"
+_INSPECT_LINE = re.compile(r"^(?P<plugin>[\w-]+):\s+(?P<element>[\w-]+):\s")
+
+
+def registry_paths():
+    """Registry file(s) and plugin directories GStreamer loads from"""
+    paths = []
+    for variable in ("GST_REGISTRY_1_0", "GST_REGISTRY"):
+        if os.environ.get(variable):
+            paths.append(os.environ[variable])
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    paths += glob.glob(os.path.join(cache, "gstreamer-1.0", "registry.*.bin"))
+    for variable in (
+        "GST_PLUGIN_PATH_1_0",
+        "GST_PLUGIN_PATH",
+        "GST_PLUGIN_SYSTEM_PATH",
+    ):
+        paths += [p for p in os.environ.get(variable, "").split(os.pathsep) if p]
+    return paths + PLUGIN_DIRS
+
+
+def cache_key(device=pipeline_builder.VIDEO_DEVICE):
+    """Changes whenever plugins are (un)installed or the device is replugged"""
+    mtimes = {}
+    for path in registry_paths() + [device, "/dev/dri"]:
+        try:
+            mtimes[path] = os.stat(path).st_mtime
+        except OSError:
+            continue
+    return {"version": CACHE_VERSION, "device": device, "mtimes": mtimes}
+
+
+def parse_inspect(output):
+    """Element names from `gst-inspect-1.0` (no arguments) output"""
+    elements = set()
+    for line in output.splitlines():
+        match = _INSPECT_LINE.match(line)
+        if match:
+            elements.add(match.group("element"))
+    return elements
+
+
+def list_elements():
+    """Every installed element, from one gst-inspect run"""
+    try:
+        result = subprocess.run(
+            ["gst-inspect-1.0"], capture_output=True, text=True, timeout=60
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return set()
+    return parse_inspect(result.stdout)
+
+
+def encoder_chain(encoder):
+    """Element names one ENCODERS entry needs"""
+    chain = [encoder["element"], encoder["payloader"].split()[0]]
+    if encoder["parser"]:
+        chain.append(encoder["parser"])
+    return chain
+
+
+def test_encode(encoder, timeout=15):
+    """Encode two small frames; returns None when it works, else the error"""
+    description = (
+        f"videotestsrc num-buffers=2 ! "
+        f"video/x-raw,format={encoder['format']},width=320,height=240 ! "
+        f"{encoder['element']} ! fakesink"
+    )
+    try:
+        result = subprocess.run(
+            ["gst-launch-1.0", "-q"] + description.split(),
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return "test encode timed out"
+    except OSError as e:
+        return str(e)
+    if result.returncode == 0:
+        return None
+    lines = (result.stderr or result.stdout).strip().splitlines()
+    return lines[0] if lines else f"exit code {result.returncode}"
+
+
+def probe(hardware=(), device=pipeline_builder.VIDEO_DEVICE):
+    """Full probe; hardware lists the ENCODERS ids that need a test encode"""
+    started = time.perf_counter()
+    elements = list_elements()
+    missing_common = [name for name in COMMON_ELEMENTS if name not in elements]
+
+    encoders = {}
+    for script_id, encoder in pipeline_builder.ENCODERS.items():
+        missing = [name for name in encoder_chain(encoder) if name not in elements]
+        if missing:
+            encoders[script_id] = {
+                "available": False,
+                "reason": "missing " + ", ".join(missing),
+            }
+            continue
+        error = test_encode(encoder) if script_id in hardware else None
+        encoders[script_id] = {"available": error is None, "reason": error}
+
+    return {
+        "key": cache_key(device),
+        "probed_at": time.time(),
+        "probe_seconds": round(time.perf_counter() - started, 3),
+        # False when gst-inspect itself failed; nothing here is known then
+        "ok": bool(elements),
+        "elements": sorted(elements),
+        "missing_common": missing_common,
+        "encoders": encoders,
+        # Device-memory scale/convert paths (pipeline_builder.HARDWARE_PATHS)
+        "hardware_paths": {
+            name: all(element in elements for element in path["requires"])
+            for name, path in pipeline_builder.HARDWARE_PATHS.items()
+        },
+        "vaapi": bool(glob.glob("/dev/dri/renderD*"))
+        and any(e["available"] for i, e in encoders.items() if "vaapi" in i),
+        "nvenc": os.path.exists("/dev/nvidia0")
+        and any(e["available"] for i, e in encoders.items() if "nvenc" in i),
+        "device": device,
+        "device_modes": pipeline_builder.list_device_modes(device),
+    }
+
+
+def load(cache_file, device=pipeline_builder.VIDEO_DEVICE):
+    """Cached probe result, or None when missing or stale"""
+    try:
+        cached = json.loads(Path(cache_file).read_text())
+    except (OSError, ValueError):
+        return None
+    if cached.get("key") != cache_key(device):
+        return None
+    return cached
+
+
+def get(cache_file, hardware=(), device=pipeline_builder.VIDEO_DEVICE, force=False):
+    """Cached result if still valid, else probe and store"""
+    cached = None if force else load(cache_file, device)
+    if cached is not None:
+        return cached
+    result = probe(hardware, device)
+    tmp = Path(f"{cache_file}.tmp")
+    tmp.write_text(json.dumps(result, indent=2))
+    tmp.replace(cache_file)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Probe streaming capabilities")
+    parser.add_argument("--cache", default="/app/config/capabilities.json")
+    parser.add_argument("--device", default=pipeline_builder.VIDEO_DEVICE)
+    parser.add_argument("--force", action="store_true", help="ignore the cache")
+    parser.add_argument(
+        "--hardware",
+        nargs="*",
+        default=["h264-vaapi", "av1-vaapi", "h264-nvenc", "av1-nvenc"],
+        help="encoders to test-encode",
+    )
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    result = get(args.cache, args.hardware, args.device, args.force)
+    summary = {
+        "seconds": round(time.perf_counter() - started, 3),
+        "probe_seconds": result["probe_seconds"],
+        "encoders": result["encoders"],
+        "missing_common": result["missing_common"],
+        "vaapi": result["vaapi"],
+        "nvenc": result["nvenc"],
+        "hardware_paths": result["hardware_paths"],
+        "device_modes": len(result["device_modes"]),
+    }
+    print(json.dumps(summary, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Stream start/stop/restart cycle benchmark
+
+Drives the control panel API through start -> live -> stop cycles and
+reports how long each step takes: the start request, the time until
+Broadcast Box receives media for the stream key, the stop request (which
+returns once the pipeline has drained) and a restart. Run it against an
+idle panel; it changes the stream state.
+
+    python3 cycletest.py --url http://localhost:8081 --cycles 5
+    python3 cycletest.py --script vp9 --cycles 10 --output cycles.json
+    python3 cycletest.py --no-cache     # starts with the full pre-flight checks
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import requests
+
+import supervisor
+from loadtest import percentile
+
+
+def timed_post(base_url, path, body=None):
+    started = time.perf_counter()
+    response = requests.post(base_url + path, json=body or {}, timeout=60)
+    response.raise_for_status()
+    return (time.perf_counter() - started) * 1000, response.json()
+
+
+def wait_live(server_url, stream_key, timeout):
+    """ms until Broadcast Box receives new packets for stream_key, or None.
+
+    Broadcast Box keeps reporting the previous session's counters for a
+    while after a restart, so a non-zero count proves nothing: the first
+    poll is the baseline and the stream is live once the count rises.
+    """
+    started = time.perf_counter()
+    deadline = time.time() + timeout
+    previous = None
+    while time.time() < deadline:
+        try:
+            info = requests.get(server_url, timeout=2).json()
+        except (requests.exceptions.RequestException, ValueError):
+            info = None
+        packets = supervisor.server_progress(info, stream_key)
+        if packets is not None and previous is not None and packets > previous:
+            return (time.perf_counter() - started) * 1000
+        if packets is not None:
+            previous = packets
+        time.sleep(0.05)
+    return None
+
+
+def summarize(values):
+    values = [value for value in values if value is not None]
+    return {
+        "samples": len(values),
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "max_ms": round(max(values), 2) if values else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start/stop cycle benchmark")
+    parser.add_argument("--url", default="http://localhost:8081")
+    parser.add_argument(
+        "--server",
+        default="http://localhost:8080/api/status",
+        help="Broadcast Box status URL, to time until media arrives",
+    )
+    parser.add_argument("--script", help="preset to start (default: saved config)")
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--live-timeout", type=float, default=20)
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="start without the cached capability probe (plugin checks, "
+        "device probing), to compare time-to-first-frame",
+    )
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip("/")
+    config = requests.get(base_url + "/api/config", timeout=5).json()
+    script_id = args.script or config.get("selected_script", "vp9")
+    stream_key = config.get("stream_key", "gaming")
+    config["capability_cache"] = not args.no_cache
+
+    samples = {"start": [], "live": [], "stop": [], "restart": [], "restart_live": []}
+    shutdowns = {}
+    failures = []
+    timed_post(base_url, "/api/stream/stop")
+    for cycle in range(args.cycles):
+        print(f"cycle {cycle + 1}/{args.cycles}...", file=sys.stderr)
+        ms, result = timed_post(
+            base_url, "/api/stream/start", {"script_id": script_id, "config": config}
+        )
+        if not result.get("success"):
+            failures.append(result.get("error"))
+            continue
+        samples["start"].append(ms)
+        samples["live"].append(wait_live(args.server, stream_key, args.live_timeout))
+
+        ms, result = timed_post(base_url, "/api/stream/restart")
+        samples["restart"].append(ms)
+        samples["restart_live"].append(
+            wait_live(args.server, stream_key, args.live_timeout)
+        )
+
+        ms, result = timed_post(base_url, "/api/stream/stop")
+        samples["stop"].append(ms)
+        how = (result.get("stop") or {}).get("how")
+        shutdowns[how] = shutdowns.get(how, 0) + 1
+
+    report = {
+        "url": args.url,
+        "script_id": script_id,
+        "cycles": args.cycles,
+        "capability_cache": not args.no_cache,
+        "failures": failures,
+        # eos = drained cleanly; sigterm/sigkill = EOS timed out
+        "shutdowns": shutdowns,
+        **{step: summarize(values) for step, values in samples.items()},
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
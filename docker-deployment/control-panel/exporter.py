@@ -0,0 +1,67 @@
+"""
+Prometheus text exposition for the control panel's /metrics endpoint
+
+The control panel's sampler fills an Exposition on its own cadence and
+keeps the rendered text, so a scrape only returns a string.
+"""
+
+import re
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "streamer_"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return repr(value) if value == value else "NaN"
+    return str(value)
+
+
+class Exposition:
+    """Metric families collected for one scrape"""
+
+    def __init__(self):
+        self.families = {}
+
+    def add(self, name, kind, help_text, value, **labels):
+        """Add a sample; None values are skipped so absent data stays absent"""
+        name = PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+        family = self.families.setdefault(
+            name, {"kind": kind, "help": help_text, "samples": []}
+        )
+        if value is not None:
+            family["samples"].append((labels, value))
+
+    def render(self):
+        lines = []
+        for name, family in self.families.items():
+            if not family["samples"]:
+                continue
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['kind']}")
+            for labels, value in family["samples"]:
+                label_text = ",".join(
+                    f'{key}="{_escape(val)}"' for key, val in sorted(labels.items())
+                )
+                series = f"{name}{{{label_text}}}" if label_text else name
+                lines.append(f"{series} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def count_viewers(stream_info):
+    """WHEP sessions per stream key from Broadcast Box's /api/status"""
+    viewers = {}
+    if not isinstance(stream_info, list):
+        return viewers
+    for stream in stream_info:
+        if not isinstance(stream, dict):
+            continue
+        key = stream.get("streamKey", "")
+        viewers[key] = viewers.get(key, 0) + len(stream.get("whepSessions") or [])
+    return viewers
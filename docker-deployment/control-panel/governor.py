@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+CPU/thermal governor for the live encoder
+
+Watches CPU load, the thermal zones in /sys/class/thermal and whether the
+encoder keeps up with the target frame rate, and steps the running
+pipeline down a per-preset ladder (faster encoder settings, then lower
+FPS, then lower resolution) while it is under pressure, and back up once
+it has been comfortable for a while.
+
+Ladders are configured per preset ("ladder" in STREAMING_SCRIPTS).
+
+Replay a recorded sample trace (JSONL, one sample per line):
+    python3 governor.py replay samples.jsonl --ladder ladder.json
+    python3 governor.py thermal
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+from pathlib import Path
+
+DEFAULT_SETTINGS = {
+    # Average CPU% over all cores that counts as pressure / as comfortable
+    "cpu_high": 90,
+    "cpu_low": 65,
+    # Busiest single core: a saturated encoder thread
+    "cpu_core_high": 99,
+    # Hottest thermal zone, degrees C
+    "temp_high": 85,
+    "temp_low": 75,
+    # Encoded FPS / target FPS below which the encoder is falling behind
+    "fps_ratio_low": 0.9,
+    "fps_ratio_ok": 0.98,
+    # Consecutive samples under pressure before a step down, and
+    # consecutive comfortable samples before a step back up
+    "down_after": 3,
+    "up_after": 30,
+}
+
+# Rungs below the configured settings, applied cumulatively. "encoder" holds
+# encoder element properties; "fps" and "resolution" are output settings.
+# This one only touches the output, for encoders without CPU-side knobs.
+DEFAULT_LADDER = [
+    {"fps": 48},
+    {"fps": 30},
+    {"resolution": "960x540"},
+]
+
+
+def read_thermal(root="/sys/class/thermal"):
+    """{zone type: degrees C} for every readable thermal zone"""
+    zones = {}
+    for zone in sorted(glob.glob(os.path.join(root, "thermal_zone*"))):
+        try:
+            with open(os.path.join(zone, "temp")) as f:
+                millidegrees = int(f.read().strip())
+            with open(os.path.join(zone, "type")) as f:
+                name = f.read().strip()
+        except (OSError, ValueError):
+            continue
+        key = name if name not in zones else f"{name}-{os.path.basename(zone)}"
+        zones[key] = millidegrees / 1000
+    return zones
+
+
+def level_settings(ladder, level, base):
+    """Settings for a ladder level: base overridden by rungs 1..level.
+
+    base is {"fps", "resolution", "encoder": {...}}; every encoder
+    property any rung touches is included, so stepping back up restores it.
+    """
+    encoder_keys = {key for rung in ladder for key in rung.get("encoder", {})}
+    target = {
+        "fps": base["fps"],
+        "resolution": base["resolution"],
+        "encoder": {
+            key: base["encoder"][key] for key in encoder_keys if key in base["encoder"]
+        },
+    }
+    for rung in ladder[:level]:
+        target["encoder"].update(rung.get("encoder", {}))
+        if "fps" in rung:
+            target["fps"] = min(target["fps"], rung["fps"])
+        # Never scale up past the configured resolution
+        if "resolution" in rung and _height(rung["resolution"]) < _height(
+            target["resolution"]
+        ):
+            target["resolution"] = rung["resolution"]
+    return target
+
+
+def usable_ladder(ladder, controls):
+    """The ladder without what the running pipeline cannot change live.
+
+    controls is StreamEngine.live_controls(): the encoder properties that
+    are mutable while PLAYING, and whether fps/resolution can change. A
+    rung left with nothing to apply is dropped, so a step down always
+    changes something.
+    """
+    usable = []
+    for rung in ladder:
+        kept = {}
+        encoder = {
+            key: value
+            for key, value in rung.get("encoder", {}).items()
+            if key in controls["encoder"]
+        }
+        if encoder:
+            kept["encoder"] = encoder
+        for key in ("fps", "resolution"):
+            if key in rung and controls[key]:
+                kept[key] = rung[key]
+        if kept:
+            usable.append(kept)
+    return usable
+
+
+def _height(resolution):
+    return int(resolution.split("x")[1])
+
+
+class Governor:
+    """Hysteresis over pressure samples; level 0 is the configured quality.
+
+    Each update() takes one sample ({"cpu", "cpu_core", "temp",
+    "fps_ratio"}, any may be None) and returns (direction, reason) when the level changed,
+    otherwise None.
+    """
+
+    def __init__(self, ladder, settings=None):
+        self.ladder = ladder
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.level = 0
+        self.pressure_samples = 0
+        self.calm_samples = 0
+
+    def _pressure(self, sample):
+        s = self.settings
+        reasons = []
+        if (sample.get("cpu") or 0) >= s["cpu_high"]:
+            reasons.append(f"cpu {sample['cpu']:.0f}%")
+        if (sample.get("cpu_core") or 0) >= s["cpu_core_high"]:
+            reasons.append(f"busiest core {sample['cpu_core']:.0f}%")
+        if (sample.get("temp") or 0) >= s["temp_high"]:
+            reasons.append(f"temp {sample['temp']:.0f}C")
+        ratio = sample.get("fps_ratio")
+        if ratio is not None and ratio < s["fps_ratio_low"]:
+            reasons.append(f"encoding at {ratio:.0%} of target fps")
+        return reasons
+
+    def _calm(self, sample):
+        s = self.settings
+        ratio = sample.get("fps_ratio")
+        return (
+            (sample.get("cpu") or 0) <= s["cpu_low"]
+            and (sample.get("temp") or 0) <= s["temp_low"]
+            and (ratio is None or ratio >= s["fps_ratio_ok"])
+        )
+
+    def update(self, sample):
+        reasons = self._pressure(sample)
+        if reasons:
+            self.pressure_samples += 1
+            self.calm_samples = 0
+        elif self._calm(sample):
+            self.calm_samples += 1
+            self.pressure_samples = 0
+        else:
+            # Between the thresholds: hold the level
+            self.pressure_samples = 0
+            self.calm_samples = 0
+
+        if self.pressure_samples >= self.settings["down_after"] and self.level < len(
+            self.ladder
+        ):
+            self.level += 1
+            self.pressure_samples = 0
+            return "down", ", ".join(reasons)
+        if self.calm_samples >= self.settings["up_after"] and self.level > 0:
+            self.level -= 1
+            self.calm_samples = 0
+            return "up", "headroom recovered"
+        return None
+
+
+def replay(samples, ladder, settings=None):
+    """Run the governor over a recorded trace and summarise the result"""
+    governor = Governor(ladder, settings)
+    steps = []
+    for sample in samples:
+        change = governor.update(sample)
+        if change:
+            direction, reason = change
+            steps.append(
+                {
+                    "t": sample.get("t"),
+                    "level": governor.level,
+                    "direction": direction,
+                    "reason": reason,
+                }
+            )
+    return {
+        "samples": len(samples),
+        "steps": steps,
+        "final_level": governor.level,
+        "max_level": max([step["level"] for step in steps] or [0]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU/thermal governor")
+    sub = parser.add_subparsers(dest="command", required=True)
+    replay_parser = sub.add_parser("replay", help="replay recorded samples")
+    replay_parser.add_argument("traces", nargs="+", type=Path)
+    replay_parser.add_argument(
+        "--ladder", type=Path, help="JSON list of rungs (default: fps/resolution)"
+    )
+    sub.add_parser("thermal", help="print the thermal zones")
+    args = parser.parse_args()
+
+    if args.command == "thermal":
+        print(json.dumps(read_thermal(), indent=2))
+        return 0
+    ladder = DEFAULT_LADDER
+    if args.ladder:
+        ladder = json.loads(args.ladder.read_text())
+    results = {}
+    for trace in args.traces:
+        with open(trace) as f:
+            samples = [json.loads(line) for line in f if line.strip()]
+        results[str(trace)] = replay(samples, ladder)
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
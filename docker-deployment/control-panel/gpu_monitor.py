@@ -0,0 +1,109 @@
+"""
+Long-running NVIDIA GPU reader
+
+Keeps one `nvidia-smi --loop` process (or NVML, when pynvml is installed)
+open and remembers the latest reading, instead of forking nvidia-smi for
+every stats request.
+"""
+
+import subprocess
+import threading
+import time
+
+try:
+    import pynvml
+
+    NVML_AVAILABLE = True
+except ImportError:
+    pynvml = None
+    NVML_AVAILABLE = False
+
+QUERY = "index,name,utilization.gpu,temperature.gpu"
+
+
+def parse_line(line):
+    """One `nvidia-smi --format=csv,noheader,nounits` line -> (index, info)"""
+    parts = [part.strip() for part in line.split(",")]
+    if len(parts) != 4:
+        return None
+    try:
+        return int(parts[0]), {
+            "name": parts[1],
+            "utilization": int(parts[2]),
+            "temperature": int(parts[3]),
+        }
+    except ValueError:
+        return None
+
+
+class GpuMonitor(threading.Thread):
+    """Background GPU sampler; latest() never blocks"""
+
+    def __init__(self, interval=2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.readings = {}
+        self.available = True
+
+    def latest(self, index=0):
+        """Most recent reading of one GPU, or None"""
+        return self.readings.get(index)
+
+    def run(self):
+        if NVML_AVAILABLE and self._run_nvml():
+            return
+        self._run_nvidia_smi()
+
+    def _run_nvml(self):
+        try:
+            pynvml.nvmlInit()
+        except pynvml.NVMLError:
+            return False
+        while True:
+            try:
+                for index in range(pynvml.nvmlDeviceGetCount()):
+                    handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+                    name = pynvml.nvmlDeviceGetName(handle)
+                    self.readings[index] = {
+                        "name": name.decode() if isinstance(name, bytes) else name,
+                        "utilization": pynvml.nvmlDeviceGetUtilizationRates(handle).gpu,
+                        "temperature": pynvml.nvmlDeviceGetTemperature(
+                            handle, pynvml.NVML_TEMPERATURE_GPU
+                        ),
+                    }
+            except pynvml.NVMLError as e:
+                print(f"NVML error: {e}")
+            time.sleep(self.interval)
+
+    def _run_nvidia_smi(self):
+        backoff = self.interval
+        while True:
+            try:
+                process = subprocess.Popen(
+                    [
+                        "nvidia-smi",
+                        f"--query-gpu={QUERY}",
+                        "--format=csv,noheader,nounits",
+                        f"--loop={self.interval}",
+                    ],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    text=True,
+                )
+            except FileNotFoundError:
+                # No NVIDIA driver in this container
+                self.available = False
+                return
+
+            for line in process.stdout:
+                parsed = parse_line(line)
+                if parsed:
+                    index, info = parsed
+                    self.readings[index] = info
+                    backoff = self.interval
+            process.wait()
+
+            # nvidia-smi exits on driver resets or when no GPU is present;
+            # keep the last reading and retry with growing delays
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
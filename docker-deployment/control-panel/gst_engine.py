@@ -0,0 +1,985 @@
+#!/usr/bin/env python3
+"""
+In-process GStreamer engine
+
+Runs a pipeline_builder description inside the control panel via PyGObject,
+so bitrate, FPS and output resolution can be changed on the running
+elements instead of restarting gst-launch-1.0 (and renegotiating WebRTC).
+
+A second pipeline can be prepared next to the running one (PAUSED, its
+elements and WHIP sink already set up) and swapped in when the running one
+reaches EOS, for codec switches without a cold start.
+
+Viewers' keyframe requests (PLI/FIR) reach the encoder rate-limited, so
+the periodic keyframe interval can be long.
+
+Self-test with test sources and a fakesink:
+    python3 gst_engine.py --test
+    python3 gst_engine.py --test-switch --script vp9 --to av1-optiplex
+    python3 gst_engine.py --test-keyframes --script vp9 --joiners 10
+"""
+
+import argparse
+import random
+import re
+import sys
+import threading
+import time
+
+import pipeline_builder
+import queue_policy
+
+try:
+    import gi
+
+    gi.require_version("Gst", "1.0")
+    gi.require_version("GstVideo", "1.0")
+    from gi.repository import Gst, GstVideo
+
+    Gst.init(None)
+    GST_AVAILABLE = True
+except (ImportError, ValueError):
+    Gst = GstVideo = None
+    GST_AVAILABLE = False
+
+# Least time between two keyframes produced on request (viewers' PLI/FIR)
+KEYFRAME_MIN_INTERVAL = 1.0
+
+# The fixed queue every preset used before queue_policy, for comparison
+FIXED_VIDEO_QUEUE = "queue max-size-buffers=5 max-size-time=500000000 max-size-bytes=0"
+
+
+def structure_to_dict(structure):
+    """Convert a (nested) Gst.Structure into plain Python values"""
+    result = {}
+    for i in range(structure.n_fields()):
+        name = structure.nth_field_name(i)
+        result[name] = _gvalue_to_python(structure.get_value(name))
+    return result
+
+
+def _gvalue_to_python(value):
+    if isinstance(value, Gst.Structure):
+        return structure_to_dict(value)
+    if hasattr(value, "value_nick"):
+        return value.value_nick
+    if isinstance(value, (list, tuple)):
+        return [_gvalue_to_python(v) for v in value]
+    return value
+
+
+def resized_caps(caps, width, height):
+    """caps with a new size, keeping the memory feature and format"""
+    text = caps.to_string() if caps is not None else "video/x-raw"
+    for field, value in (("width", width), ("height", height)):
+        text, found = re.subn(rf"{field}=\(int\)\d+", f"{field}=(int){value}", text)
+        if not found:
+            text += f", {field}=(int){value}"
+    return Gst.Caps.from_string(text)
+
+
+class StreamEngine:
+    """Owns one in-process pipeline and its bus watcher thread"""
+
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self.pipeline = None
+        self.script_id = None
+        self.params = {}
+        self.started_at = None
+        self.error = None
+        self._lock = threading.RLock()
+        self._bus_thread = None
+        self._eos = threading.Event()
+        self._frames = None
+        self._keyframes = None
+        self.keyframe_min_interval = KEYFRAME_MIN_INTERVAL
+        self._stopping = False
+        # Queue policy and encoder latency the running pipeline's queues
+        # were sized for, to resize them when the FPS or bitrate changes
+        self.queue_sizing = None
+        # Prepared next pipeline: (script_id, pipeline, params, queue_sizing)
+        self.standby = None
+        # Called from the bus thread with a reason when the pipeline errors
+        # out or ends on its own (not through stop())
+        self.on_failure = None
+
+    @property
+    def running(self):
+        return self.pipeline is not None
+
+    def log(self, message):
+        """Append a line to the stream log, like gst-launch output"""
+        line = f"[engine] {message}"
+        if self.log_path is None:
+            print(line)
+            return
+        with open(self.log_path, "a") as f:
+            f.write(line + "\n")
+
+    def start(self, script_id, description, config):
+        """Parse and play a pipeline description"""
+        if not GST_AVAILABLE:
+            raise RuntimeError("PyGObject/GStreamer introspection not available")
+
+        with self._lock:
+            self.stop()
+            pipeline = Gst.parse_launch(description)
+            self.pipeline = pipeline
+            self.script_id = script_id
+            self.params = {
+                "bitrate": int(config["bitrate"]),
+                "fps": int(config["fps"]),
+                "resolution": config["resolution"],
+            }
+            self.queue_sizing = queue_sizing(script_id, config)
+            self.error = None
+            self._eos.clear()
+            self._stopping = False
+
+            self._bus_thread = threading.Thread(
+                target=self._watch_bus, args=(pipeline,), daemon=True
+            )
+            self._bus_thread.start()
+            self._frames = FrameCounter(pipeline.get_by_name("venc"))
+            self.keyframe_min_interval = float(
+                config.get("keyframe_min_interval", KEYFRAME_MIN_INTERVAL)
+            )
+            self._keyframes = KeyframeGate(
+                pipeline.get_by_name("venc"), self.keyframe_min_interval
+            )
+
+            if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+                self.stop()
+                raise RuntimeError("Pipeline failed to start")
+            self.started_at = time.time()
+            self.log(f"Pipeline started ({script_id})")
+
+    def prepare(self, script_id, description, config):
+        """Build the next pipeline and take it to PAUSED next to the running one.
+
+        Live sources do not preroll, so PAUSED means every element is
+        created and opened (encoder, shm/capture source, WHIP sink) but no
+        frames flow until swap().
+        """
+        if not GST_AVAILABLE:
+            raise RuntimeError("PyGObject/GStreamer introspection not available")
+        with self._lock:
+            self.discard_standby()
+            pipeline = Gst.parse_launch(description)
+            if pipeline.set_state(Gst.State.PAUSED) == Gst.StateChangeReturn.FAILURE:
+                pipeline.set_state(Gst.State.NULL)
+                raise RuntimeError("Standby pipeline failed to pause")
+            self.standby = (
+                script_id,
+                pipeline,
+                {
+                    "bitrate": int(config["bitrate"]),
+                    "fps": int(config["fps"]),
+                    "resolution": config["resolution"],
+                },
+                queue_sizing(script_id, config),
+            )
+            self.keyframe_min_interval = float(
+                config.get("keyframe_min_interval", KEYFRAME_MIN_INTERVAL)
+            )
+            self.log(f"Standby pipeline ready ({script_id})")
+
+    def discard_standby(self):
+        with self._lock:
+            if self.standby is not None:
+                self.standby[1].set_state(Gst.State.NULL)
+                self.standby = None
+
+    def swap(self, timeout=3.0):
+        """Drain the running pipeline, then play the standby one.
+
+        Returns timings in ms: eos (old pipeline draining), first_frame
+        (standby from PLAYING to its first encoded frame) and gap (last
+        frame of the old encoder to the first of the new one).
+        """
+        with self._lock:
+            if self.standby is None or self.pipeline is None:
+                raise RuntimeError("No running and standby pipeline to swap")
+            script_id, pipeline, params, sizing = self.standby
+            self.standby = None
+            old, old_frames = self.pipeline, self._frames
+            frames = FrameCounter(pipeline.get_by_name("venc"))
+            keyframes = KeyframeGate(
+                pipeline.get_by_name("venc"), self.keyframe_min_interval
+            )
+
+            started = time.monotonic()
+            self._stopping = True
+            old.send_event(Gst.Event.new_eos())
+            if not self._eos.wait(timeout):
+                self.log("EOS timed out, swapping anyway")
+            drained = time.monotonic()
+            if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+                pipeline.set_state(Gst.State.NULL)
+                self._stopping = False
+                raise RuntimeError("Standby pipeline failed to start")
+            playing = time.monotonic()
+
+            # The old pipeline's NULL (and its WHIP DELETE) runs while the
+            # new one is already starting
+            self.pipeline = pipeline
+            old.set_state(Gst.State.NULL)
+            if self._bus_thread is not None:
+                self._bus_thread.join(timeout=1)
+            self.script_id = script_id
+            self.params = params
+            self.queue_sizing = sizing
+            self.error = None
+            self._eos.clear()
+            self._stopping = False
+            self._frames = frames
+            self._keyframes.close()
+            self._keyframes = keyframes
+            self._bus_thread = threading.Thread(
+                target=self._watch_bus, args=(pipeline,), daemon=True
+            )
+            self._bus_thread.start()
+            self.started_at = time.time()
+
+        first = frames.wait_first(timeout)
+        timings = {
+            "eos_ms": round((drained - started) * 1000, 1),
+            "first_frame_ms": (
+                round((first - playing) * 1000, 1) if first is not None else None
+            ),
+            "gap_ms": (
+                round((first - old_frames.last_at) * 1000, 1)
+                if first is not None and old_frames and old_frames.last_at
+                else None
+            ),
+        }
+        self.log(f"Swapped to standby pipeline ({script_id}): {timings}")
+        return timings
+
+    def stop(self, timeout=3.0):
+        """Send EOS, wait for it to drain, then tear the pipeline down"""
+        with self._lock:
+            self.discard_standby()
+            pipeline = self.pipeline
+            if pipeline is None:
+                return
+            self._stopping = True
+            pipeline.send_event(Gst.Event.new_eos())
+            if not self._eos.wait(timeout):
+                self.log("EOS timed out, forcing shutdown")
+            pipeline.set_state(Gst.State.NULL)
+            self._keyframes.close()
+            self.pipeline = None
+            self.started_at = None
+            if self._bus_thread is not None:
+                self._bus_thread.join(timeout=1)
+                self._bus_thread = None
+            self.log("Pipeline stopped")
+
+    def _watch_bus(self, pipeline):
+        bus = pipeline.get_bus()
+        mask = (
+            Gst.MessageType.ERROR
+            | Gst.MessageType.WARNING
+            | Gst.MessageType.EOS
+            | Gst.MessageType.STATE_CHANGED
+        )
+        while self.pipeline is pipeline:
+            message = bus.timed_pop_filtered(200 * Gst.MSECOND, mask)
+            if message is None:
+                continue
+            if message.type == Gst.MessageType.EOS:
+                self._eos.set()
+                if not self._stopping:
+                    self._report_failure("end of stream")
+                return
+            if message.type == Gst.MessageType.ERROR:
+                err, debug = message.parse_error()
+                self.error = err.message
+                self.log(f"ERROR from {message.src.get_name()}: {err.message}")
+                if debug:
+                    self.log(f"Debug: {debug}")
+                self._eos.set()
+                self._report_failure(err.message)
+                return
+            if message.type == Gst.MessageType.WARNING:
+                warn, _ = message.parse_warning()
+                self.log(f"WARNING from {message.src.get_name()}: {warn.message}")
+            elif message.src is pipeline:
+                old, new, _ = message.parse_state_changed()
+                self.log(
+                    f"Pipeline state {old.value_nick.upper()} -> "
+                    f"{new.value_nick.upper()}"
+                )
+
+    def _report_failure(self, reason):
+        if self.on_failure is not None and not self._stopping:
+            self.on_failure(reason)
+
+    def element(self, name):
+        with self._lock:
+            if self.pipeline is None:
+                return None
+            return self.pipeline.get_by_name(name)
+
+    def set_params(self, bitrate=None, fps=None, resolution=None):
+        """Push new encoder/rate/scale settings into the running elements.
+
+        Returns the parameters that were applied.
+        """
+        applied = {}
+        with self._lock:
+            if self.pipeline is None:
+                raise RuntimeError("Pipeline is not running")
+
+            if bitrate is not None:
+                encoder = pipeline_builder.ENCODERS[self.script_id]
+                venc = self.element("venc")
+                venc.set_property(
+                    encoder["bitrate_property"],
+                    int(bitrate) * encoder["bitrate_scale"],
+                )
+                applied["bitrate"] = int(bitrate)
+
+            if fps is not None:
+                rate = self.element("rate")
+                if rate is None:
+                    raise RuntimeError("Pipeline has no videorate element")
+                rate.set_property("max-rate", int(fps))
+                applied["fps"] = int(fps)
+
+            if resolution is not None:
+                width, height = pipeline_builder.parse_resolution(resolution)
+                scale_caps = self.element("scale_caps")
+                scale_caps.set_property(
+                    "caps", resized_caps(scale_caps.get_property("caps"), width, height)
+                )
+                applied["resolution"] = f"{width}x{height}"
+
+            self.params.update(applied)
+            if "fps" in applied or "bitrate" in applied:
+                self._resize_queues()
+        if applied:
+            self.log(f"Live update: {applied}")
+        return applied
+
+    def _resize_queues(self):
+        """Re-apply the queue policy for the current FPS and bitrate"""
+        policy, latency = self.queue_sizing
+        fps, bitrate = self.params["fps"], self.params["bitrate"]
+        for name, limits in (
+            ("queue_video", queue_policy.video_limits(fps, latency, policy)),
+            ("queue_rtp_video", queue_policy.rtp_limits(fps, bitrate, policy)),
+        ):
+            queue = self.element(name)
+            if queue is not None:
+                queue.set_property("max-size-buffers", limits["buffers"])
+                queue.set_property("max-size-time", limits["time_ns"])
+
+    def set_encoder_properties(self, properties):
+        """Set venc properties that may change while PLAYING.
+
+        Returns (applied, skipped): properties the element does not have or
+        only accepts before it starts are skipped, not forced.
+        """
+        applied, skipped = {}, {}
+        with self._lock:
+            if self.pipeline is None:
+                raise RuntimeError("Pipeline is not running")
+            venc = self.element("venc")
+            for name, value in properties.items():
+                spec = venc.find_property(name)
+                if spec is None or not spec.flags & Gst.PARAM_MUTABLE_PLAYING:
+                    skipped[name] = value
+                    continue
+                venc.set_property(name, value)
+                applied[name] = value
+        if applied:
+            self.log(f"Encoder update: {applied}")
+        return applied, skipped
+
+    def live_controls(self):
+        """What can change while PLAYING: venc's mutable properties, and
+        whether there is a videorate (fps) and scale capsfilter (resolution)"""
+        with self._lock:
+            if self.pipeline is None:
+                return None
+            venc = self.element("venc")
+            return {
+                "encoder": {
+                    spec.name
+                    for spec in venc.list_properties()
+                    if spec.flags & Gst.PARAM_MUTABLE_PLAYING
+                },
+                "fps": self.element("rate") is not None,
+                "resolution": self.element("scale_caps") is not None,
+            }
+
+    def get_webrtc_stats(self):
+        """Snapshot of the WHIP sink's webrtcbin stats as a dict"""
+        whip = self.element("whip0")
+        if whip is None:
+            return {}
+        stats = whip.get_property("stats")
+        return structure_to_dict(stats) if stats is not None else {}
+
+    def get_params(self):
+        """Read back the values the running elements are using"""
+        with self._lock:
+            if self.pipeline is None:
+                return {}
+            encoder = pipeline_builder.ENCODERS[self.script_id]
+            params = dict(self.params)
+            venc = self.element("venc")
+            params["bitrate"] = (
+                venc.get_property(encoder["bitrate_property"])
+                // encoder["bitrate_scale"]
+            )
+            rate = self.element("rate")
+            if rate is not None:
+                params["fps"] = rate.get_property("max-rate")
+            return params
+
+    def counters(self):
+        """Frames the encoder produced and frames videorate dropped, and
+        the keyframe requests that reached the encoder or were held back"""
+        with self._lock:
+            if self.pipeline is None:
+                return {}
+            rate = self.element("rate")
+            return {
+                "frames_encoded": self._frames.count,
+                "frames_dropped": rate.get_property("drop") if rate else None,
+                "keyframes_requested": self._keyframes.requested,
+                "keyframes_forwarded": self._keyframes.forwarded,
+                "keyframes_coalesced": self._keyframes.coalesced,
+            }
+
+    def first_frame(self, timeout):
+        """time.monotonic() of the running encoder's first frame, or None"""
+        with self._lock:
+            frames = self._frames if self.pipeline is not None else None
+        return frames.wait_first(timeout) if frames is not None else None
+
+    def status(self):
+        return {
+            "running": self.running,
+            "script_id": self.script_id if self.running else None,
+            "uptime": time.time() - self.started_at if self.started_at else 0,
+            "params": self.get_params(),
+            "error": self.error,
+        }
+
+
+def queue_sizing(script_id, config):
+    """(policy, encoder latency in ms) a pipeline's queues are sized for"""
+    return (
+        queue_policy.policy_name(config),
+        pipeline_builder.encoder_latency_ms(script_id, config),
+    )
+
+
+class FrameCounter:
+    """Counts buffers leaving an element's src pad"""
+
+    def __init__(self, element):
+        self.count = 0
+        # time.monotonic() of the first and the latest buffer
+        self.first_at = None
+        self.last_at = None
+        self._first = threading.Event()
+        element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._probe)
+
+    def _probe(self, pad, info):
+        self.count += 1
+        self.last_at = time.monotonic()
+        if self.first_at is None:
+            self.first_at = self.last_at
+            self._first.set()
+        return Gst.PadProbeReturn.OK
+
+    def wait_first(self, timeout):
+        """first_at once a buffer went through, or None after timeout"""
+        self._first.wait(timeout)
+        return self.first_at
+
+    def rate(self, seconds):
+        start = self.count
+        time.sleep(seconds)
+        return (self.count - start) / seconds
+
+
+class KeyframeGate:
+    """Rate-limits keyframe requests on their way into the encoder.
+
+    rtpsession turns a viewer's PLI/FIR into an upstream force-key-unit
+    event, which passes the encoder's src pad; so do the built-in WHEP
+    server's requests for new viewers. One request per min_interval gets
+    through. Later ones are coalesced into a single request sent when the
+    interval is over, so a reconnect storm costs one keyframe per interval
+    and nobody waits longer than that.
+    """
+
+    def __init__(self, element, min_interval=KEYFRAME_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self.requested = 0
+        self.forwarded = 0
+        self.coalesced = 0
+        self._last = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pad = element.get_static_pad("src")
+        self._pad.add_probe(Gst.PadProbeType.EVENT_UPSTREAM, self._probe)
+
+    def _probe(self, pad, info):
+        event = info.get_event()
+        if event.type != Gst.EventType.CUSTOM_UPSTREAM or not event.has_name(
+            "GstForceKeyUnit"
+        ):
+            return Gst.PadProbeReturn.OK
+        if getattr(self._local, "resending", False):
+            return Gst.PadProbeReturn.OK
+        now = time.monotonic()
+        with self._lock:
+            self.requested += 1
+            if self._last is None or now - self._last >= self.min_interval:
+                self._last = now
+                self.forwarded += 1
+                return Gst.PadProbeReturn.OK
+            self.coalesced += 1
+            if self._timer is None:
+                self._timer = threading.Timer(
+                    self._last + self.min_interval - now,
+                    self._resend,
+                    args=(event.get_structure().copy(),),
+                )
+                self._timer.daemon = True
+                self._timer.start()
+        return Gst.PadProbeReturn.DROP
+
+    def _resend(self, structure):
+        with self._lock:
+            if self._timer is None:
+                return
+            self._timer = None
+            self._last = time.monotonic()
+            self.forwarded += 1
+        # Straight into the encoder, past this probe
+        self._local.resending = True
+        try:
+            self._pad.send_event(
+                Gst.Event.new_custom(Gst.EventType.CUSTOM_UPSTREAM, structure)
+            )
+        finally:
+            self._local.resending = False
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+
+def self_test(script_id, seconds, hardware_memory=True):
+    """Run a test pipeline and change bitrate/FPS/resolution while it plays"""
+    config = {
+        "resolution": "1280x720",
+        "fps": 60,
+        "bitrate": 3000,
+        "audio_bitrate": 128,
+        "stream_key": "test",
+        "hardware_memory": hardware_memory,
+    }
+    description = pipeline_builder.build_pipeline(
+        script_id, config, test_source=True, fake_sink=True, live_controls=True
+    )
+    engine = StreamEngine()
+    engine.start(script_id, description, config)
+    counter = FrameCounter(engine.element("venc"))
+    failures = []
+
+    try:
+        frames, cpu = counter.count, time.process_time()
+        print(f"Encoded FPS at 60: {counter.rate(seconds):.1f}")
+        # Process CPU time covers every streaming thread (scale, convert,
+        # upload, encode); compare with --no-hardware-memory
+        cpu_ms = (time.process_time() - cpu) * 1000 / max(counter.count - frames, 1)
+        print(f"CPU per frame at 60: {cpu_ms:.2f} ms")
+        applied = engine.set_params(bitrate=1500, fps=30, resolution="854x480")
+        time.sleep(0.5)
+        fps = counter.rate(seconds)
+        print(f"Encoded FPS at 30: {fps:.1f}")
+
+        params = engine.get_params()
+        if params["bitrate"] != 1500:
+            failures.append(f"bitrate not applied: {params['bitrate']}")
+        if not 25 <= fps <= 32:
+            failures.append(f"fps not applied: {fps:.1f}")
+        caps = engine.element("venc").get_static_pad("sink").get_current_caps()
+        structure = caps.get_structure(0)
+        if (structure.get_value("width"), structure.get_value("height")) != (854, 480):
+            failures.append(f"resolution not applied: {caps.to_string()}")
+        if engine.error:
+            failures.append(engine.error)
+        print(f"Applied live: {applied}")
+    finally:
+        engine.stop()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("PASS" if not failures else "FAILED")
+    return 0 if not failures else 1
+
+
+def switch_test(script_id, target_id, seconds):
+    """Prepare target_id next to a running script_id pipeline and swap"""
+    config = {
+        "resolution": "1280x720",
+        "fps": 60,
+        "bitrate": 3000,
+        "audio_bitrate": 128,
+        "stream_key": "test",
+    }
+
+    def description(preset):
+        return pipeline_builder.build_pipeline(
+            preset, config, test_source=True, fake_sink=True, live_controls=True
+        )
+
+    engine = StreamEngine()
+    engine.start(script_id, description(script_id), config)
+    try:
+        time.sleep(seconds)
+        prepared = time.monotonic()
+        engine.prepare(target_id, description(target_id), config)
+        print(f"Prepared {target_id} in {(time.monotonic() - prepared) * 1000:.0f} ms")
+        time.sleep(seconds)
+        timings = engine.swap()
+        print(f"Swap {script_id} -> {target_id}: {timings}")
+        time.sleep(seconds)
+        frames = engine.counters()["frames_encoded"]
+        error = engine.error
+    finally:
+        engine.stop()
+
+    failures = []
+    if timings["gap_ms"] is None or not frames:
+        failures.append("no frames after the swap")
+    elif timings["gap_ms"] > 1000:
+        failures.append(f"gap of {timings['gap_ms']} ms")
+    if error:
+        failures.append(error)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("PASS" if not failures else "FAILED")
+    return 0 if not failures else 1
+
+
+class KeyframeWatcher:
+    """Encoded frames out of an element: (time, bytes, keyframe)"""
+
+    def __init__(self, element):
+        self.frames = []
+        element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._probe)
+
+    def _probe(self, pad, info):
+        buffer = info.get_buffer()
+        key = not buffer.has_flags(Gst.BufferFlags.DELTA_UNIT)
+        self.frames.append((time.monotonic(), buffer.get_size(), key))
+        return Gst.PadProbeReturn.OK
+
+    def next_keyframe(self, after):
+        return next((t for t, _, key in self.frames if key and t >= after), None)
+
+
+def keyframe_test(script_id, seconds, joiners):
+    """Simulated joiners: a short periodic GOP against a long one plus PLI.
+
+    Each scenario runs `seconds` with `joiners` viewers joining at random
+    times; join time is from a joiner's arrival to the next keyframe out of
+    the encoder. A final burst of requests checks the rate limit.
+    """
+    base = {
+        "resolution": "1280x720",
+        "fps": 60,
+        "bitrate": 3000,
+        "audio_bitrate": 128,
+        "stream_key": "test",
+    }
+    scenarios = [
+        ("periodic", {"keyframe_interval": 2}, False),
+        ("on_demand", {}, True),
+    ]
+    results = {}
+    failures = []
+    for name, overrides, request in scenarios:
+        config = {**base, **overrides}
+        description = pipeline_builder.build_pipeline(
+            script_id, config, test_source=True, fake_sink=True, live_controls=True
+        )
+        engine = StreamEngine()
+        engine.start(script_id, description, config)
+        venc = engine.element("venc")
+        watcher = KeyframeWatcher(venc)
+        downstream = venc.get_static_pad("src").get_peer()
+        try:
+            # Settle past the first keyframe before anyone joins
+            time.sleep(1)
+            started = time.monotonic()
+            joins = sorted(started + random.uniform(0, seconds) for _ in range(joiners))
+            for joined in joins:
+                time.sleep(max(0, joined - time.monotonic()))
+                if request:
+                    downstream.push_event(
+                        GstVideo.video_event_new_upstream_force_key_unit(
+                            Gst.CLOCK_TIME_NONE, True, 0
+                        )
+                    )
+            time.sleep(max(0, started + seconds - time.monotonic()))
+            ended = time.monotonic()
+            storm = None
+            if request:
+                # A reconnect storm: 50 requests within a second
+                burst = time.monotonic()
+                for _ in range(50):
+                    downstream.push_event(
+                        GstVideo.video_event_new_upstream_force_key_unit(
+                            Gst.CLOCK_TIME_NONE, True, 0
+                        )
+                    )
+                    time.sleep(0.02)
+                time.sleep(engine.keyframe_min_interval + 0.5)
+                storm = sum(1 for t, _, key in watcher.frames if key and t >= burst)
+            counters = engine.counters()
+            error = engine.error
+        finally:
+            engine.stop()
+
+        window = [f for f in watcher.frames if started <= f[0] < ended]
+        waits = [(watcher.next_keyframe(joined) or ended) - joined for joined in joins]
+        waits.sort()
+        results[name] = {
+            "keyframe_interval": config.get(
+                "keyframe_interval", pipeline_builder.DEFAULT_KEYFRAME_INTERVAL
+            ),
+            "bitrate_kbps": round(sum(f[1] for f in window) * 8 / seconds / 1000),
+            "keyframes": sum(1 for f in window if f[2]),
+            "join_ms_p50": round(waits[len(waits) // 2] * 1000) if waits else None,
+            "join_ms_max": round(waits[-1] * 1000) if waits else None,
+        }
+        if storm is not None:
+            results[name]["storm_keyframes"] = storm
+            results[name]["requests"] = {
+                key: counters[key]
+                for key in (
+                    "keyframes_requested",
+                    "keyframes_forwarded",
+                    "keyframes_coalesced",
+                )
+            }
+            # One keyframe per interval over the burst and the wait after
+            # it, plus a periodic one that may fall inside
+            watched = 1 + engine.keyframe_min_interval + 0.5
+            allowed = int(watched / engine.keyframe_min_interval) + 2
+            if storm > allowed:
+                failures.append(f"{storm} keyframes from a request storm")
+        if error:
+            failures.append(error)
+
+    for name, result in results.items():
+        print(f"{name}: {result}")
+    periodic, on_demand = results["periodic"], results["on_demand"]
+    if on_demand["bitrate_kbps"] >= periodic["bitrate_kbps"]:
+        failures.append(
+            f"bitrate not lower with keyframes on request: "
+            f"{on_demand['bitrate_kbps']} >= {periodic['bitrate_kbps']} kbps"
+        )
+    if periodic["join_ms_p50"] is None or on_demand["join_ms_p50"] is None:
+        failures.append("no join times measured")
+    elif on_demand["join_ms_p50"] >= periodic["join_ms_p50"]:
+        failures.append(
+            f"joins not faster with keyframes on request: "
+            f"p50 {on_demand['join_ms_p50']} >= {periodic['join_ms_p50']} ms"
+        )
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("PASS" if not failures else "FAILED")
+    return 0 if not failures else 1
+
+
+def slowed_encoder_run(queue, fps, seconds, delay_ms, stall_ms=0):
+    """videotestsrc -> queue -> a stand-in encoder taking delay_ms per frame
+    (stall_ms once a second) -> fakesink.
+
+    Latency is from a frame's capture timestamp to leaving the encoder, so
+    frames held back in the source by a full queue count as well.
+    """
+    pipeline = Gst.parse_launch(
+        "videotestsrc is-live=true ! "
+        f"video/x-raw,format=I420,width=320,height=180,framerate={fps}/1 ! "
+        f"{pipeline_builder.named(queue, 'queue_video')} ! "
+        "identity name=venc ! fakesink sync=false"
+    )
+    queue_element = pipeline.get_by_name("queue_video")
+    counts = {"in": 0, "out": 0, "queued": 0}
+    latencies = []
+
+    def on_queue(pad, info):
+        counts["in"] += 1
+        level = queue_element.get_property("current-level-buffers")
+        counts["queued"] = max(counts["queued"], level)
+        return Gst.PadProbeReturn.OK
+
+    def on_encode(pad, info):
+        stalled = stall_ms and counts["out"] and counts["out"] % fps == 0
+        time.sleep((stall_ms if stalled else delay_ms) / 1000)
+        counts["out"] += 1
+        clock = pipeline.get_clock()
+        pts = info.get_buffer().pts
+        if clock is not None and pts != Gst.CLOCK_TIME_NONE:
+            now = clock.get_time() - pipeline.get_base_time()
+            latencies.append((now - pts) / Gst.MSECOND)
+        return Gst.PadProbeReturn.OK
+
+    queue_element.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, on_queue)
+    pipeline.get_by_name("venc").get_static_pad("sink").add_probe(
+        Gst.PadProbeType.BUFFER, on_encode
+    )
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        time.sleep(seconds)
+        # Drain what is queued so every frame is either encoded or dropped
+        pipeline.send_event(Gst.Event.new_eos())
+        pipeline.get_bus().timed_pop_filtered(
+            10 * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR
+        )
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+    latencies.sort()
+
+    def pick(pct):
+        return round(
+            latencies[min(len(latencies) - 1, int(pct / 100 * len(latencies)))], 1
+        )
+
+    return {
+        "frames": counts["in"],
+        "dropped": counts["in"] - counts["out"],
+        "max_queued": counts["queued"],
+        "latency_ms_p50": pick(50) if latencies else None,
+        "latency_ms_p95": pick(95) if latencies else None,
+        "latency_ms_max": round(latencies[-1], 1) if latencies else None,
+    }
+
+
+def queue_test(script_id, seconds, fps=60):
+    """Worst-case buffering of each queue policy in front of a slowed encoder.
+
+    Three loads: an encoder at the preset's latency (keeping up), one
+    taking 1.5 frame intervals per frame (overloaded), and one at the
+    preset's latency with a 200 ms stall every second. The old fixed queue
+    runs alongside for comparison.
+    """
+    latency = pipeline_builder.encoder_latency_ms(script_id, {})
+    interval = 1000 / fps
+    loads = {
+        "steady": (latency, 0),
+        "overloaded": (1.5 * interval, 0),
+        "stalls": (latency, 200),
+    }
+    queues = {
+        policy: queue_policy.describe(queue_policy.video_limits(fps, latency, policy))
+        for policy in queue_policy.POLICIES
+    }
+    queues["fixed"] = FIXED_VIDEO_QUEUE
+    print(f"Encoder latency {latency} ms at {fps} FPS")
+    for name, queue in queues.items():
+        print(f"{name}: {queue}")
+
+    failures = []
+    for load, (delay_ms, stall_ms) in loads.items():
+        results = {
+            name: slowed_encoder_run(queue, fps, seconds, delay_ms, stall_ms)
+            for name, queue in queues.items()
+        }
+        for name, result in results.items():
+            print(f"{load} {name}: {result}")
+        fast, smooth = results["latency"], results["smoothness"]
+        # Capture (one interval), a full leaky queue, the frame's own encode
+        # or stall, and an interval of scheduling slack
+        limits = queue_policy.video_limits(fps, latency, "latency")
+        bound = limits["time_ns"] / Gst.MSECOND + max(delay_ms, stall_ms)
+        bound += 2 * interval
+        if fast["latency_ms_max"] is None or smooth["latency_ms_max"] is None:
+            failures.append(f"{load}: no frames came out")
+            continue
+        if fast["latency_ms_max"] > bound:
+            failures.append(
+                f"{load}: latency policy buffered {fast['latency_ms_max']} ms "
+                f"(bound {bound:.1f} ms)"
+            )
+        if smooth["dropped"]:
+            failures.append(f"{load}: smoothness policy dropped {smooth['dropped']}")
+        if load == "steady" and fast["dropped"] > fast["frames"] * 0.01:
+            failures.append(f"steady: latency policy dropped {fast['dropped']}")
+        if load != "steady" and fast["latency_ms_p95"] > smooth["latency_ms_p95"]:
+            failures.append(f"{load}: latency policy was not faster than smoothness")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("PASS" if not failures else "FAILED")
+    return 0 if not failures else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process GStreamer engine")
+    parser.add_argument("--test", action="store_true", help="run the self-test")
+    parser.add_argument(
+        "--test-switch", action="store_true", help="measure a warm-standby swap"
+    )
+    parser.add_argument(
+        "--test-keyframes",
+        action="store_true",
+        help="simulated joiners: periodic GOP against keyframes on request",
+    )
+    parser.add_argument("--joiners", type=int, default=10)
+    parser.add_argument(
+        "--test-queues",
+        action="store_true",
+        help="worst-case buffering of each queue policy with a slowed encoder",
+    )
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument(
+        "--script", default="vp9", choices=sorted(pipeline_builder.ENCODERS)
+    )
+    parser.add_argument(
+        "--to", default="vp9", choices=sorted(pipeline_builder.ENCODERS)
+    )
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument(
+        "--no-hardware-memory",
+        action="store_true",
+        help="convert and scale on the CPU even for hardware encoders",
+    )
+    args = parser.parse_args()
+
+    if not GST_AVAILABLE:
+        print("ERROR: PyGObject with GStreamer 1.0 introspection is required")
+        return 1
+    if args.test:
+        return self_test(args.script, args.seconds, not args.no_hardware_memory)
+    if args.test_switch:
+        return switch_test(args.script, args.to, args.seconds)
+    if args.test_keyframes:
+        return keyframe_test(args.script, max(args.seconds, 10), args.joiners)
+    if args.test_queues:
+        return queue_test(args.script, max(args.seconds, 5), args.fps)
+    parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+Glass-to-glass latency probe
+
+Stamps every frame with the wall-clock time it was captured (its PTS on
+the sender's clock) as a block barcode composited over the video right
+before the encoder, sends it through the preset's encoder and RTP
+payloader, receives it again with a headless subscriber, decodes the
+barcode and reports latency percentiles.
+
+Transports:
+    local  the built-in WHEP server (whep_sfu.py) and a whepsrc subscriber
+           on the same box, a local stand-in for Broadcast Box
+    rtp    bare loopback UDP + jitter buffer, no WebRTC
+    whep   publish over WHIP and subscribe over WHEP through Broadcast Box
+
+    python3 latency_probe.py --seconds 10 --transport local --script vp9
+"""
+
+import argparse
+import json
+import shlex
+import sys
+import time
+
+import pipeline_builder
+import whep_sfu
+from gst_engine import GST_AVAILABLE, Gst, StreamEngine
+
+SYNC_BITS = [1, 0, 1, 0]
+VALUE_BITS = 32
+CHECK_BITS = 8
+TOTAL_BITS = len(SYNC_BITS) + VALUE_BITS + CHECK_BITS
+
+# Transports a probe can be asked for (the "sfu" sender end is internal)
+TRANSPORTS = ["local", "rtp", "whep"]
+DEFAULT_TRANSPORT = "local"
+# A probe owns the encoder while it runs
+MAX_SECONDS = 60
+
+WHEP_URL = "http://localhost:8080/api/whep"
+PROBE_STREAM_KEY = "latency-probe"
+RTP_PORT = 5600
+
+
+def block_size(width):
+    """Barcode block edge in pixels (even, at most 16) for a frame width"""
+    return max(4, min(16, width // TOTAL_BITS // 2 * 2))
+
+
+def encode_bits(value):
+    value &= 0xFFFFFFFF
+    checksum = sum(value.to_bytes(4, "big")) & 0xFF
+    bits = list(SYNC_BITS)
+    bits += [(value >> i) & 1 for i in range(VALUE_BITS - 1, -1, -1)]
+    bits += [(checksum >> i) & 1 for i in range(CHECK_BITS - 1, -1, -1)]
+    return bits
+
+
+def render_strip(value, block):
+    """I420 frame (TOTAL_BITS blocks wide, one block high) carrying value"""
+    width = TOTAL_BITS * block
+    row = bytearray()
+    for bit in encode_bits(value):
+        row += bytes([235 if bit else 16]) * block
+    luma = bytes(row) * block
+    chroma = bytes([128]) * (width // 2 * block // 2)
+    return luma + chroma + chroma
+
+
+def decode_stamp(luma, width, stride):
+    """Read the barcode from the top-left of a GRAY8 frame"""
+    block = block_size(width)
+    y = block // 2
+    bits = []
+    for i in range(TOTAL_BITS):
+        x = i * block + block // 2
+        # Average a small window to ride out compression noise
+        total = 0
+        for dy in (-1, 0, 1):
+            offset = (y + dy) * stride + x
+            total += luma[offset - 1] + luma[offset] + luma[offset + 1]
+        bits.append(1 if total / 9 > 128 else 0)
+
+    if bits[: len(SYNC_BITS)] != SYNC_BITS:
+        return None
+    value = 0
+    for bit in bits[len(SYNC_BITS) : len(SYNC_BITS) + VALUE_BITS]:
+        value = (value << 1) | bit
+    checksum = 0
+    for bit in bits[len(SYNC_BITS) + VALUE_BITS :]:
+        checksum = (checksum << 1) | bit
+    if checksum != sum(value.to_bytes(4, "big")) & 0xFF:
+        return None
+    return value
+
+
+def now_ms():
+    return int(time.time() * 1000) & 0xFFFFFFFF
+
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def pick(pct):
+        return round(ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))], 2)
+
+    return {
+        "p50": pick(50),
+        "p90": pick(90),
+        "p95": pick(95),
+        "p99": pick(99),
+        "max": round(ordered[-1], 2),
+        "count": len(ordered),
+    }
+
+
+class CaptureStamper:
+    """Pushes a barcode strip carrying each frame's capture time.
+
+    A probe on the compositor's video pad (mix.sink_0) converts the frame's
+    PTS (its capture time on the pipeline clock; videorate may move it by
+    up to a frame) to wall-clock ms and pushes a strip with the same PTS
+    into the "stamp" appsrc, so the compositor lays it over that frame.
+    """
+
+    def __init__(self, pipeline, block):
+        self.pipeline = pipeline
+        self.block = block
+        self.appsrc = pipeline.get_by_name("stamp")
+        pipeline.get_by_name("mix").get_static_pad("sink_0").add_probe(
+            Gst.PadProbeType.BUFFER, self._on_frame
+        )
+
+    def captured_ms(self, pts):
+        """Wall-clock ms (wrapped to 32 bits) of a running-time PTS"""
+        clock = self.pipeline.get_clock()
+        if clock is None or pts == Gst.CLOCK_TIME_NONE:
+            return None
+        running = clock.get_time() - self.pipeline.get_base_time()
+        return int(time.time() * 1000 - (running - pts) / 1e6) & 0xFFFFFFFF
+
+    def _on_frame(self, pad, info):
+        frame = info.get_buffer()
+        captured = self.captured_ms(frame.pts)
+        if captured is not None:
+            strip = Gst.Buffer.new_wrapped(render_strip(captured, self.block))
+            strip.pts = frame.pts
+            strip.duration = frame.duration
+            self.appsrc.emit("push-buffer", strip)
+        return Gst.PadProbeReturn.OK
+
+
+class CaptureDelay:
+    """Capture to a pad (the encoder's input), from each buffer's PTS"""
+
+    def __init__(self, pipeline, pad):
+        self.pipeline = pipeline
+        self.samples = []
+        pad.add_probe(Gst.PadProbeType.BUFFER, self._probe)
+
+    def _probe(self, pad, info):
+        clock = self.pipeline.get_clock()
+        pts = info.get_buffer().pts
+        if clock is not None and pts != Gst.CLOCK_TIME_NONE:
+            running = clock.get_time() - self.pipeline.get_base_time()
+            self.samples.append((running - pts) / 1e6)
+        return Gst.PadProbeReturn.OK
+
+
+class PtsStageTimer:
+    """Time a buffer spends between two pads, matched by PTS"""
+
+    def __init__(self, in_pad, out_pad):
+        self.pending = {}
+        self.samples = []
+        in_pad.add_probe(Gst.PadProbeType.BUFFER, self._in)
+        out_pad.add_probe(Gst.PadProbeType.BUFFER, self._out)
+
+    def _in(self, pad, info):
+        self.pending[info.get_buffer().pts] = time.perf_counter()
+        if len(self.pending) > 1000:
+            self.pending.clear()
+        return Gst.PadProbeReturn.OK
+
+    def _out(self, pad, info):
+        # Payloaders emit several packets per frame; the first one counts
+        started = self.pending.pop(info.get_buffer().pts, None)
+        if started is not None:
+            self.samples.append((time.perf_counter() - started) * 1000)
+        return Gst.PadProbeReturn.OK
+
+
+def build_sender(script_id, config, transport, test_source=True, device=None):
+    """Source -> scale -> barcode overlay -> encode -> RTP -> transport"""
+    width, height = pipeline_builder.parse_resolution(config["resolution"])
+    fps = int(config["fps"])
+    block = block_size(width)
+    encoder_format = pipeline_builder.ENCODERS[script_id]["format"]
+    capture_mode = pipeline_builder.resolve_capture_mode(
+        config, device=device or pipeline_builder.VIDEO_DEVICE, test_source=test_source
+    )
+    capture = pipeline_builder.build_capture_elements(
+        config,
+        capture_mode,
+        device or pipeline_builder.VIDEO_DEVICE,
+        test_source=test_source,
+    )
+
+    if transport == "rtp":
+        end = f"udpsink host=127.0.0.1 port={RTP_PORT} sync=false async=false"
+    elif transport == "sfu":
+        # Viewers attach to the sfu_video tee (whep_loadtest.py)
+        end = "fakesink sync=false"
+    else:
+        end = "whip0."
+    encode = pipeline_builder.build_encode_elements(
+        script_id, config, payloader_name="pay", end=end, sfu=transport == "sfu"
+    )
+
+    # CaptureStamper pushes the strips, timestamped like their frames
+    branches = [
+        " ! ".join(capture + ["mix.sink_0"]),
+        "appsrc name=stamp is-live=true format=time block=false "
+        f"caps=video/x-raw,format=I420,width={TOTAL_BITS * block},height={block},"
+        f"framerate={fps}/1 ! mix.sink_1",
+        " ! ".join(
+            ["compositor name=mix sink_1::xpos=0 sink_1::ypos=0"]
+            + ([] if encoder_format == "I420" else ["videoconvert"])
+            + [f"video/x-raw,format={encoder_format},width={width},height={height}"]
+            + encode
+        ),
+    ]
+    if transport == "whep":
+        branches.append(
+            pipeline_builder.build_sink(
+                config, pipeline_builder.SERVER_URL, stream_key=PROBE_STREAM_KEY
+            )
+        )
+    return "  ".join(branches)
+
+
+def build_receiver(script_id, transport, whep_url=None):
+    """Headless subscriber: transport -> depay -> decode -> GRAY8 appsink"""
+    encoder = pipeline_builder.ENCODERS[script_id]
+    name = encoder["encoding_name"]
+    sink = (
+        "videoconvert ! video/x-raw,format=GRAY8 ! "
+        "appsink name=frames emit-signals=true sync=false max-buffers=2 drop=true"
+    )
+    if transport == "rtp":
+        depay = encoder["payloader"].split()[0].replace("pay", "depay")
+        return (
+            f"udpsrc port={RTP_PORT} caps=application/x-rtp,media=video,"
+            f"encoding-name={name},payload=96,clock-rate=90000 "
+            f"! rtpjitterbuffer latency=20 ! {depay} ! decodebin ! {sink}"
+        )
+    if transport == "local":
+        return (
+            f"whepsrc whep-endpoint={shlex.quote(whep_url)} "
+            f"video-caps=application/x-rtp,media=video,encoding-name={name} "
+            f"! decodebin ! {sink}"
+        )
+    return (
+        f"whepsrc whep-endpoint={shlex.quote(WHEP_URL)} "
+        f"auth-token={PROBE_STREAM_KEY} "
+        f"video-caps=application/x-rtp,media=video,encoding-name={name} "
+        f"! decodebin ! {sink}"
+    )
+
+
+class LatencyProbe:
+    """One sender/receiver run; results() gives the percentiles"""
+
+    def __init__(
+        self,
+        script_id="vp9",
+        config=None,
+        transport=DEFAULT_TRANSPORT,
+        test_source=True,
+    ):
+        self.script_id = script_id
+        self.config = {
+            "resolution": "1280x720",
+            "fps": 60,
+            "bitrate": 5000,
+            "stream_key": PROBE_STREAM_KEY,
+            **(config or {}),
+        }
+        self.transport = transport
+        self.test_source = test_source
+        self.glass_to_glass = []
+        self.undecoded = 0
+        self.error = None
+
+    def _on_frame(self, appsink):
+        received = now_ms()
+        sample = appsink.emit("pull-sample")
+        structure = sample.get_caps().get_structure(0)
+        width = structure.get_value("width")
+        stride = (width + 3) & ~3
+        buffer = sample.get_buffer()
+        ok, mapinfo = buffer.map(Gst.MapFlags.READ)
+        if ok:
+            try:
+                stamp = decode_stamp(mapinfo.data, width, stride)
+            finally:
+                buffer.unmap(mapinfo)
+            if stamp is None:
+                self.undecoded += 1
+            else:
+                self.glass_to_glass.append((received - stamp) & 0xFFFFFFFF)
+        return Gst.FlowReturn.OK
+
+    def _instrument(self, sender, block):
+        """Stamp the frames and time the sender stages"""
+        venc = sender.get_by_name("venc")
+        return (
+            CaptureStamper(sender, block),
+            CaptureDelay(sender, venc.get_static_pad("sink")),
+            PtsStageTimer(venc.get_static_pad("sink"), venc.get_static_pad("src")),
+            PtsStageTimer(
+                venc.get_static_pad("src"),
+                sender.get_by_name("pay").get_static_pad("src"),
+            ),
+        )
+
+    def run(self, seconds):
+        width, _ = pipeline_builder.parse_resolution(self.config["resolution"])
+        block = block_size(width)
+        description = build_sender(
+            self.script_id,
+            self.config,
+            "sfu" if self.transport == "local" else self.transport,
+            self.test_source,
+        )
+        engine = httpd = None
+        if self.transport == "local":
+            # The engine runs the sender with the sfu tees; a WhepServer on
+            # an ephemeral port serves the subscriber from them
+            engine = StreamEngine()
+            engine.start(self.script_id, description, self.config)
+            sender = engine.pipeline
+            server = whep_sfu.WhepServer(
+                engine, max_viewers=1, stream_key=PROBE_STREAM_KEY
+            )
+            httpd = whep_sfu.serve(server, 0)
+            url = f"http://127.0.0.1:{httpd.server_address[1]}/whep/{PROBE_STREAM_KEY}"
+            receiver = Gst.parse_launch(
+                build_receiver(self.script_id, self.transport, url)
+            )
+        else:
+            sender = Gst.parse_launch(description)
+            receiver = Gst.parse_launch(build_receiver(self.script_id, self.transport))
+        receiver.get_by_name("frames").connect("new-sample", self._on_frame)
+        _, capture, encode, packetize = self._instrument(sender, block)
+
+        # The engine's own bus thread watches the sender in local mode
+        watched = [receiver] if engine else [sender, receiver]
+        if not engine:
+            sender.set_state(Gst.State.PLAYING)
+        receiver.set_state(Gst.State.PLAYING)
+
+        deadline = time.time() + seconds
+        try:
+            while time.time() < deadline and self.error is None:
+                for pipeline in watched:
+                    message = pipeline.get_bus().pop_filtered(Gst.MessageType.ERROR)
+                    if message is not None:
+                        err, _ = message.parse_error()
+                        self.error = f"{message.src.get_name()}: {err.message}"
+                if engine and engine.error:
+                    self.error = engine.error
+                time.sleep(0.1)
+        finally:
+            receiver.set_state(Gst.State.NULL)
+            if engine:
+                httpd.shutdown()
+                server.close_all()
+                engine.stop()
+            else:
+                sender.set_state(Gst.State.NULL)
+
+        return self.results(capture.samples, encode.samples, packetize.samples)
+
+    def results(self, capture_samples=(), encode_samples=(), packetize_samples=()):
+        glass = percentiles(self.glass_to_glass)
+        capture = percentiles(list(capture_samples))
+        encode = percentiles(list(encode_samples))
+        packetize = percentiles(list(packetize_samples))
+        # Whatever the median frame spent outside the timed sender stages:
+        # network hop, jitter buffer and decode
+        remainder = None
+        if glass and capture and encode and packetize:
+            remainder = round(
+                glass["p50"] - capture["p50"] - encode["p50"] - packetize["p50"], 2
+            )
+        return {
+            "script_id": self.script_id,
+            "transport": self.transport,
+            "resolution": self.config["resolution"],
+            "fps": int(self.config["fps"]),
+            "glass_to_glass_ms": glass,
+            "capture_to_encoder_ms": capture,
+            "encode_ms": encode,
+            "packetize_ms": packetize,
+            "transport_decode_p50_ms": remainder,
+            "frames_decoded": len(self.glass_to_glass),
+            "frames_unreadable": self.undecoded,
+            "error": self.error,
+            "finished": time.time(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Glass-to-glass latency probe")
+    parser.add_argument(
+        "--script", default="vp9", choices=sorted(pipeline_builder.ENCODERS)
+    )
+    parser.add_argument("--transport", choices=TRANSPORTS, default=DEFAULT_TRANSPORT)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--resolution", default="1280x720")
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--bitrate", type=int, default=5000)
+    parser.add_argument(
+        "--device",
+        action="store_true",
+        help="stamp the capture card's video instead of videotestsrc",
+    )
+    args = parser.parse_args()
+
+    if not GST_AVAILABLE:
+        print("ERROR: PyGObject with GStreamer 1.0 introspection is required")
+        return 1
+
+    probe = LatencyProbe(
+        args.script,
+        {"resolution": args.resolution, "fps": args.fps, "bitrate": args.bitrate},
+        args.transport,
+        test_source=not args.device,
+    )
+    result = probe.run(args.seconds)
+    print(json.dumps(result, indent=2))
+    return 0 if result["glass_to_glass_ms"] and not result["error"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Control panel load test
+
+Hits the panel's read endpoints from N concurrent clients for a while at
+each concurrency level and reports request latency percentiles, so it is
+visible whether latency stays flat as panels and scrapers pile up.
+
+With --viewers it also holds that many idle log viewers (SSE on
+/api/logs/stream) and panel sockets (Socket.IO) open during each level,
+and with --panel-pid it reports the panel's CPU and memory meanwhile. Pin
+the panel to one core (taskset -c 0) to see how many viewers a core holds.
+
+    python3 loadtest.py --url http://localhost:8081 --clients 1 10 50
+    python3 loadtest.py --clients 5 --viewers 0 100 500 1000 --panel-pid 1234
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+
+import psutil
+import requests
+
+try:
+    import socketio
+except ImportError:
+    socketio = None
+
+DEFAULT_PATHS = ["/api/stats", "/api/status", "/metrics", "/"]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))], 2)
+
+
+def client(base_url, paths, deadline, latencies, errors):
+    """One panel: request the paths round-robin until the deadline"""
+    session = requests.Session()
+    index = 0
+    while time.time() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            response = session.get(base_url + path, timeout=10)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            errors.append(path)
+            continue
+        latencies.append((path, (time.perf_counter() - started) * 1000))
+
+
+class Viewers:
+    """Idle SSE log viewers and Socket.IO panels held open for a level"""
+
+    def __init__(self, base_url, count):
+        self.base_url = base_url
+        self.count = count
+        self.streams = []
+        self.sockets = []
+        self.failed = 0
+        self.events = 0
+        self._lock = threading.Lock()
+
+    def _open_stream(self):
+        try:
+            response = requests.get(
+                self.base_url + "/api/logs/stream", stream=True, timeout=(5, None)
+            )
+            response.raise_for_status()
+            with self._lock:
+                self.streams.append(response)
+            for _ in response.iter_lines():
+                pass
+        except (requests.exceptions.RequestException, AttributeError):
+            # AttributeError: the response was closed under iter_lines
+            pass
+
+    def _count_event(self, data):
+        with self._lock:
+            self.events += 1
+
+    def open(self):
+        for _ in range(self.count):
+            threading.Thread(target=self._open_stream, daemon=True).start()
+            if socketio is None:
+                continue
+            sock = socketio.Client(reconnection=False)
+            sock.on("combined_update", self._count_event)
+            try:
+                sock.connect(self.base_url, transports=["websocket"])
+                self.sockets.append(sock)
+            except socketio.exceptions.ConnectionError:
+                self.failed += 1
+        # Let the SSE connections land before measuring
+        deadline = time.time() + 10
+        while len(self.streams) < self.count and time.time() < deadline:
+            time.sleep(0.1)
+
+    def close(self):
+        for response in self.streams:
+            response.close()
+        for sock in self.sockets:
+            sock.disconnect()
+
+    def summary(self):
+        return {
+            "viewers": self.count,
+            "sse_open": len(self.streams),
+            "sockets_open": len(self.sockets) if socketio else None,
+            "socket_failures": self.failed,
+            "socket_events": self.events,
+        }
+
+
+def run_level(base_url, paths, clients, seconds, viewers=0, panel=None):
+    held = Viewers(base_url, viewers)
+    held.open()
+
+    latencies = []
+    errors = []
+    cpu_before = panel.cpu_times() if panel else None
+    deadline = time.time() + seconds
+    threads = [
+        threading.Thread(
+            target=client, args=(base_url, paths, deadline, latencies, errors)
+        )
+        for _ in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    result = {"clients": clients, **held.summary()}
+    if panel:
+        cpu_after = panel.cpu_times()
+        busy = (cpu_after.user - cpu_before.user) + (
+            cpu_after.system - cpu_before.system
+        )
+        result["panel_cpu_percent"] = round(busy / seconds * 100, 1)
+        result["panel_rss_mb"] = round(panel.memory_info().rss / 1024 / 1024, 1)
+        result["panel_threads"] = panel.num_threads()
+    held.close()
+
+    values = [ms for _, ms in latencies]
+    per_path = {}
+    for path in paths:
+        path_values = [ms for p, ms in latencies if p == path]
+        per_path[path] = {
+            "p50_ms": percentile(path_values, 50),
+            "p95_ms": percentile(path_values, 95),
+        }
+    result.update(
+        {
+            "requests": len(values),
+            "errors": len(errors),
+            "requests_per_second": round(len(values) / seconds, 1),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+            "max_ms": round(max(values), 2) if values else None,
+            "paths": per_path,
+        }
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control panel load test")
+    parser.add_argument("--url", default="http://localhost:8081")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument(
+        "--viewers",
+        type=int,
+        nargs="+",
+        default=[0],
+        help="idle SSE + Socket.IO viewers to hold open per level",
+    )
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--path", action="append", dest="paths")
+    parser.add_argument("--panel-pid", type=int, help="report this PID's CPU/RSS")
+    parser.add_argument(
+        "--max-ratio",
+        type=float,
+        default=3.0,
+        help="fail when p95 at the highest level exceeds this multiple of "
+        "the lowest level's p95 (plus 20 ms of slack)",
+    )
+    args = parser.parse_args()
+
+    if socketio is None and any(args.viewers):
+        print(
+            "python-socketio client not installed, holding SSE viewers only",
+            file=sys.stderr,
+        )
+    panel = psutil.Process(args.panel_pid) if args.panel_pid else None
+    paths = args.paths or DEFAULT_PATHS
+    levels = []
+    for viewers in args.viewers:
+        for clients in args.clients:
+            print(f"{clients} clients, {viewers} viewers...", file=sys.stderr)
+            levels.append(
+                run_level(
+                    args.url.rstrip("/"), paths, clients, args.seconds, viewers, panel
+                )
+            )
+
+    flat = None
+    if len(levels) > 1 and levels[0]["p95_ms"] and levels[-1]["p95_ms"]:
+        flat = (
+            levels[-1]["p95_ms"] <= levels[0]["p95_ms"] * args.max_ratio + 20
+            and levels[-1]["errors"] == 0
+        )
+    print(json.dumps({"url": args.url, "levels": levels, "flat": flat}, indent=2))
+    return 1 if flat is False else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
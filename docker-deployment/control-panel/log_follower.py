@@ -0,0 +1,222 @@
+"""
+Single follower for the stream log
+
+Watches the log's directory with inotify (so a log that does not exist yet,
+or is truncated by the next start, is picked up), keeps the last lines in a
+ring buffer and fans new lines out to any number of subscribers (SSE
+streams, Socket.IO). Falls back to polling once a second without inotify.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import gzip
+import os
+import shutil
+import struct
+import time
+from collections import deque
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT = struct.Struct("iIII")
+
+# Bytes read per wakeup, so one burst cannot stall the event loop
+READ_CHUNK = 256 * 1024
+SUBSCRIBER_QUEUE = 1000
+
+
+def _inotify():
+    """libc handle with inotify, or None"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError, TypeError):
+        return None
+    return libc
+
+
+def archive(path, archive_dir, copy=False):
+    """Move path into archive_dir under a timestamped name; returns the new path.
+
+    copy=True copies and truncates instead, for a log a running child still
+    has open (O_APPEND), so it keeps writing to the same file.
+    """
+    path = str(path)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    os.makedirs(archive_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    base = os.path.join(archive_dir, f"{stem}-{time.strftime('%Y%m%d-%H%M%S')}")
+    target = base + ".log"
+    suffix = 0
+    while os.path.exists(target) or os.path.exists(target + ".gz"):
+        suffix += 1
+        target = f"{base}.{suffix}.log"
+    if copy:
+        shutil.copyfile(path, target)
+        os.truncate(path, 0)
+    else:
+        os.replace(path, target)
+    return target
+
+
+def compress(path, keep):
+    """gzip an archived log, then prune its directory to the newest keep"""
+    with open(path, "rb") as src, gzip.open(path + ".gz", "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.unlink(path)
+    directory = os.path.dirname(path)
+    archives = sorted(
+        (
+            os.path.join(directory, name)
+            for name in os.listdir(directory)
+            if name.endswith(".log.gz")
+        ),
+        key=os.path.getmtime,
+    )
+    for old in archives[:-keep] if keep else archives:
+        os.unlink(old)
+
+
+class LogFollower:
+    """Ring buffer of a log file's lines with live fan-out.
+
+    Every line gets a sequence number that keeps counting across
+    truncations, so reconnecting SSE clients can resume after the last
+    line they saw (Last-Event-ID).
+    """
+
+    def __init__(self, path, lines=1000):
+        self.path = str(path)
+        self.ring = deque(maxlen=lines)
+        self.seq = 0
+        self.subscribers = set()
+        self.dropped = 0
+        self._file = None
+        self._inode = None
+        self._partial = b""
+        # Set while the file is copied and truncated under a running child,
+        # so the truncation does not clear the ring or reset viewers
+        self.rotating = False
+
+    def tail(self, count=50, after=None):
+        """Last count lines as (seq, line), or every buffered line after seq"""
+        lines = list(self.ring)
+        if after is not None:
+            return [entry for entry in lines if entry[0] > after]
+        return lines[-count:] if count else []
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def _publish(self, item):
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(item)
+            except asyncio.QueueFull:
+                # A stalled client loses lines instead of growing memory
+                self.dropped += 1
+
+    def rewind(self, keep_lines=False):
+        """The file was truncated or replaced: start again from byte 0"""
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._inode = None
+        self._partial = b""
+        if not keep_lines:
+            self.ring.clear()
+            self._publish(("reset", None))
+
+    def _open(self):
+        try:
+            self._file = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        return True
+
+    def read_new(self, limit=READ_CHUNK):
+        """Read whatever was appended since the last call (limit=None: all)"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if self._file is not None and (
+            stat.st_ino != self._inode or stat.st_size < self._file.tell()
+        ):
+            self.rewind(keep_lines=self.rotating)
+            self.rotating = False
+        if self._file is None and not self._open():
+            return
+
+        data = self._file.read(limit or -1)
+        if not data:
+            return
+        data = self._partial + data
+        *complete, self._partial = data.split(b"\n")
+        for raw in complete:
+            self.seq += 1
+            line = raw.decode(errors="replace").rstrip("\r")
+            self.ring.append((self.seq, line))
+            self._publish(("line", (self.seq, line)))
+        if limit and len(data) >= limit:
+            # More is waiting; finish it on the next loop iteration
+            asyncio.get_running_loop().call_soon(self.read_new)
+
+    async def run(self):
+        """Follow the file until cancelled"""
+        self.read_new()
+        libc = _inotify()
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC) if libc else -1
+        if fd < 0:
+            while True:
+                await asyncio.sleep(1)
+                self.read_new()
+
+        directory, name = os.path.split(self.path)
+        if libc.inotify_add_watch(fd, directory.encode(), WATCH_MASK) < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch {directory}")
+
+        loop = asyncio.get_running_loop()
+        target = name.encode()
+
+        def on_events():
+            try:
+                buffer = os.read(fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            offset = 0
+            relevant = False
+            while offset < len(buffer):
+                _, mask, _, length = _EVENT.unpack_from(buffer, offset)
+                event_name = buffer[
+                    offset + _EVENT.size : offset + _EVENT.size + length
+                ]
+                offset += _EVENT.size + length
+                if event_name.rstrip(b"\0") == target:
+                    relevant = True
+            if relevant:
+                self.read_new()
+
+        loop.add_reader(fd, on_events)
+        try:
+            await asyncio.Future()
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
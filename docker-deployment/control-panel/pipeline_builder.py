@@ -0,0 +1,1357 @@
+#!/usr/bin/env python3
+"""
+GStreamer pipeline builder for the streaming presets
+
+Generates the gst-launch-1.0 description for a STREAMING_SCRIPTS entry from
+the saved config instead of the hardcoded 1440p@144 pipelines in scripts/.
+Frame dropping and scaling happen before colorspace conversion, so only the
+frames that are actually encoded get converted.
+
+Dry run (no capture card needed):
+    python3 pipeline_builder.py vp9 --resolution 1280x720 --fps 60 --dry-run
+"""
+
+import argparse
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import queue_policy
+
+SERVER_URL = "http://localhost:8080/api/whip"
+VIDEO_DEVICE = "/dev/video0"
+
+# Mode the scripts assumed before negotiation existed (Elgato-class USB cards)
+FALLBACK_CAPTURE_MODE = {
+    "format": "YUY2",
+    "width": 2560,
+    "height": 1440,
+    "fps": 144,
+}
+
+# V4L2 fourcc -> GStreamer raw format
+V4L2_FORMATS = {
+    "YUYV": "YUY2",
+    "UYVY": "UYVY",
+    "NV12": "NV12",
+    "YU12": "I420",
+    "RGB3": "RGB",
+    "BGR3": "BGR",
+}
+
+# Compressed capture formats: V4L2 fourcc -> format name used here
+COMPRESSED_FORMATS = {"MJPG": "MJPEG"}
+
+# Cheapest raw formats first: 4:2:0 needs no chroma resampling for encoders
+RAW_FORMAT_PREFERENCE = ["NV12", "I420", "YUY2", "UYVY", "RGB", "BGR"]
+
+# Bytes per pixel on the USB bus; MJPEG at capture-card quality is roughly
+# a sixth of YUY2
+BUS_BYTES_PER_PIXEL = {
+    "NV12": 1.5,
+    "I420": 1.5,
+    "YUY2": 2,
+    "UYVY": 2,
+    "RGB": 3,
+    "BGR": 3,
+    "MJPEG": 0.33,
+}
+
+# Usable bandwidth in Mbit/s by USB link speed (the sysfs "speed" value);
+# isochronous video gets well under the signalling rate
+USB_USABLE_MBPS = {480: 190, 5000: 3200, 10000: 6400, 20000: 12800}
+
+# Relative CPU cost per pixel of each step between the capture card and the
+# encoder input, videoconvert = 1
+CAPTURE_COSTS = {
+    # Software JPEG decode, per captured pixel (before videorate drops)
+    "jpegdec": 6.0,
+    # VA-API/NVDEC JPEG decode: the CPU only parses the headers
+    "hw_jpegdec": 0.3,
+    # videoscale, per pixel going in
+    "scale": 2.0,
+    # videoconvert, per pixel coming out
+    "convert": 1.0,
+    # Copy into device memory (cudaupload, or VA-API without a DMABuf import)
+    "upload": 0.5,
+}
+
+# Simulcast renditions when the config doesn't list any
+DEFAULT_RENDITIONS = [
+    {"name": "720p60", "resolution": "1280x720", "fps": 60, "bitrate": 3500},
+    {"name": "480p30", "resolution": "854x480", "fps": 30, "bitrate": 1200},
+]
+
+# Recorded `v4l2-ctl --list-formats-ext` of a USB 3 capture card (MJPG, YUYV
+# and NV12, the last only up to 720p at 60 FPS), for --self-check
+RECORDED_FORMATS = (
+    Path(__file__).resolve().parent / "testdata" / "v4l2-usb3-capture.txt"
+)
+
+# --self-check: (preset, config, installed elements or None for all, mode
+# it must pick from RECORDED_FORMATS)
+SELF_CHECKS = [
+    # Software: the 4:2:0 mode at the output size needs no scaling, and
+    # NV12 -> I420 is a cheaper conversion on the bus than YUYV
+    ("vp9", {}, None, {"format": "NV12", "width": 1280, "height": 720}),
+    # NV12 stops at 1080p30, so 1080p60 comes in as YUYV
+    (
+        "vp9",
+        {"resolution": "1920x1080"},
+        None,
+        {"format": "YUY2", "width": 1920, "height": 1080},
+    ),
+    # USB 2: no raw mode fits, so MJPEG and a software decode
+    (
+        "vp9",
+        {"capture_bus_mbps": 480},
+        None,
+        {"format": "MJPEG", "decoder": "jpegdec"},
+    ),
+    # VA-API imports raw DMABufs for free: NV12 straight into the GPU
+    (
+        "h264-vaapi",
+        {},
+        None,
+        {"format": "NV12", "width": 1280, "height": 720, "io_mode": "dmabuf"},
+    ),
+    (
+        "h264-vaapi",
+        {"capture_bus_mbps": 480},
+        None,
+        {"format": "MJPEG", "decoder": "vaapijpegdec", "io_mode": None},
+    ),
+    # CUDA copies raw frames up; NVDEC decoding MJPEG is cheaper
+    (
+        "h264-nvenc",
+        {},
+        None,
+        {"format": "MJPEG", "decoder": "nvjpegdec", "width": 1280},
+    ),
+    # ... unless no JPEG decoder is installed
+    (
+        "av1-nvenc",
+        {},
+        {"cudaupload", "cudaconvertscale"},
+        {"format": "NV12", "width": 1280, "height": 720, "io_mode": None},
+    ),
+]
+
+# Shared-memory hand-off between the capture and encoder stages
+SHM_SOCKET = "/tmp/stream-capture.sock"
+SHM_FORMAT = "I420"
+SHM_FRAMES = 6
+
+# Conversion and scaling on the device for hardware encoders. Frames are
+# dropped by videorate while still in system memory, uploaded once (VA-API
+# imports the capture's DMABufs instead of copying), then converted and
+# scaled by the GPU into the memory the encoder reads.
+HARDWARE_PATHS = {
+    # gstreamer-vaapi (vaapih264enc)
+    "vaapi": {
+        "requires": ["vaapipostproc"],
+        "upload": [],
+        "scaler": "vaapipostproc",
+        "memory": "memory:VASurface",
+        "dmabuf": True,
+        "jpeg_decoder": "vaapijpegdec",
+    },
+    # va plugin in gst-plugins-bad (vaav1enc)
+    "va": {
+        "requires": ["vapostproc"],
+        "upload": [],
+        "scaler": "vapostproc",
+        "memory": "memory:VAMemory",
+        "dmabuf": True,
+        "jpeg_decoder": "vajpegdec",
+    },
+    # nvcodec (nvh264enc, nvav1enc)
+    "cuda": {
+        "requires": ["cudaupload", "cudaconvertscale"],
+        "upload": ["cudaupload"],
+        "scaler": "cudaconvertscale",
+        "memory": "memory:CUDAMemory",
+        "dmabuf": False,
+        "jpeg_decoder": "nvjpegdec",
+    },
+}
+
+# Seconds between periodic keyframes. Long, because viewers that join in
+# between ask for one (PLI/FIR -> force-key-unit, see gst_engine.KeyframeGate)
+DEFAULT_KEYFRAME_INTERVAL = 10
+
+# Encoder settings per STREAMING_SCRIPTS id.
+# bitrate_scale converts the config's kbps to the element's bitrate unit;
+# keyframe_property takes the keyframe distance in frames (keyframe_max caps
+# it where the element's range is limited). latency_ms is a rough per-frame
+# encode time at 720p60 for sizing the queues (queue_policy.py); the
+# config's encoder_latency_ms (benchmark.py's latency_ms p95) overrides it.
+ENCODERS = {
+    "vp9": {
+        "element": "vp9enc",
+        "bitrate_property": "target-bitrate",
+        "bitrate_scale": 1000,
+        "format": "I420",
+        "properties": {
+            "cpu-used": 4,
+            "deadline": 1,
+            "min-quantizer": 0,
+            "max-quantizer": 63,
+            "cq-level": 10,
+            "threads": 4,
+            "static-threshold": 100,
+        },
+        "keyframe_property": "keyframe-max-dist",
+        "parser": None,
+        "payloader": "rtpvp9pay",
+        "encoding_name": "VP9",
+        "latency_ms": 12,
+    },
+    "av1-optiplex": {
+        "element": "svtav1enc",
+        "bitrate_property": "target-bitrate",
+        "bitrate_scale": 1,
+        "format": "I420",
+        "properties": {
+            "preset": 10,
+        },
+        "keyframe_property": "intra-period-length",
+        "parser": "av1parse",
+        "payloader": "rtpav1pay",
+        "encoding_name": "AV1",
+        "latency_ms": 20,
+    },
+    "h264-vaapi": {
+        "element": "vaapih264enc",
+        "bitrate_property": "bitrate",
+        "bitrate_scale": 1,
+        "format": "NV12",
+        "properties": {
+            "rate-control": "cbr",
+            "quality-level": 7,
+            "tune": "high-compression",
+        },
+        "keyframe_property": "keyframe-period",
+        "keyframe_max": 1024,
+        "parser": "h264parse",
+        "payloader": "rtph264pay config-interval=1",
+        "encoding_name": "H264",
+        "latency_ms": 5,
+        "hardware_path": "vaapi",
+    },
+    "av1-vaapi": {
+        "element": "vaav1enc",
+        "bitrate_property": "bitrate",
+        "bitrate_scale": 1,
+        "format": "NV12",
+        "properties": {
+            "rate-control": "cbr",
+        },
+        "keyframe_property": "key-int-max",
+        "keyframe_max": 1024,
+        "parser": "av1parse",
+        "payloader": "rtpav1pay",
+        "encoding_name": "AV1",
+        "latency_ms": 6,
+        "hardware_path": "va",
+    },
+    "h264-nvenc": {
+        "element": "nvh264enc",
+        "bitrate_property": "bitrate",
+        "bitrate_scale": 1,
+        "format": "NV12",
+        "properties": {
+            "preset": "p4",
+            "rc-mode": "cbr",
+            "tune": "low-latency",
+        },
+        "keyframe_property": "gop-size",
+        "parser": "h264parse",
+        "payloader": "rtph264pay config-interval=1",
+        "encoding_name": "H264",
+        "latency_ms": 3,
+        "hardware_path": "cuda",
+    },
+    "av1-nvenc": {
+        "element": "nvav1enc",
+        "bitrate_property": "bitrate",
+        "bitrate_scale": 1,
+        "format": "NV12",
+        "properties": {
+            "preset": "p4",
+            "rc-mode": "cbr",
+            "tune": "low-latency",
+        },
+        "keyframe_property": "gop-size",
+        "parser": "av1parse",
+        "payloader": "rtpav1pay",
+        "encoding_name": "AV1",
+        "latency_ms": 4,
+        "hardware_path": "cuda",
+    },
+}
+
+
+def parse_resolution(resolution):
+    """Parse "1280x720" into (1280, 720)"""
+    width, height = str(resolution).lower().split("x")
+    return int(width), int(height)
+
+
+def parse_v4l2_formats(output):
+    """Parse `v4l2-ctl --list-formats-ext` output into capture modes"""
+    modes = []
+    fourcc = None
+    size = None
+    for line in output.splitlines():
+        match = re.search(r"\[\d+\]: '(\w+)'", line)
+        if match:
+            fourcc = match.group(1)
+            size = None
+            continue
+        match = re.search(r"Size: Discrete (\d+)x(\d+)", line)
+        if match:
+            size = (int(match.group(1)), int(match.group(2)))
+            continue
+        match = re.search(r"Interval: Discrete [\d.]+s \(([\d.]+) fps\)", line)
+        if match and fourcc and size:
+            modes.append(
+                {
+                    "fourcc": fourcc,
+                    "format": V4L2_FORMATS.get(fourcc)
+                    or COMPRESSED_FORMATS.get(fourcc),
+                    "width": size[0],
+                    "height": size[1],
+                    "fps": round(float(match.group(1))),
+                }
+            )
+    return modes
+
+
+def list_device_modes(device=VIDEO_DEVICE):
+    """Query the capture device for its supported modes"""
+    try:
+        result = subprocess.run(
+            ["v4l2-ctl", f"--device={device}", "--list-formats-ext"],
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+        if result.returncode == 0:
+            return parse_v4l2_formats(result.stdout)
+    except (OSError, subprocess.TimeoutExpired):
+        pass
+    return []
+
+
+def bus_speed(device=VIDEO_DEVICE, sysfs="/sys"):
+    """USB link speed of the capture device in Mbit/s, or None (not USB)"""
+    name = os.path.basename(os.path.realpath(device))
+    interface = os.path.realpath(f"{sysfs}/class/video4linux/{name}/device")
+    try:
+        with open(os.path.join(os.path.dirname(interface), "speed")) as f:
+            return int(float(f.read()))
+    except (OSError, ValueError):
+        return None
+
+
+def bus_mbps(mode):
+    """Mbit/s a capture mode puts on the bus"""
+    pixels = mode["width"] * mode["height"] * mode["fps"]
+    return pixels * BUS_BYTES_PER_PIXEL[mode["format"]] * 8 / 1e6
+
+
+def capture_cost(mode, width, height, fps, output_format, hw_path=None, decoder=None):
+    """Relative CPU work per second to turn a capture mode into encoder input.
+
+    JPEG is decoded at the capture rate; videorate drops frames before
+    anything else runs, and with a hw_path scaling and conversion happen on
+    the GPU, leaving only the upload (free when DMABufs are imported).
+    """
+    rate = min(mode["fps"], fps)
+    captured = mode["width"] * mode["height"]
+    cost = 0.0
+    source_format = mode["format"]
+    if source_format == "MJPEG":
+        step = "jpegdec" if decoder in (None, "jpegdec") else "hw_jpegdec"
+        cost += captured * mode["fps"] * CAPTURE_COSTS[step]
+        if step == "hw_jpegdec":
+            return cost  # decoded into device memory
+        source_format = None  # decoder output, usually not the encoder's
+    if hw_path is not None:
+        if source_format is None or not hw_path["dmabuf"]:
+            cost += captured * rate * CAPTURE_COSTS["upload"]
+        return cost
+    if (mode["width"], mode["height"]) != (width, height):
+        cost += captured * rate * CAPTURE_COSTS["scale"]
+    if source_format != output_format:
+        cost += width * height * rate * CAPTURE_COSTS["convert"]
+    return cost
+
+
+def rank_capture_modes(
+    modes,
+    width,
+    height,
+    fps,
+    output_format="I420",
+    hw_path=None,
+    decoder="jpegdec",
+    capture_format="auto",
+    bus_speed_mbps=None,
+):
+    """Usable capture modes, cheapest first, each with its cost and bus load.
+
+    Modes must cover the output size and rate, and raw modes must fit the
+    USB link (when its speed is known). capture_format restricts the choice to one format;
+    decoder=None means no JPEG decoder is installed, ruling out MJPEG.
+    """
+    usable = USB_USABLE_MBPS.get(bus_speed_mbps)
+    if bus_speed_mbps and usable is None:
+        usable = bus_speed_mbps * 0.6
+    ranked = []
+    for mode in modes:
+        fmt = mode.get("format")
+        if fmt not in BUS_BYTES_PER_PIXEL:
+            continue
+        if capture_format != "auto" and fmt != capture_format:
+            continue
+        if fmt == "MJPEG" and decoder is None:
+            continue
+        if mode["width"] < width or mode["height"] < height or mode["fps"] < fps:
+            continue
+        mbps = bus_mbps(mode)
+        # MJPEG's rate is only an estimate; the card knows what fits
+        if usable is not None and mbps > usable and fmt != "MJPEG":
+            continue
+        cost = capture_cost(mode, width, height, fps, output_format, hw_path, decoder)
+        ranked.append(
+            {
+                **{k: mode[k] for k in ("format", "width", "height", "fps")},
+                "cost": round(cost / 1e6, 2),
+                "bus_mbps": round(mbps),
+            }
+        )
+    ranked.sort(
+        key=lambda m: (
+            m["cost"],
+            m["bus_mbps"],
+            (
+                RAW_FORMAT_PREFERENCE.index(m["format"])
+                if m["format"] in RAW_FORMAT_PREFERENCE
+                else len(RAW_FORMAT_PREFERENCE)
+            ),
+        )
+    )
+    return ranked
+
+
+def choose_capture_mode(modes, width, height, fps, **options):
+    """Pick the cheapest mode that covers the output size and rate.
+
+    See rank_capture_modes() for the options. When nothing covers the
+    target, the largest raw mode is used (scaled up), then the mode the
+    scripts assumed.
+    """
+    ranked = rank_capture_modes(modes, width, height, fps, **options)
+    if ranked:
+        return {k: ranked[0][k] for k in ("format", "width", "height", "fps")}
+    candidates = [m for m in modes if m.get("format") in RAW_FORMAT_PREFERENCE]
+    if not candidates:
+        return dict(FALLBACK_CAPTURE_MODE)
+    best = max(candidates, key=lambda m: (m["width"] * m["height"], m["fps"]))
+    return {k: best[k] for k in ("format", "width", "height", "fps")}
+
+
+def keyframe_distance(script_id, config):
+    """Frames between periodic keyframes for the config's interval and FPS"""
+    encoder = ENCODERS[script_id]
+    interval = float(config.get("keyframe_interval", DEFAULT_KEYFRAME_INTERVAL))
+    frames = max(1, round(interval * int(config["fps"])))
+    return min(frames, encoder.get("keyframe_max", frames))
+
+
+def encoder_properties(script_id, config):
+    """Element properties for a preset: bitrate, keyframe distance, tuning"""
+    encoder = ENCODERS[script_id]
+    return {
+        encoder["bitrate_property"]: int(config["bitrate"]) * encoder["bitrate_scale"],
+        encoder["keyframe_property"]: keyframe_distance(script_id, config),
+        **encoder["properties"],
+    }
+
+
+def encoder_latency_ms(script_id, config):
+    """Per-frame encode time the queues are sized for"""
+    latency = config.get("encoder_latency_ms")
+    if latency is None:
+        latency = ENCODERS[script_id].get(
+            "latency_ms", queue_policy.DEFAULT_ENCODER_LATENCY_MS
+        )
+    return float(latency)
+
+
+def video_queue(script_id, config):
+    """Queue in front of the encoder, sized by the config's queue policy"""
+    return queue_policy.describe(
+        queue_policy.video_limits(
+            config["fps"],
+            encoder_latency_ms(script_id, config),
+            queue_policy.policy_name(config),
+        )
+    )
+
+
+def rtp_queue(config):
+    """Queue after the video payloader"""
+    return queue_policy.describe(
+        queue_policy.rtp_limits(
+            config["fps"], config["bitrate"], queue_policy.policy_name(config)
+        )
+    )
+
+
+def audio_queue(config):
+    """Queue in front of opusenc"""
+    return queue_policy.describe(
+        queue_policy.audio_limits(queue_policy.policy_name(config))
+    )
+
+
+def format_properties(properties):
+    """Render an element property dict as gst-launch arguments"""
+    return " ".join(f"{key}={value}" for key, value in properties.items())
+
+
+def hardware_path(script_id, config, available=None):
+    """HARDWARE_PATHS entry for a preset, or None to convert on the CPU.
+
+    available is the set of installed elements (capabilities.py); a path
+    whose elements are missing falls back to videoconvert/videoscale. None
+    skips the check (dry runs). "hardware_memory": false turns it off.
+    """
+    path = HARDWARE_PATHS.get(ENCODERS[script_id].get("hardware_path"))
+    if path is None or not config.get("hardware_memory", True):
+        return None
+    if available is not None and not all(e in available for e in path["requires"]):
+        return None
+    return path
+
+
+def device_caps(hw_path, output_format, width, height):
+    """Caps for frames in the hardware path's memory"""
+    memory = hw_path["memory"]
+    return (
+        f'"video/x-raw({memory}),format={output_format},width={width},height={height}"'
+    )
+
+
+def build_video_source(capture_mode, device=VIDEO_DEVICE, test_source=False):
+    """Capture card, or a live test pattern in the same mode
+
+    An MJPEG mode is decoded right away by capture_mode["decoder"];
+    capture_mode["io_mode"] = "dmabuf" exports the capture buffers as
+    DMABufs, which VA-API imports without a copy.
+    """
+    if test_source:
+        source = "videotestsrc name=capture is-live=true pattern=smpte"
+    else:
+        source = f"v4l2src name=capture device={device}"
+        if capture_mode.get("io_mode"):
+            source += f" io-mode={capture_mode['io_mode']}"
+    size = "width={width},height={height},framerate={fps}/1".format(**capture_mode)
+    if capture_mode["format"] == "MJPEG":
+        return [source, f"image/jpeg,{size}", capture_mode.get("decoder", "jpegdec")]
+    return [source, f"video/x-raw,format={capture_mode['format']},{size}"]
+
+
+def build_branch_end(fake_sink=False):
+    """Terminate a branch at the WHIP sink (or a fakesink for tests)"""
+    return "fakesink sync=false" if fake_sink else "whip0."
+
+
+def build_capture_elements(
+    config,
+    capture_mode,
+    device=VIDEO_DEVICE,
+    test_source=False,
+    live_controls=False,
+    output_format="I420",
+    hw_path=None,
+):
+    """Capture -> drop frames -> scale -> convert
+
+    live_controls keeps videorate and videoscale in the pipeline even when
+    the capture mode already matches, so FPS and resolution can be changed
+    on the running pipeline. With a hw_path the frames are scaled and
+    converted on the device and leave in its memory.
+    """
+    width, height = parse_resolution(config["resolution"])
+    fps = int(config["fps"])
+
+    elements = build_video_source(capture_mode, device, test_source)
+    if live_controls or capture_mode["fps"] != fps:
+        elements.append(f"videorate name=rate drop-only=true max-rate={fps}")
+    if hw_path is not None:
+        return elements + build_device_scale(hw_path, output_format, width, height)
+    if live_controls or (capture_mode["width"], capture_mode["height"]) != (
+        width,
+        height,
+    ):
+        elements.append("videoscale method=0 add-borders=true n-threads=4")
+    elements.append(
+        f"capsfilter name=scale_caps caps=video/x-raw,width={width},height={height}"
+    )
+    if capture_mode["format"] != output_format:
+        elements.append("videoconvert n-threads=2")
+    elements.append(f"video/x-raw,format={output_format}")
+    return elements
+
+
+def build_device_scale(
+    hw_path, output_format, width, height, name="scale_caps", upload=True
+):
+    """Upload (unless already on the device) -> convert and scale on the GPU"""
+    elements = list(hw_path["upload"]) if upload else []
+    elements.append(hw_path["scaler"])
+    elements.append(
+        f"capsfilter name={name} "
+        f"caps={device_caps(hw_path, output_format, width, height)}"
+    )
+    return elements
+
+
+def named(element, name):
+    """Give an element description (e.g. a video_queue() one) a name"""
+    factory, _, properties = element.partition(" ")
+    return f"{factory} name={name} {properties}".rstrip()
+
+
+def build_encode_elements(
+    script_id,
+    config,
+    fake_sink=False,
+    encoder_name="venc",
+    queue_prefix=None,
+    payloader_name=None,
+    end=None,
+    sfu=False,
+):
+    """Encode -> RTP, starting from raw frames in the encoder's format
+
+    The queues are named queue_video/queue_rtp_video (pipeline_metrics
+    reports them under those names). queue_prefix names them "<prefix>enc"
+    and "<prefix>rtp" instead; their streaming threads (and the encoder's
+    worker threads, which inherit the name) then show up under that name
+    in /proc. sfu puts a tee (sfu_video) in front of the payloader for the
+    built-in WHEP server's viewers (whep_sfu.py).
+    """
+    encoder = ENCODERS[script_id]
+    properties = encoder_properties(script_id, config)
+
+    elements = [
+        named(
+            video_queue(script_id, config),
+            f"{queue_prefix}enc" if queue_prefix else "queue_video",
+        ),
+        f"{encoder['element']} name={encoder_name} {format_properties(properties)}",
+    ]
+    if encoder["parser"]:
+        elements.append(encoder["parser"])
+    if sfu:
+        elements.append("tee name=sfu_video allow-not-linked=true")
+    payloader = f"{encoder['payloader']} pt=96"
+    elements.append(named(payloader, payloader_name) if payloader_name else payloader)
+    elements.append(
+        named(
+            rtp_queue(config),
+            f"{queue_prefix}rtp" if queue_prefix else "queue_rtp_video",
+        )
+    )
+    elements.append(
+        f"application/x-rtp,media=video,encoding-name={encoder['encoding_name']},"
+        "payload=96,clock-rate=90000"
+    )
+    elements.append(end or build_branch_end(fake_sink))
+    return elements
+
+
+def build_video_branch(
+    script_id,
+    config,
+    capture_mode,
+    device=VIDEO_DEVICE,
+    test_source=False,
+    fake_sink=False,
+    live_controls=False,
+    hw_path=None,
+    sfu=False,
+):
+    """Capture -> drop frames -> scale -> convert -> encode -> RTP"""
+    elements = build_capture_elements(
+        config,
+        capture_mode,
+        device,
+        test_source=test_source,
+        live_controls=live_controls,
+        output_format=ENCODERS[script_id]["format"],
+        hw_path=hw_path,
+    )
+    elements += build_encode_elements(script_id, config, fake_sink, sfu=sfu)
+    return " ! ".join(elements)
+
+
+def build_audio_branch(config, test_source=False, fake_sink=False, end=None, sfu=False):
+    """PulseAudio -> Opus -> RTP (sfu: tee sfu_audio after the encoder)"""
+    audio_bitrate = int(config.get("audio_bitrate", 192)) * 1000
+    source = "audiotestsrc is-live=true wave=sine" if test_source else "pulsesrc"
+    elements = [
+        source,
+        "audioconvert",
+        "audioresample",
+        "audio/x-raw,rate=48000,channels=2",
+        named(audio_queue(config), "queue_audio"),
+        f"opusenc name=aenc bitrate={audio_bitrate} audio-type=generic frame-size=20",
+    ]
+    if sfu:
+        elements.append("tee name=sfu_audio allow-not-linked=true")
+    elements += [
+        "rtpopuspay pt=97",
+        named(
+            queue_policy.describe(
+                queue_policy.audio_rtp_limits(queue_policy.policy_name(config))
+            ),
+            "queue_rtp_audio",
+        ),
+        "application/x-rtp,media=audio,encoding-name=OPUS,payload=97,clock-rate=48000",
+        end or build_branch_end(fake_sink),
+    ]
+    return " ! ".join(elements)
+
+
+def build_sink(config, server_url=SERVER_URL, name="whip0", stream_key=None):
+    """WHIP sink shared by the audio and video branches"""
+    stream_key = stream_key or config["stream_key"]
+    sink = (
+        f"whipclientsink name={name} "
+        f"signaller::whip-endpoint={shlex.quote(server_url)} "
+        f"signaller::auth-token={shlex.quote(stream_key)}"
+    )
+    if config.get("adaptive_bitrate"):
+        # abr.py owns the encoder bitrate; keep the sink's own GCC out of it
+        sink += " congestion-control=disabled"
+    return sink
+
+
+def jpeg_decoder(hw_path=None, available=None):
+    """Decoder for MJPEG capture: the hardware path's if installed, else
+    jpegdec; None when neither is (available=None assumes both are)"""
+    for element in ((hw_path or {}).get("jpeg_decoder"), "jpegdec"):
+        if element and (available is None or element in available):
+            return element
+    return None
+
+
+def resolve_capture_mode(
+    config,
+    device_modes=None,
+    device=VIDEO_DEVICE,
+    test_source=False,
+    output_format="I420",
+    hw_path=None,
+    available=None,
+):
+    """Capture mode for the config, probing the device if no modes are given.
+
+    config["capture_format"] ("auto", "NV12", "YUY2", "MJPEG", ...) and
+    config["capture_io_mode"] ("auto", "mmap", "dmabuf") override the
+    choice. The USB link speed is read from sysfs unless
+    config["capture_bus_mbps"] sets it.
+    """
+    width, height = parse_resolution(config["resolution"])
+    fps = int(config["fps"])
+    if device_modes is None and test_source:
+        # Generate the pattern directly in the output mode
+        device_modes = [
+            {"format": "YUY2", "width": width, "height": height, "fps": fps}
+        ]
+    elif device_modes is None:
+        device_modes = list_device_modes(device)
+    bus_speed_mbps = config.get("capture_bus_mbps")
+    if bus_speed_mbps:
+        bus_speed_mbps = int(bus_speed_mbps)
+    elif not test_source:
+        bus_speed_mbps = bus_speed(device)
+
+    decoder = jpeg_decoder(hw_path, available)
+    mode = choose_capture_mode(
+        device_modes,
+        width,
+        height,
+        fps,
+        output_format=output_format,
+        hw_path=hw_path,
+        decoder=decoder,
+        capture_format=config.get("capture_format", "auto"),
+        bus_speed_mbps=bus_speed_mbps,
+    )
+    if mode["format"] == "MJPEG":
+        mode["decoder"] = decoder or "jpegdec"
+    io_mode = config.get("capture_io_mode", "auto")
+    if io_mode == "auto":
+        raw_import = hw_path is not None and hw_path["dmabuf"]
+        io_mode = "dmabuf" if raw_import and mode["format"] != "MJPEG" else None
+    mode["io_mode"] = io_mode
+    return mode
+
+
+def explain_capture(
+    script_id, config, device_modes=None, device=VIDEO_DEVICE, available=None
+):
+    """The capture mode a start would use, plus every candidate with its cost"""
+    if device_modes is None:
+        device_modes = list_device_modes(device)
+    width, height = parse_resolution(config["resolution"])
+    hw_path = hardware_path(script_id, config, available)
+    output_format = ENCODERS[script_id]["format"]
+    chosen = resolve_capture_mode(
+        config,
+        device_modes,
+        device,
+        output_format=output_format,
+        hw_path=hw_path,
+        available=available,
+    )
+    bus = config.get("capture_bus_mbps")
+    ranked = rank_capture_modes(
+        device_modes,
+        width,
+        height,
+        int(config["fps"]),
+        output_format=output_format,
+        hw_path=hw_path,
+        decoder=jpeg_decoder(hw_path, available),
+        bus_speed_mbps=int(bus) if bus else bus_speed(device),
+    )
+    return {"chosen": chosen, "ranked": ranked}
+
+
+def build_pipeline(
+    script_id,
+    config,
+    device_modes=None,
+    device=VIDEO_DEVICE,
+    server_url=SERVER_URL,
+    test_source=False,
+    fake_sink=False,
+    live_controls=False,
+    available=None,
+    sfu=False,
+):
+    """Build the full gst-launch-1.0 description for a preset.
+
+    device_modes is the parsed output of list_device_modes(); pass it in to
+    avoid probing the device (dry runs, tests). test_source and fake_sink
+    swap the capture card, PulseAudio and WHIP for videotestsrc,
+    audiotestsrc and fakesink. available is the set of installed elements,
+    for choosing the hardware scale/convert path. sfu adds the tees the
+    built-in WHEP server attaches viewers to.
+    """
+    if script_id not in ENCODERS:
+        raise ValueError(f"Unknown script: {script_id}")
+
+    hw_path = hardware_path(script_id, config, available)
+    capture_mode = resolve_capture_mode(
+        config,
+        device_modes,
+        device,
+        test_source,
+        output_format=ENCODERS[script_id]["format"],
+        hw_path=hw_path,
+        available=available,
+    )
+    branches = [
+        build_video_branch(
+            script_id,
+            config,
+            capture_mode,
+            device,
+            test_source=test_source,
+            fake_sink=fake_sink,
+            live_controls=live_controls,
+            hw_path=hw_path,
+            sfu=sfu,
+        ),
+        build_audio_branch(
+            config, test_source=test_source, fake_sink=fake_sink, sfu=sfu
+        ),
+    ]
+    if not fake_sink:
+        branches.append(build_sink(config, server_url))
+    return "  ".join(branches)
+
+
+def rendition_stream_key(config, index, rendition):
+    """Broadcast Box stream key for a simulcast rendition.
+
+    The first rendition keeps the main stream key so existing viewer links
+    keep working; the others get "<stream_key>-<name>".
+    """
+    if rendition.get("stream_key"):
+        return rendition["stream_key"]
+    if index == 0:
+        return config["stream_key"]
+    return f"{config['stream_key']}-{rendition['name']}"
+
+
+def rendition_config(config, rendition):
+    """The config one simulcast rendition is encoded with: its own rate and
+    bitrate set the keyframe distance and the queue limits"""
+    return {**config, "bitrate": rendition["bitrate"], "fps": rendition["fps"]}
+
+
+def build_simulcast_pipeline(
+    script_id,
+    config,
+    device_modes=None,
+    device=VIDEO_DEVICE,
+    server_url=SERVER_URL,
+    test_source=False,
+    fake_sink=False,
+    available=None,
+):
+    """Capture and scale once, then encode every config["renditions"] entry.
+
+    The capture is scaled to the largest rendition and split with a tee;
+    each rendition drops/scales from there, gets its own encoder and its own
+    WHIP session (stream key). Rendition i runs in the streaming threads of
+    the queues "r<i>scale", "r<i>enc" and "r<i>rtp", which is how /api/stats
+    attributes CPU to it.
+    """
+    if script_id not in ENCODERS:
+        raise ValueError(f"Unknown script: {script_id}")
+    renditions = config["renditions"]
+    if not renditions:
+        raise ValueError("Simulcast needs at least one rendition")
+
+    largest = max(
+        renditions,
+        key=lambda r: (
+            parse_resolution(r["resolution"])[0] * parse_resolution(r["resolution"])[1]
+        ),
+    )
+    capture_config = {
+        **config,
+        "resolution": largest["resolution"],
+        "fps": max(int(r["fps"]) for r in renditions),
+    }
+    encoder_format = ENCODERS[script_id]["format"]
+    hw_path = hardware_path(script_id, config, available)
+    capture_mode = resolve_capture_mode(
+        capture_config,
+        device_modes,
+        device,
+        test_source,
+        output_format=encoder_format,
+        hw_path=hw_path,
+        available=available,
+    )
+    capture = build_capture_elements(
+        capture_config,
+        capture_mode,
+        device,
+        test_source=test_source,
+        output_format=encoder_format,
+        hw_path=hw_path,
+    )
+    branches = [" ! ".join(capture + ["tee name=vt"])]
+
+    # One Opus encode shared by every WHIP session
+    audio_end = "fakesink sync=false" if fake_sink else "tee name=at"
+    branches.append(build_audio_branch(config, test_source=test_source, end=audio_end))
+
+    for index, rendition in enumerate(renditions):
+        width, height = parse_resolution(rendition["resolution"])
+        sink_name = f"whip{index}"
+        end = "fakesink sync=false" if fake_sink else f"{sink_name}."
+        elements = [
+            "vt.",
+            f"queue name=r{index}scale max-size-buffers=2 leaky=downstream",
+            f"videorate name=rate{index} drop-only=true max-rate={int(rendition['fps'])}",
+        ]
+        if hw_path is not None:
+            # Already in device memory after the shared capture
+            elements += build_device_scale(
+                hw_path,
+                encoder_format,
+                width,
+                height,
+                name=f"scale_caps{index}",
+                upload=False,
+            )
+        else:
+            elements += [
+                "videoscale method=0 add-borders=true",
+                f"capsfilter name=scale_caps{index} "
+                f"caps=video/x-raw,width={width},height={height}",
+            ]
+        elements += build_encode_elements(
+            script_id,
+            rendition_config(config, rendition),
+            encoder_name=f"venc{index}",
+            queue_prefix=f"r{index}",
+            end=end,
+        )
+        branches.append(" ! ".join(elements))
+        if not fake_sink:
+            branches.append(f"at. ! {audio_queue(config)} ! {sink_name}.")
+            branches.append(
+                build_sink(
+                    config,
+                    server_url,
+                    name=sink_name,
+                    stream_key=rendition_stream_key(config, index, rendition),
+                )
+            )
+    return "  ".join(branches)
+
+
+def shm_caps(config, output_format=SHM_FORMAT):
+    """Caps of the frames the capture stage publishes"""
+    width, height = parse_resolution(config["resolution"])
+    return (
+        f"video/x-raw,format={output_format},width={width},height={height},"
+        f"framerate={int(config['fps'])}/1"
+    )
+
+
+def build_capture_stage(
+    config,
+    device_modes=None,
+    device=VIDEO_DEVICE,
+    socket_path=SHM_SOCKET,
+    test_source=False,
+    available=None,
+):
+    """Persistent capture stage: capture -> drop -> scale -> I420 -> shmsink.
+
+    Encoder stages attach with shmsrc and can come and go (or run several at
+    once) without the capture device being reopened.
+    """
+    width, height = parse_resolution(config["resolution"])
+    capture_mode = resolve_capture_mode(
+        config, device_modes, device, test_source, available=available
+    )
+    # Room for SHM_FRAMES I420 frames so a slow encoder doesn't stall capture
+    shm_size = width * height * 3 // 2 * SHM_FRAMES
+
+    elements = build_capture_elements(config, capture_mode, device, test_source)
+    elements.append(
+        f"shmsink name=shm socket-path={shlex.quote(str(socket_path))} "
+        f"shm-size={shm_size} wait-for-connection=false sync=false"
+    )
+    return " ! ".join(elements)
+
+
+def build_encoder_stage(
+    script_id,
+    config,
+    socket_path=SHM_SOCKET,
+    server_url=SERVER_URL,
+    test_source=False,
+    fake_sink=False,
+    live_controls=False,
+    available=None,
+    sfu=False,
+):
+    """Encoder stage fed by the capture stage's shared memory
+
+    live_controls adds videorate/videoscale after the shared memory so the
+    engine can lower FPS and resolution on the running stage.
+    """
+    if script_id not in ENCODERS:
+        raise ValueError(f"Unknown script: {script_id}")
+
+    encoder_format = ENCODERS[script_id]["format"]
+    width, height = parse_resolution(config["resolution"])
+    hw_path = hardware_path(script_id, config, available)
+    elements = [
+        f"shmsrc name=capture socket-path={shlex.quote(str(socket_path))} "
+        "is-live=true do-timestamp=true",
+        shm_caps(config),
+    ]
+    if live_controls:
+        elements.append(
+            f"videorate name=rate drop-only=true max-rate={int(config['fps'])}"
+        )
+    if hw_path is not None:
+        elements += build_device_scale(hw_path, encoder_format, width, height)
+    elif live_controls:
+        elements += [
+            "videoscale method=0 add-borders=true n-threads=4",
+            f"capsfilter name=scale_caps caps=video/x-raw,width={width},height={height}",
+        ]
+    if hw_path is None and encoder_format != SHM_FORMAT:
+        elements.append("videoconvert n-threads=2")
+        elements.append(f"video/x-raw,format={encoder_format}")
+    elements += build_encode_elements(script_id, config, fake_sink, sfu=sfu)
+
+    branches = [
+        " ! ".join(elements),
+        build_audio_branch(
+            config, test_source=test_source, fake_sink=fake_sink, sfu=sfu
+        ),
+    ]
+    if not fake_sink:
+        branches.append(build_sink(config, server_url))
+    return "  ".join(branches)
+
+
+def pipeline_argv(description):
+    """Command line for running a description with gst-launch-1.0"""
+    return ["gst-launch-1.0", "-e"] + shlex.split(description)
+
+
+def self_check(formats_file=RECORDED_FORMATS):
+    """Capture mode selection against a recorded device listing, and the
+    per-rendition encoder settings of a simulcast dry run"""
+    failures = []
+    modes = parse_v4l2_formats(Path(formats_file).read_text())
+    listed = {m["format"] for m in modes}
+    if listed != {"MJPEG", "YUY2", "NV12"}:
+        failures.append(f"parsed formats: {sorted(f or '?' for f in listed)}")
+
+    for script_id, overrides, available, expected in SELF_CHECKS:
+        config = {"resolution": "1280x720", "fps": 60, "capture_bus_mbps": 5000}
+        config.update(overrides)
+        mode = resolve_capture_mode(
+            config,
+            modes,
+            output_format=ENCODERS[script_id]["format"],
+            hw_path=hardware_path(script_id, config, available),
+            available=available,
+        )
+        wrong = {k: mode.get(k) for k, v in expected.items() if mode.get(k) != v}
+        print(f"{script_id} {json.dumps(overrides)}: {json.dumps(mode)}")
+        if wrong:
+            failures.append(f"{script_id} {overrides}: {wrong}, expected {expected}")
+
+    # The link speed comes from the USB device above the V4L2 interface
+    with tempfile.TemporaryDirectory() as sysfs:
+        interface = Path(sysfs, "devices/usb2/2-1/2-1:1.0")
+        interface.mkdir(parents=True)
+        (interface.parent / "speed").write_text("5000\n")
+        node = Path(sysfs, "class/video4linux/video9")
+        node.mkdir(parents=True)
+        (node / "device").symlink_to(interface)
+        speed = bus_speed("/dev/video9", sysfs)
+        if speed != 5000:
+            failures.append(f"bus speed: {speed}")
+        if bus_speed("/dev/video8", sysfs) is not None:
+            failures.append("bus speed of a device that is not there")
+
+    # Each rendition's GOP and encoder queue follow its own frame rate
+    config = {
+        "resolution": "1280x720",
+        "fps": 60,
+        "bitrate": 5000,
+        "audio_bitrate": 128,
+        "stream_key": "test",
+        "renditions": DEFAULT_RENDITIONS,
+    }
+    for script_id, encoder in ENCODERS.items():
+        description = build_simulcast_pipeline(
+            script_id, config, test_source=True, fake_sink=True
+        )
+        for index, rendition in enumerate(DEFAULT_RENDITIONS):
+            own = {**config, "fps": rendition["fps"]}
+            gop = re.search(
+                rf"name=venc{index} [^!]*{encoder['keyframe_property']}=(\d+)",
+                description,
+            )
+            queue = re.search(
+                rf"queue name=r{index}enc [^!]*max-size-time=(\d+)", description
+            )
+            limits = queue_policy.video_limits(
+                own["fps"], encoder_latency_ms(script_id, own)
+            )
+            if not gop or int(gop.group(1)) != keyframe_distance(script_id, own):
+                failures.append(
+                    f"{script_id} {rendition['name']}: GOP {gop and gop[1]}"
+                )
+            if not queue or int(queue.group(1)) != limits["time_ns"]:
+                failures.append(
+                    f"{script_id} {rendition['name']}: queue {queue and queue[1]}"
+                )
+    print(f"Simulcast GOP and queues checked for {len(ENCODERS)} presets")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("PASS" if not failures else "FAILED")
+    return 0 if not failures else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build streaming pipelines")
+    parser.add_argument("script_id", nargs="?", choices=sorted(ENCODERS))
+    parser.add_argument("--config", type=Path, help="stream_config.json to read")
+    parser.add_argument("--resolution")
+    parser.add_argument("--fps", type=int)
+    parser.add_argument("--bitrate", type=int)
+    parser.add_argument(
+        "--keyframe-interval", type=float, help="seconds between periodic keyframes"
+    )
+    parser.add_argument("--queue-policy", choices=queue_policy.POLICIES)
+    parser.add_argument(
+        "--encoder-latency-ms",
+        type=float,
+        help="per-frame encode time the queues are sized for",
+    )
+    parser.add_argument("--stream-key")
+    parser.add_argument("--device", default=VIDEO_DEVICE)
+    parser.add_argument(
+        "--formats-file",
+        type=Path,
+        help="recorded `v4l2-ctl --list-formats-ext` output instead of probing",
+    )
+    parser.add_argument(
+        "--test-source",
+        action="store_true",
+        help="use videotestsrc/audiotestsrc instead of the capture card",
+    )
+    parser.add_argument(
+        "--fake-sink",
+        action="store_true",
+        help="end in fakesink instead of publishing over WHIP",
+    )
+    parser.add_argument(
+        "--stage",
+        choices=["full", "capture", "encoder"],
+        default="full",
+        help="whole pipeline, or one side of the shared-memory split",
+    )
+    parser.add_argument("--socket-path", default=SHM_SOCKET)
+    parser.add_argument(
+        "--simulcast",
+        action="store_true",
+        help="encode every rendition in the config's renditions list",
+    )
+    parser.add_argument(
+        "--capture-format",
+        help="capture format instead of the cheapest (NV12, YUY2, MJPEG, ...)",
+    )
+    parser.add_argument("--capture-io-mode", choices=["auto", "mmap", "dmabuf"])
+    parser.add_argument(
+        "--bus-speed", type=int, help="USB link speed in Mbit/s (480, 5000, ...)"
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="rank the capture modes by cost instead of building a pipeline",
+    )
+    parser.add_argument(
+        "--no-hardware-memory",
+        action="store_true",
+        help="convert and scale on the CPU even for hardware encoders",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the pipeline instead of running it",
+    )
+    parser.add_argument(
+        "--self-check",
+        action="store_true",
+        help="check the capture mode choices against a recorded listing "
+        "(--formats-file, default testdata/v4l2-usb3-capture.txt)",
+    )
+    args = parser.parse_args()
+
+    if args.self_check:
+        return self_check(args.formats_file or RECORDED_FORMATS)
+    if args.script_id is None:
+        parser.error("script_id is required")
+
+    config = {
+        "resolution": "1280x720",
+        "fps": 60,
+        "bitrate": 5000,
+        "audio_bitrate": 192,
+        "stream_key": "gaming",
+        "renditions": DEFAULT_RENDITIONS,
+    }
+    if args.config and args.config.exists():
+        config.update(json.loads(args.config.read_text()))
+    for key in (
+        "resolution",
+        "fps",
+        "bitrate",
+        "keyframe_interval",
+        "queue_policy",
+        "encoder_latency_ms",
+        "stream_key",
+    ):
+        value = getattr(args, key)
+        if value is not None:
+            config[key] = value
+    for key in ("capture_format", "capture_io_mode"):
+        if getattr(args, key):
+            config[key] = getattr(args, key)
+    if args.bus_speed:
+        config["capture_bus_mbps"] = args.bus_speed
+    if args.no_hardware_memory:
+        config["hardware_memory"] = False
+
+    modes = None
+    if args.formats_file:
+        modes = parse_v4l2_formats(args.formats_file.read_text())
+
+    if args.explain:
+        explained = explain_capture(args.script_id, config, modes, args.device)
+        print(json.dumps(explained, indent=2))
+        return 0
+
+    if args.simulcast:
+        description = build_simulcast_pipeline(
+            args.script_id,
+            config,
+            modes,
+            args.device,
+            test_source=args.test_source,
+            fake_sink=args.fake_sink,
+        )
+    elif args.stage == "capture":
+        description = build_capture_stage(
+            config, modes, args.device, args.socket_path, args.test_source
+        )
+    elif args.stage == "encoder":
+        description = build_encoder_stage(
+            args.script_id,
+            config,
+            args.socket_path,
+            test_source=args.test_source,
+            fake_sink=args.fake_sink,
+        )
+    else:
+        description = build_pipeline(
+            args.script_id,
+            config,
+            modes,
+            args.device,
+            test_source=args.test_source,
+            fake_sink=args.fake_sink,
+        )
+    if args.dry_run:
+        print("gst-launch-1.0 -e " + description.replace(" ! ", " \\\n  ! "))
+        return 0
+
+    return subprocess.call(pipeline_argv(description))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
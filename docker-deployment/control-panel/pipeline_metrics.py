@@ -0,0 +1,281 @@
+"""
+Per-element latency and queue-depth metrics for the running pipeline
+
+Two feeds end up in the same PipelineMetrics store:
+  * gst-launch pipelines run with GStreamer's "latency(flags=element)"
+    tracer writing to a FIFO that TracerReader drains;
+  * the in-process engine gets pad probes and queue polling (EngineProbes).
+
+Queue levels come only from the engine's polling: core GStreamer has no
+tracer that logs them, so the gst-launch modes report them as unavailable.
+
+Samples are kept in bounded rolling windows and summarised as histograms
+and percentiles for /api/pipeline/metrics.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from gst_engine import Gst
+
+TRACERS = "latency(flags=element)"
+QUEUES_UNAVAILABLE = "queue levels are only sampled in engine mode"
+WINDOW_SECONDS = 30
+MAX_SAMPLES = 2000
+
+# Histogram bucket upper edges
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500]
+FILL_BUCKETS = [0.1, 0.25, 0.5, 0.75, 0.9, 1.0]
+
+# pipeline_builder queue names -> the queue-config.sh setting they mirror
+# (both sized by queue_policy.py)
+QUEUE_SETTINGS = {
+    "queue_video": "QUEUE_VIDEO",
+    "queue_audio": "QUEUE_AUDIO",
+    "queue_rtp_video": "QUEUE_RTP",
+    "queue_rtp_audio": "QUEUE_RTP_AUDIO",
+}
+# Simulcast rendition queues (r0enc, r0rtp, ...)
+_RENDITION_QUEUE = re.compile(r"^r\d+(enc|rtp)$")
+
+_FIELD = re.compile(r"([\w-]+)=\((?:string|guint64|uint|gint64|int)\)([^,;]+)")
+
+
+class RollingSeries:
+    """Timestamped samples in a bounded window"""
+
+    def __init__(self):
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def add(self, value, timestamp=None):
+        self.samples.append((timestamp or time.time(), value))
+
+    def values(self, window=WINDOW_SECONDS):
+        cutoff = time.time() - window
+        return [value for ts, value in self.samples if ts >= cutoff]
+
+
+def queue_setting(name):
+    """queue-config.sh setting a builder queue was created from"""
+    match = _RENDITION_QUEUE.match(name)
+    if match:
+        return "QUEUE_VIDEO" if match.group(1) == "enc" else "QUEUE_RTP"
+    return QUEUE_SETTINGS.get(name)
+
+
+def summarize(values, buckets):
+    """Percentiles plus a per-bucket histogram (keyed by upper edge)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def pick(pct):
+        return round(ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))], 3)
+
+    histogram = {}
+    for value in ordered:
+        edge = next((b for b in buckets if value <= b), "inf")
+        histogram[str(edge)] = histogram.get(str(edge), 0) + 1
+    return {
+        "count": len(ordered),
+        "p50": pick(50),
+        "p95": pick(95),
+        "p99": pick(99),
+        "max": round(ordered[-1], 3),
+        "histogram": histogram,
+    }
+
+
+class PipelineMetrics:
+    """Thread-safe store for element latencies and queue levels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.source = None
+        self.latency = {}
+        self.buffers = {}
+        self.queue_fill = {}
+        self.queue_current = {}
+        self.started = time.time()
+
+    def reset(self, source=None):
+        """Start over for a new pipeline (source: "tracer" or "probes")"""
+        with self._lock:
+            self.source = source
+            self.latency = {}
+            self.buffers = {}
+            self.queue_fill = {}
+            self.queue_current = {}
+            self.started = time.time()
+
+    def record_latency(self, element, ms):
+        with self._lock:
+            self.latency.setdefault(element, RollingSeries()).add(ms)
+            self.buffers[element] = self.buffers.get(element, 0) + 1
+
+    def record_queue(self, queue, level_buffers, max_buffers, level_time, max_time):
+        """Queue level; times in nanoseconds, a max of 0 means unlimited"""
+        fills = []
+        if max_buffers:
+            fills.append(level_buffers / max_buffers)
+        if max_time:
+            fills.append(level_time / max_time)
+        with self._lock:
+            self.queue_current[queue] = {
+                "level_buffers": level_buffers,
+                "max_buffers": max_buffers,
+                "level_time_ms": round(level_time / 1e6, 2),
+                "max_time_ms": round(max_time / 1e6, 2),
+            }
+            self.queue_fill.setdefault(queue, RollingSeries()).add(
+                max(fills) if fills else 0.0
+            )
+
+    def parse_tracer_line(self, line):
+        """Feed one GST_TRACER log line (the latency tracer's element-latency
+        records; everything else is ignored)"""
+        if "element-latency," in line:
+            fields = dict(_FIELD.findall(line))
+            if "element" in fields and "time" in fields:
+                self.record_latency(fields["element"], int(fields["time"]) / 1e6)
+
+    def totals(self):
+        """Buffers seen per element and the current queue levels"""
+        with self._lock:
+            return dict(self.buffers), dict(self.queue_current)
+
+    def snapshot(self, window=WINDOW_SECONDS):
+        with self._lock:
+            elements = {
+                name: summarize(series.values(window), LATENCY_BUCKETS_MS)
+                for name, series in self.latency.items()
+            }
+            queues = {}
+            for name, series in self.queue_fill.items():
+                queues[name] = {
+                    **self.queue_current.get(name, {}),
+                    "setting": queue_setting(name),
+                    "fill": summarize(series.values(window), FILL_BUCKETS),
+                }
+
+        elements = {k: v for k, v in elements.items() if v}
+        busiest = max(
+            (
+                (name, stats["p95"])
+                for name, stats in elements.items()
+                if not name.startswith("queue")
+            ),
+            key=lambda item: item[1],
+            default=None,
+        )
+        fullest = max(
+            ((name, q["fill"]["p95"]) for name, q in queues.items() if q["fill"]),
+            key=lambda item: item[1],
+            default=None,
+        )
+        unavailable = self.source == "tracer"
+        return {
+            "source": self.source,
+            "window_seconds": window,
+            "elements": elements,
+            "queues": None if unavailable else queues,
+            "queues_unavailable": QUEUES_UNAVAILABLE if unavailable else None,
+            "bottleneck": {
+                "element": busiest[0] if busiest else None,
+                "element_p95_ms": busiest[1] if busiest else None,
+                "queue": fullest[0] if fullest else None,
+                "queue_p95_fill": fullest[1] if fullest else None,
+            },
+        }
+
+
+def tracer_env(fifo_path):
+    """Environment that makes gst-launch write tracer records to the FIFO"""
+    return {
+        "GST_TRACERS": TRACERS,
+        "GST_DEBUG": "GST_TRACER:7",
+        "GST_DEBUG_FILE": str(fifo_path),
+        "GST_DEBUG_NO_COLOR": "1",
+    }
+
+
+class TracerReader(threading.Thread):
+    """Drains the tracer FIFO into a PipelineMetrics store.
+
+    The writer blocks on open() until this reader is there, and a full FIFO
+    would stall the pipeline, so reading never stops while the panel runs.
+    """
+
+    def __init__(self, fifo_path, metrics):
+        super().__init__(daemon=True)
+        self.fifo_path = str(fifo_path)
+        self.metrics = metrics
+        if os.path.exists(self.fifo_path):
+            os.unlink(self.fifo_path)
+        os.mkfifo(self.fifo_path, 0o600)
+
+    def run(self):
+        while True:
+            try:
+                # Each gst process (gst-inspect in scripts, gst-launch) opens
+                # and closes the FIFO; EOF just means wait for the next one
+                with open(self.fifo_path, "r", errors="replace") as fifo:
+                    for line in fifo:
+                        self.metrics.parse_tracer_line(line)
+            except Exception as e:
+                print(f"Tracer reader error: {e}")
+                time.sleep(1)
+
+
+class EngineProbes:
+    """Pad probes and queue polling for an in-process pipeline"""
+
+    def __init__(self, pipeline, metrics):
+        self.metrics = metrics
+        self.queues = []
+        self._pending = {}
+        iterator = pipeline.iterate_recurse()
+        while True:
+            result, element = iterator.next()
+            if result != Gst.IteratorResult.OK:
+                break
+            factory = element.get_factory()
+            if factory and factory.get_name() == "queue":
+                self.queues.append(element)
+            sink = element.get_static_pad("sink")
+            src = element.get_static_pad("src")
+            if sink is not None and src is not None:
+                self._watch(element.get_name(), sink, src)
+
+    def _watch(self, name, sink, src):
+        pending = self._pending.setdefault(name, {})
+
+        def on_in(pad, info):
+            pending[info.get_buffer().pts] = time.perf_counter()
+            if len(pending) > 500:
+                pending.clear()
+            return Gst.PadProbeReturn.OK
+
+        def on_out(pad, info):
+            started = pending.pop(info.get_buffer().pts, None)
+            if started is not None:
+                self.metrics.record_latency(
+                    name, (time.perf_counter() - started) * 1000
+                )
+            return Gst.PadProbeReturn.OK
+
+        sink.add_probe(Gst.PadProbeType.BUFFER, on_in)
+        src.add_probe(Gst.PadProbeType.BUFFER, on_out)
+
+    def sample_queues(self):
+        for queue in self.queues:
+            self.metrics.record_queue(
+                queue.get_name(),
+                queue.get_property("current-level-buffers"),
+                queue.get_property("max-size-buffers"),
+                queue.get_property("current-level-time"),
+                queue.get_property("max-size-time"),
+            )
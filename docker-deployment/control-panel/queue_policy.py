@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Queue limits from the frame interval and the encoder's latency
+
+The queues used to be fixed (scripts/queue-config.sh: 5-15 buffers and up
+to 500 ms in front of every encoder), which at 60 FPS lets a stalled
+encoder put half a second between capture and the wire before anything
+gives. The limits are now worked out from the stream's frame interval,
+its bitrate and how long the preset's encoder takes per frame, under one
+of two policies (the config's "queue_policy"):
+
+  latency     the queue in front of the encoder holds one frame interval
+              plus the encoder's latency and is leaky=downstream: when the
+              encoder falls behind, the oldest frame is dropped instead of
+              every later frame waiting behind it
+  smoothness  nothing is dropped: room for SMOOTHNESS_FRAMES intervals plus
+              an encoder stall of twice its usual latency, then
+              back-pressure to the capture
+
+scripts/queue-config.sh does the same arithmetic in shell. All times are
+whole nanoseconds so the two come out identical.
+
+    python3 queue_policy.py --fps 60 --bitrate 5000 --encoder-latency 12
+"""
+
+import argparse
+import json
+import sys
+
+POLICIES = ["latency", "smoothness"]
+DEFAULT_POLICY = "latency"
+
+# Per-frame encode time when neither the config nor the preset says
+DEFAULT_ENCODER_LATENCY_MS = 10
+# Frame intervals of headroom in smoothness mode
+SMOOTHNESS_FRAMES = 4
+
+# Opus frames (frame-size=20 in the builder) the audio queues hold
+AUDIO_FRAME_MS = 20
+AUDIO_FRAMES = {"latency": 3, "smoothness": 10}
+# pulsesrc's default buffer-time slices
+AUDIO_BUFFER_MS = 10
+
+# RTP: packets of one frame share a timestamp, so the time limit never
+# counts a keyframe burst; the buffer limit is sized for one
+RTP_PAYLOAD_BYTES = 1200
+KEYFRAME_SIZE_RATIO = 10
+RTP_FRAMES = {"latency": 1, "smoothness": SMOOTHNESS_FRAMES}
+# Output frame intervals the queue in front of videorate holds
+CAPTURE_FRAMES = {"latency": 1, "smoothness": SMOOTHNESS_FRAMES}
+
+NS_PER_MS = 1000000
+NS_PER_SECOND = 1000000000
+
+
+def policy_name(config):
+    """The config's queue policy, or the default for unknown values"""
+    policy = config.get("queue_policy", DEFAULT_POLICY)
+    return policy if policy in POLICIES else DEFAULT_POLICY
+
+
+def frame_ns(fps):
+    return NS_PER_SECOND // max(1, round(float(fps)))
+
+
+def video_limits(fps, encoder_latency_ms, policy=DEFAULT_POLICY):
+    """Limits of the raw video queue in front of the encoder"""
+    interval = frame_ns(fps)
+    encoder = round(float(encoder_latency_ms) * NS_PER_MS)
+    if policy == "latency":
+        wait = interval + encoder
+    else:
+        wait = SMOOTHNESS_FRAMES * interval + 2 * encoder
+    buffers = max(1, -(-wait // interval))
+    return {
+        "buffers": buffers,
+        "time_ns": buffers * interval,
+        "leaky": policy == "latency",
+    }
+
+
+def capture_limits(capture_fps, fps, policy=DEFAULT_POLICY):
+    """Limits of a queue between the capture and videorate (the scripts'
+    thread boundary), which sees every captured frame: output frame
+    intervals counted in capture frames, and no dropping, so a full queue
+    holds back the capture instead of leaking frames videorate would keep"""
+    interval = frame_ns(capture_fps)
+    wait = CAPTURE_FRAMES[policy] * frame_ns(fps)
+    buffers = max(1, -(-wait // interval))
+    return {"buffers": buffers, "time_ns": wait, "leaky": False}
+
+
+def audio_limits(policy=DEFAULT_POLICY):
+    """Limits of the raw audio queue in front of opusenc"""
+    time_ms = AUDIO_FRAMES[policy] * AUDIO_FRAME_MS
+    return {
+        "buffers": time_ms // AUDIO_BUFFER_MS,
+        "time_ns": time_ms * NS_PER_MS,
+        "leaky": False,
+    }
+
+
+def rtp_limits(fps, bitrate_kbps, policy=DEFAULT_POLICY):
+    """Limits of a video RTP queue after the payloader"""
+    frame_bytes = int(bitrate_kbps) * 1000 // 8 // max(1, round(float(fps)))
+    packets = max(1, -(-frame_bytes // RTP_PAYLOAD_BYTES))
+    frames = RTP_FRAMES[policy]
+    return {
+        "buffers": packets * (frames + KEYFRAME_SIZE_RATIO),
+        "time_ns": frames * frame_ns(fps),
+        "leaky": False,
+    }
+
+
+def audio_rtp_limits(policy=DEFAULT_POLICY):
+    """Limits of the audio RTP queue: one packet per Opus frame"""
+    frames = AUDIO_FRAMES[policy]
+    return {
+        "buffers": frames,
+        "time_ns": frames * AUDIO_FRAME_MS * NS_PER_MS,
+        "leaky": False,
+    }
+
+
+def describe(limits):
+    """A queue element description for a limits dict"""
+    description = (
+        f"queue max-size-buffers={limits['buffers']} "
+        f"max-size-time={limits['time_ns']} max-size-bytes=0"
+    )
+    return description + (" leaky=downstream" if limits["leaky"] else "")
+
+
+def worst_case_ms(fps, encoder_latency_ms, policy=DEFAULT_POLICY):
+    """Longest a frame can spend from the queue's input to the encoder's
+    output: a full queue ahead of it, then its own encode"""
+    limits = video_limits(fps, encoder_latency_ms, policy)
+    return round(limits["time_ns"] / NS_PER_MS + float(encoder_latency_ms), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue limits for a stream")
+    parser.add_argument("--fps", type=float, default=60)
+    parser.add_argument("--bitrate", type=int, default=5000, help="kbps")
+    parser.add_argument(
+        "--encoder-latency",
+        type=float,
+        default=DEFAULT_ENCODER_LATENCY_MS,
+        help="per-frame encode time in ms (benchmark.py latency_ms p95)",
+    )
+    parser.add_argument(
+        "--capture-fps", type=float, help="capture rate in front of videorate"
+    )
+    parser.add_argument("--policy", choices=POLICIES)
+    args = parser.parse_args()
+
+    report = {}
+    for policy in [args.policy] if args.policy else POLICIES:
+        report[policy] = {
+            "capture": describe(
+                capture_limits(args.capture_fps or args.fps, args.fps, policy)
+            ),
+            "video": describe(video_limits(args.fps, args.encoder_latency, policy)),
+            "audio": describe(audio_limits(policy)),
+            "rtp_video": describe(rtp_limits(args.fps, args.bitrate, policy)),
+            "rtp_audio": describe(audio_rtp_limits(policy)),
+            "worst_case_ms": worst_case_ms(args.fps, args.encoder_latency, policy),
+        }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,57 @@
 #!/bin/bash
-# Queue configuration for different resolutions
-# Usage: source ./queue-config.sh
+# Queue configuration sized from the frame rate and the encoder's latency
+# (the same arithmetic as queue_policy.py)
+# Usage: source ./queue-config.sh (after setting FPS, BITRATE and, when the
+# card captures faster than FPS, CAPTURE_FPS)
+#
+# QUEUE_POLICY=latency     the video queue holds one frame interval plus the
+#                          encoder latency and drops the oldest frame
+#                          (leaky) when the encoder falls behind
+# QUEUE_POLICY=smoothness  4 frame intervals plus twice the encoder latency,
+#                          no dropping
 
-# Video queue settings (non-leaky, time-based)
-QUEUE_VIDEO_LOW_RES="queue max-size-buffers=5 max-size-time=500000000 max-size-bytes=0"
-QUEUE_VIDEO_MID_RES="queue max-size-buffers=10 max-size-time=500000000 max-size-bytes=0"
-QUEUE_VIDEO_HIGH_RES="queue max-size-buffers=15 max-size-time=500000000 max-size-bytes=0"
+QUEUE_POLICY="${QUEUE_POLICY:-latency}"
+# Per-frame encode time in whole ms (benchmark.py reports latency_ms p95)
+ENCODER_LATENCY_MS="${ENCODER_LATENCY_MS:-10}"
 
-# Audio queue settings (increased from 1 to 10 buffers)
-QUEUE_AUDIO="queue max-size-buffers=10 max-size-time=200000000 max-size-bytes=0"
+_queue_fps="${FPS:-60}"
+_queue_bitrate="${BITRATE:-5000}"
+_capture_fps="${CAPTURE_FPS:-$_queue_fps}"
+_frame_ns=$((1000000000 / _queue_fps))
+_capture_frame_ns=$((1000000000 / _capture_fps))
+_encoder_ns=$((ENCODER_LATENCY_MS * 1000000))
 
-# RTP packet queue
-QUEUE_RTP="queue max-size-buffers=5 max-size-time=100000000 max-size-bytes=0"
+if [ "$QUEUE_POLICY" = "smoothness" ]; then
+    _wait_ns=$((4 * _frame_ns + 2 * _encoder_ns))
+    _leaky=""
+    _audio_frames=10
+    _rtp_frames=4
+    _capture_frames=4
+else
+    _wait_ns=$((_frame_ns + _encoder_ns))
+    _leaky=" leaky=downstream"
+    _audio_frames=3
+    _rtp_frames=1
+    _capture_frames=1
+fi
+
+# Video queue in front of the encoder (whole frames)
+_video_buffers=$(( (_wait_ns + _frame_ns - 1) / _frame_ns ))
+QUEUE_VIDEO="queue max-size-buffers=$_video_buffers max-size-time=$((_video_buffers * _frame_ns)) max-size-bytes=0$_leaky"
+
+# Queue between capture and videorate: it sees the capture rate, so it is
+# counted in capture frames, and it never leaks (a full queue holds back
+# the capture rather than dropping frames videorate would keep)
+_capture_wait_ns=$((_capture_frames * _frame_ns))
+QUEUE_CAPTURE="queue max-size-buffers=$(( (_capture_wait_ns + _capture_frame_ns - 1) / _capture_frame_ns )) max-size-time=$_capture_wait_ns max-size-bytes=0"
+
+# Audio queue in front of opusenc (20 ms Opus frames, 10 ms pulsesrc buffers)
+QUEUE_AUDIO="queue max-size-buffers=$((_audio_frames * 2)) max-size-time=$((_audio_frames * 20000000)) max-size-bytes=0"
+
+# RTP packet queue: room for a keyframe (~10 frames' worth of packets); the
+# packets of one frame share a timestamp, so the time limit skips bursts
+_frame_packets=$(( (_queue_bitrate * 1000 / 8 / _queue_fps + 1199) / 1200 ))
+[ "$_frame_packets" -lt 1 ] && _frame_packets=1
+QUEUE_RTP="queue max-size-buffers=$((_frame_packets * (_rtp_frames + 10))) max-size-time=$((_rtp_frames * _frame_ns)) max-size-bytes=0"
+# Audio RTP queue: one packet per Opus frame
+QUEUE_RTP_AUDIO="queue max-size-buffers=$_audio_frames max-size-time=$((_audio_frames * 20000000)) max-size-bytes=0"
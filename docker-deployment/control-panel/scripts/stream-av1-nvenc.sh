@@ -4,6 +4,9 @@
 STREAM_KEY="${STREAM_KEY:-gaming}"
 SERVER_URL="${SERVER_URL:-http://localhost:8080/api/whip}"
 VIDEO_DEVICE="${VIDEO_DEVICE:-/dev/video0}"
+# Seconds between periodic keyframes; viewers joining in between ask for
+# one (PLI), so this can be long
+KEYFRAME_INTERVAL="${KEYFRAME_INTERVAL:-10}"
 
 # Source queue configuration
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
@@ -19,17 +22,18 @@ echo
 # Video: AV1 with NVENC hardware encoding (RTX 40-series and newer)
 # Audio: High quality Opus encoding
 
-gst-launch-1.0 \
+# exec: the panel signals gst-launch itself; -e turns its SIGINT into EOS
+exec gst-launch-1.0 -e \
   v4l2src device="$VIDEO_DEVICE" \
   ! video/x-raw,width=1920,height=1080,framerate=60/1 \
   ! videoconvert \
   ! 'video/x-raw,format=NV12' \
-  ! $QUEUE_VIDEO_MID_RES \
+  ! $QUEUE_VIDEO \
   ! nvav1enc \
       preset=p4 \
       rc-mode=cbr \
       bitrate=6000000 \
-      gop-size=60 \
+      gop-size=$((60 * KEYFRAME_INTERVAL)) \
       tune=ll \
   ! av1parse \
   ! rtpav1pay \
@@ -44,7 +48,7 @@ gst-launch-1.0 \
   ! $QUEUE_AUDIO \
   ! opusenc bitrate=192000 \
   ! rtpopuspay \
-  ! $QUEUE_RTP \
+  ! $QUEUE_RTP_AUDIO \
   ! application/x-rtp,media=audio,encoding-name=OPUS,payload=97,clock-rate=48000 \
   ! whip0.sink_1 \
   \
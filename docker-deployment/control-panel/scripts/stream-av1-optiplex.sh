@@ -7,6 +7,9 @@ set -e
 STREAM_KEY="${STREAM_KEY:-gaming}"
 SERVER_URL="${SERVER_URL:-http://localhost:8080/api/whip}"
 VIDEO_DEVICE="${VIDEO_DEVICE:-/dev/video0}"
+# Seconds between periodic keyframes; viewers joining in between ask for
+# one (PLI), so this can be long
+KEYFRAME_INTERVAL="${KEYFRAME_INTERVAL:-10}"
 
 # Optimized for OptiPlex Pentium G3250T (4 cores, 3.5GHz, 8 threads)
 # Direct downscale: 1440p@144Hz → 720p@60Hz (2.07M → 0.92M pixels = 55% reduction)
@@ -14,6 +17,9 @@ RESOLUTION="${RESOLUTION:-1280x720}"
 FPS="${FPS:-60}"
 BITRATE="${BITRATE:-4000}"
 
+# The card's rate, ahead of videorate
+CAPTURE_FPS=144
+
 # Source queue configuration
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 source "$SCRIPT_DIR/queue-config.sh"
@@ -36,34 +42,39 @@ if [ ! -e "$VIDEO_DEVICE" ]; then
     exit 1
 fi
 
-# Validate Broadcast Box is running
-if ! curl -s --connect-timeout 3 "$SERVER_URL" > /dev/null 2>&1; then
-    echo "WARNING: Broadcast Box may not be running at $SERVER_URL"
-    echo "Attempting to start stream anyway..."
-    echo
-fi
-
-# Check for required GStreamer plugins
-REQUIRED_PLUGINS="v4l2src svtav1enc av1parse rtpav1pay whipclientsink pulsesrc opusenc rtpopuspay"
-for plugin in $REQUIRED_PLUGINS; do
-    if ! gst-inspect-1.0 "$plugin" > /dev/null 2>&1; then
-        echo "ERROR: Missing GStreamer plugin: $plugin"
-        echo "Please install required packages:"
-        echo "  sudo dnf install gstreamer1-plugins-base-tools gstreamer1-plugins-bad-free"
-        exit 1
+# The control panel probes plugins and the server once and caches the
+# result (capabilities.py); run the checks only when started by hand
+if [ -z "$SKIP_PREFLIGHT" ]; then
+    # Validate Broadcast Box is running
+    if ! curl -s --connect-timeout 3 "$SERVER_URL" > /dev/null 2>&1; then
+        echo "WARNING: Broadcast Box may not be running at $SERVER_URL"
+        echo "Attempting to start stream anyway..."
+        echo
     fi
-done
 
-gst-launch-1.0 \
+    # Check for required GStreamer plugins
+    REQUIRED_PLUGINS="v4l2src svtav1enc av1parse rtpav1pay whipclientsink pulsesrc opusenc rtpopuspay"
+    for plugin in $REQUIRED_PLUGINS; do
+        if ! gst-inspect-1.0 "$plugin" > /dev/null 2>&1; then
+            echo "ERROR: Missing GStreamer plugin: $plugin"
+            echo "Please install required packages:"
+            echo "  sudo dnf install gstreamer1-plugins-base-tools gstreamer1-plugins-bad-free"
+            exit 1
+        fi
+    done
+fi
+
+# exec: the panel signals gst-launch itself; -e turns its SIGINT into EOS
+exec gst-launch-1.0 -e \
   v4l2src device="$VIDEO_DEVICE" \
-  ! video/x-raw,width=2560,height=1440,framerate=144/1 \
+  ! video/x-raw,width=2560,height=1440,framerate=$CAPTURE_FPS/1 \
   ! videoconvert ! 'video/x-raw,format=I420' \
-  ! $QUEUE_VIDEO_LOW_RES \
+  ! $QUEUE_CAPTURE \
   ! videorate drop-only=true \
   ! video/x-raw,framerate=60/1 \
   ! videoscale method=0 add-borders=true n-threads=4 \
   ! video/x-raw,width=1280,height=720 \
-  ! $QUEUE_VIDEO_LOW_RES \
+  ! $QUEUE_VIDEO \
   ! svtav1enc \
       preset=10 \
       bitrate=$BITRATE \
@@ -73,7 +84,7 @@ gst-launch-1.0 \
       tile-columns=2 \
       tile-rows=1 \
       cpu-used=4 \
-      keyframe-interval=2 \
+      keyframe-interval=$KEYFRAME_INTERVAL \
       enable-overlays=0 \
       tune=1 \
   ! av1parse \
@@ -93,7 +104,7 @@ gst-launch-1.0 \
       inband-fec=false \
       complexity=8 \
   ! rtpopuspay pt=97 \
-  ! $QUEUE_RTP \
+  ! $QUEUE_RTP_AUDIO \
   ! application/x-rtp,media=audio,encoding-name=OPUS,payload=97,clock-rate=48000 \
   ! whip0.sink_1 \
   \
@@ -4,6 +4,9 @@
 STREAM_KEY="${STREAM_KEY:-gaming}"
 SERVER_URL="${SERVER_URL:-http://localhost:8080/api/whip}"
 VIDEO_DEVICE="${VIDEO_DEVICE:-/dev/video0}"
+# Seconds between periodic keyframes; viewers joining in between ask for
+# one (PLI), so this can be long
+KEYFRAME_INTERVAL="${KEYFRAME_INTERVAL:-10}"
 
 # Source queue configuration
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
@@ -19,16 +22,17 @@ echo
 # Video: AV1 with VA-API hardware encoding (Intel Arc/AMD RDNA3+)
 # Audio: High quality Opus encoding
 
-gst-launch-1.0 \
+# exec: the panel signals gst-launch itself; -e turns its SIGINT into EOS
+exec gst-launch-1.0 -e \
   v4l2src device="$VIDEO_DEVICE" \
   ! video/x-raw,width=1920,height=1080,framerate=60/1 \
   ! videoconvert \
   ! 'video/x-raw,format=NV12' \
-  ! $QUEUE_VIDEO_MID_RES \
+  ! $QUEUE_VIDEO \
   ! vaapiav1enc \
       rate-control=cbr \
       target-bitrate=6000 \
-      keyframe-period=60 \
+      keyframe-period=$((60 * KEYFRAME_INTERVAL)) \
       quality-level=7 \
       tune=hq \
   ! av1parse \
@@ -44,7 +48,7 @@ gst-launch-1.0 \
   ! $QUEUE_AUDIO \
   ! opusenc bitrate=192000 \
   ! rtpopuspay \
-  ! $QUEUE_RTP \
+  ! $QUEUE_RTP_AUDIO \
   ! application/x-rtp,media=audio,encoding-name=OPUS,payload=97,clock-rate=48000 \
   ! whip0.sink_1 \
   \
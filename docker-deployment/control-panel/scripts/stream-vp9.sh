@@ -5,6 +5,9 @@
 STREAM_KEY="${STREAM_KEY:-gaming}"
 SERVER_URL="${SERVER_URL:-http://localhost:8080/api/whip}"
 VIDEO_DEVICE="${VIDEO_DEVICE:-/dev/video0}"
+# Seconds between periodic keyframes; viewers joining in between ask for
+# one (PLI), so this can be long
+KEYFRAME_INTERVAL="${KEYFRAME_INTERVAL:-10}"
 
 # Optimized for OptiPlex Pentium G3250T (4 cores, 3.5GHz, 8 threads)
 # VP9 via libvpx: 20-30% lower CPU than SVT-AV1 for same quality
@@ -12,6 +15,9 @@ RESOLUTION="${RESOLUTION:-1280x720}"
 FPS="${FPS:-60}"
 BITRATE="${BITRATE:-5000}"
 
+# The card's rate, ahead of videorate
+CAPTURE_FPS=144
+
 # Source queue configuration
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 source "$SCRIPT_DIR/queue-config.sh"
@@ -19,7 +25,7 @@ source "$SCRIPT_DIR/queue-config.sh"
 echo "=== Optimized VP9 Streaming for OptiPlex ==="
 echo "CPU: Intel Pentium G3250T (4 cores, 3.5GHz)"
 echo "Capture: 2560x1440 @ 144Hz"
-echo "Output: 720p @ 60Hz"
+echo "Output: 720p @ ${FPS}Hz"
 echo "Bitrate: ${BITRATE} Kbps"
 echo "CPU Estimate: 30-40% (VP9 is 20-30% more efficient than AV1)"
 echo
@@ -34,34 +40,39 @@ if [ ! -e "$VIDEO_DEVICE" ]; then
     exit 1
 fi
 
-# Validate Broadcast Box is running
-if ! curl -s --connect-timeout 3 "$SERVER_URL" > /dev/null 2>&1; then
-    echo "WARNING: Broadcast Box may not be running at $SERVER_URL"
-    echo "Attempting to start stream anyway..."
-    echo
-fi
-
-# Check for required GStreamer plugins
-REQUIRED_PLUGINS="v4l2src vp9enc rtpvp9pay whipclientsink pulsesrc opusenc rtpopuspay"
-for plugin in $REQUIRED_PLUGINS; do
-    if ! gst-inspect-1.0 "$plugin" > /dev/null 2>&1; then
-        echo "ERROR: Missing GStreamer plugin: $plugin"
-        echo "Please install required packages:"
-        echo "  sudo dnf install gstreamer1-plugins-base-tools gstreamer1-plugins-bad-free"
-        exit 1
+# The control panel probes plugins and the server once and caches the
+# result (capabilities.py); run the checks only when started by hand
+if [ -z "$SKIP_PREFLIGHT" ]; then
+    # Validate Broadcast Box is running
+    if ! curl -s --connect-timeout 3 "$SERVER_URL" > /dev/null 2>&1; then
+        echo "WARNING: Broadcast Box may not be running at $SERVER_URL"
+        echo "Attempting to start stream anyway..."
+        echo
     fi
-done
 
-gst-launch-1.0 \
+    # Check for required GStreamer plugins
+    REQUIRED_PLUGINS="v4l2src vp9enc rtpvp9pay whipclientsink pulsesrc opusenc rtpopuspay"
+    for plugin in $REQUIRED_PLUGINS; do
+        if ! gst-inspect-1.0 "$plugin" > /dev/null 2>&1; then
+            echo "ERROR: Missing GStreamer plugin: $plugin"
+            echo "Please install required packages:"
+            echo "  sudo dnf install gstreamer1-plugins-base-tools gstreamer1-plugins-bad-free"
+            exit 1
+        fi
+    done
+fi
+
+# exec: the panel signals gst-launch itself; -e turns its SIGINT into EOS
+exec gst-launch-1.0 -e \
   v4l2src device="$VIDEO_DEVICE" \
-  ! video/x-raw,width=2560,height=1440,framerate=144/1 \
+  ! video/x-raw,width=2560,height=1440,framerate=$CAPTURE_FPS/1 \
   ! videoconvert ! 'video/x-raw,format=I420' \
-  ! $QUEUE_VIDEO_LOW_RES \
+  ! $QUEUE_CAPTURE \
   ! videorate drop-only=true \
-  ! video/x-raw,framerate=60/1 \
+  ! video/x-raw,framerate=$FPS/1 \
   ! videoscale method=0 add-borders=true n-threads=4 \
   ! video/x-raw,width=1280,height=720 \
-  ! $QUEUE_VIDEO_LOW_RES \
+  ! $QUEUE_VIDEO \
   ! vp9enc \
       cpu-used=4 \
       target-bitrate=$BITRATE \
@@ -71,6 +82,7 @@ gst-launch-1.0 \
       cq-level=10 \
       threads=4 \
       static-threshold=100 \
+      keyframe-max-dist=$((FPS * KEYFRAME_INTERVAL)) \
   ! rtpvp9pay pt=96 \
   ! $QUEUE_RTP \
   ! application/x-rtp,media=video,encoding-name=VP9,payload=96,clock-rate=90000 \
@@ -87,7 +99,7 @@ gst-launch-1.0 \
       inband-fec=false \
       complexity=8 \
   ! rtpopuspay pt=97 \
-  ! $QUEUE_RTP \
+  ! $QUEUE_RTP_AUDIO \
   ! application/x-rtp,media=audio,encoding-name=OPUS,payload=97,clock-rate=48000 \
   ! whip0.sink_1 \
   \
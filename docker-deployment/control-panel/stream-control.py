@@ -3,22 +3,42 @@
 Container-friendly web control panel for streaming
 """
 
+import asyncio
 import subprocess
 import json
 import os
+import re
 import psutil
 import time
-import signal
-from flask import Flask, render_template, jsonify, request, Response
+from quart import Quart, render_template, jsonify, request, Response
 from pathlib import Path
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from flask_socketio import SocketIO, emit
+from socketio import ASGIApp, AsyncServer
+from hypercorn.asyncio import serve
+from hypercorn.config import Config as HypercornConfig
 from threading import Thread
 
-app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading")
+import abr
+import capabilities
+import exporter
+import gpu_monitor
+import governor
+import gst_engine
+import latency_probe
+import log_follower
+import pipeline_builder
+import pipeline_metrics
+import queue_policy
+import stream_events
+import supervisor
+import viewer_sessions
+import whep_sfu
+
+app = Quart(__name__)
+socketio = AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+asgi_app = ASGIApp(socketio, app)
 
 # Create session with connection pooling and retry logic
 session = requests.Session()
@@ -35,7 +55,33 @@ CONFIG_DIR = Path("/app/config")
 LOG_DIR = Path("/app/logs")
 CONFIG_FILE = CONFIG_DIR / "stream_config.json"
 PID_FILE = CONFIG_DIR / "stream.pid"
+CAPABILITIES_FILE = CONFIG_DIR / "capabilities.json"
 LOG_FILE = LOG_DIR / "stream.log"
+SERVER_URL = "http://localhost:8080/api/whip"
+STATUS_URL = "http://localhost:8080/api/status"
+VIDEO_DEVICE = "/dev/video0"
+ABR_TRACE_FILE = LOG_DIR / "abr-trace.jsonl"
+
+# Persistent capture stage for pipeline_mode "split"
+CAPTURE_PID_FILE = CONFIG_DIR / "capture.pid"
+CAPTURE_STATE_FILE = CONFIG_DIR / "capture.json"
+CAPTURE_LOG_FILE = LOG_DIR / "capture.log"
+SHM_SOCKET = Path(pipeline_builder.SHM_SOCKET)
+
+# gst-launch tracer output (latency, queue levels) for /api/pipeline/metrics
+TRACER_FIFO = Path("/tmp/stream-tracer.fifo")
+
+# Logs are archived (gzipped) at every start, and while running once they
+# pass LOG_MAX_BYTES or LOG_MAX_AGE seconds
+LOG_ARCHIVE_DIR = LOG_DIR / "archive"
+LOG_MAX_BYTES = 20 * 1024 * 1024
+LOG_MAX_AGE = 24 * 3600
+LOG_ARCHIVES = 20
+LOG_ROTATE_INTERVAL = 60
+
+# Structured events parsed from stream.log, for /api/events
+EVENTS_FILE = LOG_DIR / "events.jsonl"
+EVENT_FLUSH_DELAY = 1
 
 # Ensure directories exist
 CONFIG_DIR.mkdir(parents=True, exist_ok=True)
@@ -45,6 +91,22 @@ LOG_DIR.mkdir(parents=True, exist_ok=True)
 # Optimize for CPU efficiency
 STATS_POLL_INTERVAL = 5
 STATUS_POLL_INTERVAL = 5
+ABR_INTERVAL = 1
+SAMPLE_INTERVAL = 2
+LOG_BACKLOG = 50
+SSE_KEEPALIVE = 15
+QUEUE_SAMPLE_INTERVAL = 0.25
+SUPERVISOR_INTERVAL = 2
+GOVERNOR_INTERVAL = 2
+VIEWER_INTERVAL = 2
+CAPABILITY_CHECK_INTERVAL = 30
+# Stopping: EOS gets this long to drain before SIGTERM, then SIGKILL
+STOP_EOS_TIMEOUT = 5
+STOP_TERM_TIMEOUT = 2
+# Cold switch: how long to wait for the new pipeline's first media, and how
+# often Broadcast Box's packet counts are polled for it outside engine mode
+SWITCH_FIRST_MEDIA_TIMEOUT = 10
+SWITCH_POLL_INTERVAL = 0.05
 
 # Streaming scripts (filtered for target hardware)
 # For low-power OptiPlex: Only show VP9, AV1 OptiPlex, and hardware encoders
@@ -56,6 +118,15 @@ STREAMING_SCRIPTS = {
         "codec": "VP9",
         "recommended": True,
         "target": "low-power",
+        # Governor steps under CPU/thermal pressure (governor.py), cumulative
+        "ladder": [
+            {"encoder": {"cpu-used": 6, "deadline": 1}},
+            {"encoder": {"cpu-used": 8}},
+            {"fps": 48},
+            {"fps": 30},
+            {"resolution": "960x540"},
+            {"resolution": "854x480"},
+        ],
     },
     "av1-optiplex": {
         "name": "AV1 (OptiPlex - 1440p→720p)",
@@ -64,6 +135,14 @@ STREAMING_SCRIPTS = {
         "codec": "AV1",
         "recommended": False,
         "target": "low-power",
+        "ladder": [
+            {"encoder": {"preset": 11}},
+            {"encoder": {"preset": 12}},
+            {"fps": 48},
+            {"fps": 30},
+            {"resolution": "960x540"},
+            {"resolution": "854x480"},
+        ],
     },
     "h264-vaapi": {
         "name": "H.264 (VA-API - Intel/AMD)",
@@ -72,6 +151,7 @@ STREAMING_SCRIPTS = {
         "codec": "H.264",
         "recommended": False,
         "target": "hardware",
+        "ladder": governor.DEFAULT_LADDER,
     },
     "av1-vaapi": {
         "name": "AV1 (VA-API - Intel Arc/AMD RDNA3)",
@@ -80,6 +160,7 @@ STREAMING_SCRIPTS = {
         "codec": "AV1",
         "recommended": False,
         "target": "hardware",
+        "ladder": governor.DEFAULT_LADDER,
     },
     "h264-nvenc": {
         "name": "H.264 (NVENC - NVIDIA)",
@@ -88,6 +169,7 @@ STREAMING_SCRIPTS = {
         "codec": "H.264",
         "recommended": False,
         "target": "hardware",
+        "ladder": governor.DEFAULT_LADDER,
     },
     "av1-nvenc": {
         "name": "AV1 (NVENC - RTX 40-series)",
@@ -96,9 +178,67 @@ STREAMING_SCRIPTS = {
         "codec": "AV1",
         "recommended": False,
         "target": "hardware",
+        "ladder": governor.DEFAULT_LADDER,
     },
 }
 
+# Encoders that get a test encode in the capability probe
+HARDWARE_ENCODERS = [
+    script_id
+    for script_id, script_info in STREAMING_SCRIPTS.items()
+    if script_info["type"] == "hardware"
+]
+
+# In-process pipeline for pipeline_mode "engine"
+engine = gst_engine.StreamEngine(log_path=LOG_FILE)
+whep_server = whep_sfu.WhepServer(engine)
+
+# Per-element latency and queue levels of the running pipeline
+metrics = pipeline_metrics.PipelineMetrics()
+metrics_state = {"probes": None}
+
+# Stream lifecycle counters, for /metrics. A failure is counted once: as a
+# start failure by start_stream, or as a crash (exit, stall, pipeline
+# error) by pipeline_failed
+stream_counters = {
+    "starts": 0,
+    "start_failures": 0,
+    "crashes": 0,
+    "manual_restarts": 0,
+    "automatic_restarts": 0,
+}
+# How long the last stop took and how it ended (eos, sigterm, sigkill)
+last_stop = {"seconds": None, "how": None}
+
+# One long-running nvidia-smi/NVML reader instead of a fork per query
+gpu = gpu_monitor.GpuMonitor(interval=SAMPLE_INTERVAL)
+
+# Latest sampler output. Each sample is a new dict that is never modified
+# after it is published, so handlers can serve it without locking
+sampler_state = {"snapshot": None, "wake": asyncio.Event()}
+
+# The one reader of stream.log; SSE and Socket.IO clients subscribe to it
+stream_log = log_follower.LogFollower(LOG_FILE)
+
+# When each live log was started, for time-based rotation
+log_opened = {}
+
+# State changes, warnings/errors, WHIP signalling and exits from stream.log
+events = stream_events.EventLog(EVENTS_FILE)
+
+# Child processes started by this panel, by PID file, so their exit can be
+# awaited instead of polled
+children = {}
+
+# Installed elements, working encoders and capture modes (capabilities.py),
+# probed at startup and again when plugins change
+capability_state = {"result": None}
+
+# Restarts the stream when it dies or stalls; "restart" is the pending
+# backoff restart, if any
+stream_supervisor = supervisor.Supervisor()
+supervisor_state = {"restart": None}
+
 # Default configuration
 DEFAULT_CONFIG = {
     "selected_script": "vp9",
@@ -108,79 +248,170 @@ DEFAULT_CONFIG = {
     "audio_bitrate": 192,
     "stream_key": "gaming",
     "auto_start": False,
+    # "builder" generates the pipeline from this config, "engine" runs it
+    # in-process (live parameter changes), "split" keeps capture in its own
+    # process and attaches encoders over shared memory, "script" runs the
+    # legacy hand-written scripts/stream-*.sh
+    "pipeline_mode": "builder",
+    # Closed-loop bitrate/resolution control (engine mode only)
+    "adaptive_bitrate": False,
+    "abr_min_bitrate": 1000,
+    "abr_max_bitrate": 5000,
+    "abr_record_trace": False,
+    # Encode every rendition from one capture (builder mode). The first
+    # rendition publishes on stream_key, the others on "<stream_key>-<name>"
+    "simulcast": False,
+    "renditions": pipeline_builder.DEFAULT_RENDITIONS,
+    # Per-element latency and queue-depth instrumentation: GStreamer tracers
+    # for gst-launch modes, pad probes in engine mode
+    "pipeline_metrics": False,
+    # Engine mode: run the encoder from the split-mode capture stage, so the
+    # next preset can be prepared next to the running one for switches
+    "warm_standby": False,
+    # Trust the cached capability probe on start: no plugin checks in the
+    # scripts and no v4l2-ctl probe (turn off to measure the difference)
+    "capability_cache": True,
+    # Capture mode: "auto" picks the cheapest format the card offers (raw
+    # NV12/YUY2, or MJPEG decoded by VA-API/NVDEC/jpegdec) that fits the USB
+    # link; or force one ("NV12", "YUY2", "MJPEG", ...). capture_io_mode
+    # "auto" uses DMABuf import on VA-API presets; capture_bus_mbps
+    # overrides the USB speed read from sysfs
+    "capture_format": "auto",
+    "capture_io_mode": "auto",
+    "capture_bus_mbps": None,
+    # Hardware presets convert and scale on the GPU (vapostproc,
+    # vaapipostproc, cudaconvertscale) and import DMABufs from the capture
+    # card for VA-API; falls back to the CPU when the elements are missing
+    "hardware_memory": True,
+    # Step the running encoder down its preset's ladder under CPU, thermal
+    # or frame-drop pressure, and back up once it recovers (engine mode only)
+    "governor": False,
+    # Seconds between periodic keyframes; viewers that join in between ask
+    # for one (PLI/FIR). In engine mode those requests reach the encoder at
+    # most once per keyframe_min_interval seconds
+    "keyframe_interval": pipeline_builder.DEFAULT_KEYFRAME_INTERVAL,
+    "keyframe_min_interval": gst_engine.KEYFRAME_MIN_INTERVAL,
+    # Engine mode: serve WHEP viewers from the streamer itself
+    # (/api/whep/<stream_key>), fanning the encoded stream out without a
+    # re-encode. whip_publish false skips Broadcast Box entirely
+    "builtin_whep": False,
+    "whip_publish": True,
+    "whep_max_viewers": 10,
+    # Queue sizing from the frame interval and the encoder's latency
+    # (queue_policy.py): "latency" drops the oldest frame in front of a
+    # lagging encoder, "smoothness" holds a few frames more and drops none.
+    # encoder_latency_ms overrides the preset's estimate (benchmark.py
+    # reports the measured one)
+    "queue_policy": queue_policy.DEFAULT_POLICY,
+    "encoder_latency_ms": None,
 }
 
+# Last glass-to-glass probe run, pushed with combined_update
+latency_state = {"running": False, "result": None}
 
-def get_system_stats():
-    """Get system statistics with optimized caching"""
-    cpu_percent = psutil.cpu_percent(interval=0.1)
-    memory = psutil.virtual_memory()
-    net_io = psutil.net_io_counters()
+# Latest adaptive bitrate decision, for /api/abr
+abr_state = {"active": False, "sample": None, "target": None, "updated": 0}
 
-    gpu_info = None
-    try:
-        # Use module-level cache for GPU stats
-        if not hasattr(get_system_stats, "gpu_cache"):
-            get_system_stats.gpu_cache = {"data": None, "timestamp": 0}
+# Encode governor: current ladder level and the settings it applied
+governor_state = {"active": False, "level": 0, "sample": None, "target": None}
 
-        current_time = time.time()
-        cache = get_system_stats.gpu_cache
+# Per-viewer records and history; Broadcast Box's part changes only when
+# its cached /api/status is refreshed
+viewers = viewer_sessions.ViewerTracker()
+beacons = viewer_sessions.BeaconAggregator()
+viewer_state = {"status_time": None}
 
-        # Return cached data if within 50 seconds
-        if cache["timestamp"] > 0 and (current_time - cache["timestamp"]) < 50:
-            gpu_info = cache["data"]
-        else:
-            try:
-                result = subprocess.run(
-                    [
-                        "nvidia-smi",
-                        "--query-gpu=name,utilization.gpu,temperature.gpu",
-                        "--format=csv,noheader",
-                    ],
-                    capture_output=True,
-                    text=True,
-                    timeout=5,
-                )
-                if result.returncode == 0:
-                    parts = result.stdout.strip().split(", ")
-                    gpu_info = {
-                        "name": parts[0],
-                        "utilization": int(parts[1].split()[0]),
-                        "temperature": int(parts[2].split()[0]),
-                    }
-                    # Update cache
-                    cache["data"] = gpu_info
-                    cache["timestamp"] = current_time
-                else:
-                    gpu_info = cache["data"]
-            except:
-                gpu_info = cache["data"]
-    except:
-        pass
+
+def get_system_stats():
+    """Get system statistics (only called by the sampler thread)"""
+    # interval=None compares against the previous call, one sample ago
+    cpu_percent = psutil.cpu_percent(interval=None)
+    cpu_per_core = psutil.cpu_percent(interval=None, percpu=True)
+    memory = psutil.virtual_memory()
+    net_io = psutil.net_io_counters()
 
     return {
         "cpu": cpu_percent,
+        "cpu_per_core": cpu_per_core,
         "memory": memory.percent,
         "network": {"bytes_sent": net_io.bytes_sent, "bytes_recv": net_io.bytes_recv},
-        "gpu": gpu_info,
+        "gpu": gpu.latest(),
+        "renditions": get_rendition_cpu(),
     }
 
 
+def get_rendition_cpu():
+    """CPU% per simulcast rendition, from the stream's per-thread CPU time.
+
+    Rendition i runs in the threads named "r<i>scale/enc/rtp:src" (see
+    pipeline_builder.build_simulcast_pipeline). Percentages are of one core,
+    averaged since the previous call.
+    """
+    config = load_config()
+    pid = supervisor.read_pid(PID_FILE)
+    if not config.get("simulcast") or pid is None:
+        return None
+
+    if not hasattr(get_rendition_cpu, "last"):
+        get_rendition_cpu.last = {"pid": None, "ticks": {}, "timestamp": 0}
+    last = get_rendition_cpu.last
+
+    try:
+        ticks = {}
+        for task in Path(f"/proc/{pid}/task").iterdir():
+            try:
+                comm = (task / "comm").read_text().strip()
+                match = re.match(r"r(\d+)(scale|enc|rtp)", comm)
+                if not match:
+                    continue
+                # utime and stime follow the ")"-terminated comm field
+                fields = (task / "stat").read_text().rsplit(")", 1)[1].split()
+                index = int(match.group(1))
+                ticks[index] = ticks.get(index, 0) + int(fields[11]) + int(fields[12])
+            except (OSError, ValueError, IndexError):
+                continue
+    except (OSError, ValueError):
+        return None
+
+    now = time.time()
+    elapsed = now - last["timestamp"]
+    hz = os.sysconf("SC_CLK_TCK")
+    result = {}
+    for index, rendition in enumerate(config["renditions"]):
+        cpu = None
+        if last["pid"] == pid and elapsed > 0 and index in last["ticks"]:
+            delta = ticks.get(index, 0) - last["ticks"][index]
+            cpu = round(delta / hz / elapsed * 100, 1)
+        result[rendition["name"]] = {
+            "resolution": rendition["resolution"],
+            "fps": rendition["fps"],
+            "bitrate": rendition["bitrate"],
+            "cpu": cpu,
+        }
+    get_rendition_cpu.last = {"pid": pid, "ticks": ticks, "timestamp": now}
+    return result
+
+
+def is_streaming():
+    """Whether a pipeline runs, without asking Broadcast Box"""
+    if engine.running:
+        return True
+
+    process = children.get(PID_FILE)
+    if process is not None:
+        return process.returncode is None
+
+    # Left over from an earlier panel instance: the PID file also records
+    # the start time, so a reused PID does not read as streaming
+    if supervisor.read_pid(PID_FILE) is not None:
+        return True
+    PID_FILE.unlink(missing_ok=True)
+    return False
+
+
 def get_stream_status():
     """Get current streaming status"""
-    streaming = False
-
-    # Check PID file
-    if PID_FILE.exists():
-        try:
-            pid = int(PID_FILE.read_text().strip())
-            if psutil.pid_exists(pid):
-                streaming = True
-            else:
-                # Stale PID file
-                PID_FILE.unlink(missing_ok=True)
-        except:
-            PID_FILE.unlink(missing_ok=True)
+    streaming = is_streaming()
 
     # Check Broadcast Box with caching
     broadcast_box_active = False
@@ -200,7 +431,7 @@ def get_stream_status():
     else:
         try:
             # Use requests with timeout
-            response = session.get("http://localhost:8080/api/status", timeout=2)
+            response = session.get(STATUS_URL, timeout=2)
             if response.status_code == 200:
                 broadcast_box_active = True
                 stream_info = response.json()
@@ -216,9 +447,23 @@ def get_stream_status():
         "streaming": streaming,
         "broadcast_box": broadcast_box_active,
         "stream_info": stream_info,
+        "supervisor": stream_supervisor.status(),
     }
 
 
+def get_stream_uptime():
+    """Seconds since the running pipeline started, or None"""
+    if engine.running:
+        return time.time() - engine.started_at if engine.started_at else None
+    pid = supervisor.read_pid(PID_FILE)
+    if pid is None:
+        return None
+    try:
+        return time.time() - psutil.Process(pid).create_time()
+    except psutil.NoSuchProcess:
+        return None
+
+
 def load_config():
     """Load stream configuration"""
     if CONFIG_FILE.exists():
@@ -236,13 +481,25 @@ def save_config(config):
         json.dump(config, f, indent=2)
 
 
-def start_stream(script_id, config):
-    """Start streaming with specified script"""
+async def start_stream(script_id, config, automatic=False):
+    """Start streaming with specified script.
+
+    automatic=True is the supervisor restarting a failed stream.
+    """
     if script_id not in STREAMING_SCRIPTS:
         return {"success": False, "error": "Invalid script"}
 
+    probed = usable_probe(config)
+    if probed is not None:
+        encoder = probed["encoders"].get(script_id)
+        if encoder and not encoder["available"]:
+            return {
+                "success": False,
+                "error": f"Encoder unavailable: {encoder['reason']}",
+            }
+
     # Stop existing stream if running
-    stop_stream()
+    await stop_stream(supervised=True)
 
     try:
         script_info = STREAMING_SCRIPTS[script_id]
@@ -251,79 +508,538 @@ def start_stream(script_id, config):
         # Prepare environment
         env = os.environ.copy()
         env["STREAM_KEY"] = config["stream_key"]
-        env["SERVER_URL"] = "http://localhost:8080/api/whip"
-        env["VIDEO_DEVICE"] = "/dev/video0"
+        env["SERVER_URL"] = SERVER_URL
+        env["VIDEO_DEVICE"] = VIDEO_DEVICE
         env["RESOLUTION"] = config["resolution"]
         env["BITRATE"] = str(config["bitrate"])
         env["FPS"] = str(config["fps"])
-
-        # Open log file and ensure it is closed after subprocess spawn
-        with open(LOG_FILE, "w") as log_fd:
-            # Start process
-            process = subprocess.Popen(
-                [str(script_path)],
-                env=env,
-                cwd=str(STREAM_DIR),
-                stdout=log_fd,
-                stderr=subprocess.STDOUT,  # Capture stderr to log file too
-                start_new_session=True,
+        # Whole seconds: the scripts do shell arithmetic with it
+        interval = config.get(
+            "keyframe_interval", pipeline_builder.DEFAULT_KEYFRAME_INTERVAL
+        )
+        env["KEYFRAME_INTERVAL"] = str(max(1, round(float(interval))))
+        env["QUEUE_POLICY"] = queue_policy.policy_name(config)
+        # Whole ms, for the same reason
+        env["ENCODER_LATENCY_MS"] = str(
+            round(pipeline_builder.encoder_latency_ms(script_id, config))
+        )
+        if probed is not None:
+            env["SKIP_PREFLIGHT"] = "1"
+
+        mode = config.get("pipeline_mode", "builder")
+        instrument = config.get("pipeline_metrics", False)
+        if mode == "engine":
+            await rotate_log(LOG_FILE)
+            log_opened[LOG_FILE] = time.time()
+            stream_log.rewind()
+            if config.get("warm_standby"):
+                capture = await start_capture_stage(config)
+                if not capture["success"]:
+                    return capture
+            description = await asyncio.to_thread(
+                build_engine_pipeline, script_id, config
             )
+            await asyncio.to_thread(
+                engine.start, script_id, description, {**DEFAULT_CONFIG, **config}
+            )
+            if instrument:
+                metrics.reset("probes")
+                metrics_state["probes"] = pipeline_metrics.EngineProbes(
+                    engine.pipeline, metrics
+                )
+            save_config(config)
+            stream_counters["starts"] += 1
+            await publish_transition(stream_supervisor.started(automatic=automatic))
+            return {"success": True}
+
+        # The FIFO only exists while the tracer reader is draining it
+        if instrument and TRACER_FIFO.exists():
+            env.update(pipeline_metrics.tracer_env(TRACER_FIFO))
+            metrics.reset("tracer")
+
+        if mode == "split":
+            capture = await start_capture_stage(config)
+            if not capture["success"]:
+                return capture
+            command = pipeline_builder.pipeline_argv(
+                pipeline_builder.build_encoder_stage(
+                    script_id,
+                    {**DEFAULT_CONFIG, **config},
+                    socket_path=SHM_SOCKET,
+                    server_url=SERVER_URL,
+                    available=installed_elements(config),
+                )
+            )
+        elif mode == "builder":
+            command = pipeline_builder.pipeline_argv(
+                await asyncio.to_thread(build_stream_pipeline, script_id, config)
+            )
+        else:
+            command = [str(script_path)]
 
-        # Save PID
-        PID_FILE.write_text(str(process.pid))
+        await spawn(command, PID_FILE, LOG_FILE, env=env, cwd=STREAM_DIR)
 
         save_config(config)
+        stream_counters["starts"] += 1
+        await publish_transition(stream_supervisor.started(automatic=automatic))
         return {"success": True}
     except Exception as e:
+        stream_counters["start_failures"] += 1
+        if automatic:
+            await pipeline_failed("start failed", error=str(e))
         return {"success": False, "error": str(e)}
 
 
-def stop_stream():
-    """Stop streaming"""
+def build_engine_pipeline(script_id, config):
+    """Description for the in-process engine.
+
+    With warm_standby the engine runs an encoder stage fed by the capture
+    stage, so a second pipeline can be prepared while the first one runs
+    (the capture device can only be opened once). Building may probe the
+    capture card with v4l2-ctl, so callers run it in a worker thread.
+    """
+    config = {**DEFAULT_CONFIG, **config}
+    sfu = bool(config.get("builtin_whep"))
+    fake_sink = sfu and not config.get("whip_publish")
+    if config.get("warm_standby"):
+        return pipeline_builder.build_encoder_stage(
+            script_id,
+            config,
+            socket_path=SHM_SOCKET,
+            server_url=SERVER_URL,
+            fake_sink=fake_sink,
+            live_controls=True,
+            available=installed_elements(config),
+            sfu=sfu,
+        )
+    return build_stream_pipeline(
+        script_id, config, live_controls=True, fake_sink=fake_sink, sfu=sfu
+    )
+
+
+async def prepare_standby(script_id, config):
+    """Take script_id's pipeline to PAUSED next to the running one"""
+    description = await asyncio.to_thread(build_engine_pipeline, script_id, config)
+    await asyncio.to_thread(
+        engine.prepare, script_id, description, {**DEFAULT_CONFIG, **config}
+    )
+
+
+def first_media(stream_key, timeout):
+    """(time.monotonic() of the new pipeline's first media, where it was
+    seen), or (None, why not) after a cold start.
+
+    The engine timestamps its encoder's first frame. Builder, split and
+    script pipelines run in a subprocess, so their first media is the
+    first rise in the packets Broadcast Box reports for stream_key. The old
+    pipeline is stopped by then, so any rise is the new one's; it is later
+    than the encoder by the network hop and the poll interval.
+    """
+    if engine.running:
+        first = engine.first_frame(timeout)
+        if first is None:
+            return None, f"no encoded frame within {timeout} s"
+        return first, "encoder"
+    deadline = time.monotonic() + timeout
+    previous = None
+    while time.monotonic() < deadline:
+        try:
+            response = session.get(STATUS_URL, timeout=1)
+            packets = supervisor.server_progress(response.json(), stream_key)
+        except (requests.exceptions.RequestException, ValueError):
+            return None, "Broadcast Box status is unreachable"
+        if packets is None:
+            return None, "Broadcast Box does not report packet counts"
+        if previous is not None and packets > previous:
+            return time.monotonic(), "broadcast-box"
+        previous = packets
+        time.sleep(SWITCH_POLL_INTERVAL)
+    return None, f"no packets reached Broadcast Box within {timeout} s"
+
+
+async def switch_stream(script_id):
+    """Change the preset of the running stream.
+
+    In engine mode with warm_standby the prepared pipeline is swapped in
+    when the old one reaches EOS; otherwise this is a stop and a cold
+    start. Either way the response carries the measured switch timings.
+    """
+    if script_id not in STREAMING_SCRIPTS:
+        return {"success": False, "error": "Invalid script"}
+    config = load_config()
+    config["selected_script"] = script_id
+    probed = usable_probe(config)
+    encoder = probed["encoders"].get(script_id) if probed else None
+    if encoder and not encoder["available"]:
+        return {"success": False, "error": f"Encoder unavailable: {encoder['reason']}"}
+
+    if not (engine.running and config.get("warm_standby")):
+        started = time.monotonic()
+        result = await start_stream(script_id, config)
+        restart_ms = round((time.monotonic() - started) * 1000, 1)
+        if result["success"]:
+            first, source = await asyncio.to_thread(
+                first_media, config.get("stream_key"), SWITCH_FIRST_MEDIA_TIMEOUT
+            )
+        else:
+            first, source = None, "the new pipeline did not start"
+        result["warm"] = False
+        result["switch"] = {"restart_ms": restart_ms}
+        if first is None:
+            result["switch"]["gap_unmeasured"] = source
+        else:
+            result["switch"]["gap_ms"] = round((first - started) * 1000, 1)
+            result["switch"]["gap_source"] = source
+        return result
+
     try:
-        if PID_FILE.exists():
-            pid = int(PID_FILE.read_text().strip())
-            try:
-                os.kill(pid, signal.SIGTERM)
-                # Wait a bit
-                time.sleep(1)
-                if psutil.pid_exists(pid):
-                    os.kill(pid, signal.SIGKILL)
-            except ProcessLookupError:
-                pass
-            finally:
-                PID_FILE.unlink(missing_ok=True)
-
-        # Also try to kill gst-launch-1.0 processes to be safe
-        subprocess.run(["pkill", "-f", "gst-launch-1.0"])
+        if engine.standby is None or engine.standby[0] != script_id:
+            await prepare_standby(script_id, config)
+        timings = await asyncio.to_thread(engine.swap, STOP_EOS_TIMEOUT)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+    if config.get("pipeline_metrics"):
+        metrics.reset("probes")
+        metrics_state["probes"] = pipeline_metrics.EngineProbes(
+            engine.pipeline, metrics
+        )
+    save_config(config)
+    await publish_transition(stream_supervisor.switched())
+    return {"success": True, "warm": True, "switch": timings}
+
+
+def usable_probe(config):
+    """The capability probe result, unless missing, failed or turned off"""
+    probed = capability_state["result"]
+    if probed is None or not probed["ok"]:
+        return None
+    if not config.get("capability_cache", True):
+        return None
+    return probed
+
+
+def cached_device_modes(config):
+    """Capture modes from the capability probe, or None to probe the device"""
+    probed = usable_probe(config)
+    if probed is None or not probed["device_modes"]:
+        return None
+    return probed["device_modes"]
+
+
+def installed_elements(config):
+    """Installed GStreamer elements from the capability probe, if known.
+
+    The builder falls back to CPU conversion when a hardware path's
+    elements are missing; None (no probe yet) assumes they are there.
+    """
+    probed = usable_probe(config)
+    return set(probed["elements"]) if probed is not None else None
+
+
+def build_stream_pipeline(
+    script_id, config, live_controls=False, fake_sink=False, sfu=False
+):
+    """Generate the gst-launch description for a preset from the config"""
+    config = {**DEFAULT_CONFIG, **config}
+    if config.get("simulcast") and not live_controls:
+        return pipeline_builder.build_simulcast_pipeline(
+            script_id,
+            config,
+            device_modes=cached_device_modes(config),
+            device=VIDEO_DEVICE,
+            server_url=SERVER_URL,
+            available=installed_elements(config),
+        )
+    return pipeline_builder.build_pipeline(
+        script_id,
+        config,
+        device_modes=cached_device_modes(config),
+        device=VIDEO_DEVICE,
+        server_url=SERVER_URL,
+        fake_sink=fake_sink,
+        live_controls=live_controls,
+        available=installed_elements(config),
+        sfu=sfu,
+    )
 
+
+async def spawn(command, pid_file, log_file, env=None, cwd=None):
+    """Start a child in its own session, logging to log_file"""
+    await rotate_log(log_file)
+    log_opened[log_file] = time.time()
+    # Append mode (O_APPEND), so the log can be copied and truncated under
+    # the running child; the file is closed here once the child has it
+    with open(log_file, "a") as log_fd:
+        if log_file == LOG_FILE:
+            stream_log.rewind()
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            env=env,
+            cwd=str(cwd) if cwd else None,
+            stdout=log_fd,
+            stderr=subprocess.STDOUT,  # Capture stderr to log file too
+            start_new_session=True,
+        )
+    supervisor.write_pid_file(pid_file, process.pid)
+    children[pid_file] = process
+    asyncio.create_task(watch_exit(pid_file, process, log_file))
+    return process
+
+
+async def rotate_log(log_file, live=False):
+    """Archive log_file and gzip the archive in the background.
+
+    live=True copies and truncates instead of renaming, for a log a running
+    child keeps writing to; the follower keeps its lines across that.
+    """
+    follow = log_file == LOG_FILE
+    if follow:
+        stream_log.read_new(limit=None)
+        stream_log.rotating = live
+    try:
+        archived = await asyncio.to_thread(
+            log_follower.archive, log_file, LOG_ARCHIVE_DIR, live
+        )
+    finally:
+        # Unless the follower already noticed the truncation itself
+        if follow and stream_log.rotating:
+            stream_log.rewind(keep_lines=True)
+            stream_log.rotating = False
+    if archived:
+        asyncio.create_task(
+            asyncio.to_thread(log_follower.compress, archived, LOG_ARCHIVES)
+        )
+    return archived
+
+
+async def watch_exit(pid_file, process, log_file):
+    """Note a child's exit as soon as it happens"""
+    returncode = await process.wait()
+    if children.get(pid_file) is not process:
+        return  # stopped on purpose
+    children.pop(pid_file, None)
+    pid_file.unlink(missing_ok=True)
+    with open(log_file, "a") as f:
+        f.write(f"[panel] Process {process.pid} exited with code {returncode}\n")
+    request_sample()
+    if pid_file in (PID_FILE, CAPTURE_PID_FILE):
+        await pipeline_failed("exited", pid=process.pid, code=returncode)
+
+
+async def publish_transition(event):
+    """Push a supervisor transition to every client"""
+    request_sample()
+    if event is not None:
+        await socketio.emit("supervisor", event)
+
+
+async def pipeline_failed(reason, **info):
+    """The stream died, stalled or did not start: schedule a restart"""
+    event, delay = stream_supervisor.failed(reason, **info)
+    if event is None:
+        return  # stopped on purpose meanwhile
+    if reason != "start failed":  # start_stream counted that one
+        stream_counters["crashes"] += 1
+    await publish_transition(event)
+    if delay is not None:
+        supervisor_state["restart"] = asyncio.create_task(delayed_restart(delay))
+
+
+async def delayed_restart(delay):
+    await asyncio.sleep(delay)
+    if stream_supervisor.state != "backoff":
+        return
+    supervisor_state["restart"] = None
+    await publish_transition(stream_supervisor.restarting())
+    config = load_config()
+    stream_counters["automatic_restarts"] += 1
+    await start_stream(config.get("selected_script", "vp9"), config, automatic=True)
+
+
+async def terminate(pid_file, timeout=STOP_EOS_TIMEOUT):
+    """Stop the process group in pid_file, EOS first; returns (seconds, how)"""
+    process = children.pop(pid_file, None)
+    pid = process.pid if process is not None else supervisor.read_pid(pid_file)
+    try:
+        if pid is None or (process is not None and process.returncode is not None):
+            return None
+        # Children run in their own session, so their group is theirs alone
+        return await supervisor.stop_group(
+            pid, process, eos_timeout=timeout, term_timeout=STOP_TERM_TIMEOUT
+        )
+    finally:
+        pid_file.unlink(missing_ok=True)
+
+
+async def update_stream_params(params):
+    """Apply bitrate/fps/resolution changes to the running stream.
+
+    In engine mode the new values are pushed into the running elements.
+    Otherwise they are only saved and take effect on the next start.
+    """
+    updates = {
+        key: params[key] for key in ("bitrate", "fps", "resolution") if key in params
+    }
+    if not updates:
+        return {"success": False, "error": "No bitrate, fps or resolution given"}
+
+    config = load_config()
+    live = False
+    try:
+        if engine.running:
+            updates = await asyncio.to_thread(engine.set_params, **updates)
+            live = True
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+    config.update(updates)
+    save_config(config)
+    return {"success": True, "live": live, "applied": updates}
+
+
+def get_capture_status():
+    """State of the persistent capture stage"""
+    pid = supervisor.read_pid(CAPTURE_PID_FILE)
+    if pid is None:
+        return {"running": False}
+    try:
+        state = json.loads(CAPTURE_STATE_FILE.read_text())
+    except (ValueError, OSError):
+        return {"running": False}
+    return {"running": True, "pid": pid, **state}
+
+
+async def start_capture_stage(config):
+    """Start the capture stage, or reuse it if it already publishes these caps"""
+    config = {**DEFAULT_CONFIG, **config}
+    caps = pipeline_builder.shm_caps(config)
+    source = {key: config[key] for key in ("capture_format", "capture_io_mode")}
+    capture = get_capture_status()
+    if (
+        capture["running"]
+        and capture.get("caps") == caps
+        and capture.get("source", source) == source
+    ):
+        return {"success": True, "reused": True}
+    await stop_capture_stage()
+
+    try:
+        SHM_SOCKET.unlink(missing_ok=True)
+        description = await asyncio.to_thread(
+            pipeline_builder.build_capture_stage,
+            config,
+            device_modes=cached_device_modes(config),
+            device=VIDEO_DEVICE,
+            socket_path=SHM_SOCKET,
+            available=installed_elements(config),
+        )
+        process = await spawn(
+            pipeline_builder.pipeline_argv(description),
+            CAPTURE_PID_FILE,
+            CAPTURE_LOG_FILE,
+        )
+        CAPTURE_STATE_FILE.write_text(
+            json.dumps({"caps": caps, "source": source, "socket": str(SHM_SOCKET)})
+        )
+
+        # Encoders can only attach once shmsink has created its socket
+        deadline = time.time() + 5
+        while not SHM_SOCKET.exists():
+            if process.returncode is not None:
+                return {
+                    "success": False,
+                    "error": "Capture stage exited, see capture.log",
+                }
+            if time.time() > deadline:
+                return {"success": False, "error": "Capture stage did not come up"}
+            await asyncio.sleep(0.05)
+        return {"success": True, "reused": False}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+async def stop_capture_stage():
+    """Stop the capture stage and release the capture device"""
+    try:
+        await terminate(CAPTURE_PID_FILE)
+        CAPTURE_STATE_FILE.unlink(missing_ok=True)
+        SHM_SOCKET.unlink(missing_ok=True)
         return {"success": True}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
-def restart_stream():
+async def stop_stream(supervised=False):
+    """Stop streaming; supervised=True is a stop on the way to a (re)start"""
+    if not supervised:
+        restart = supervisor_state["restart"]
+        if restart is not None:
+            restart.cancel()
+            supervisor_state["restart"] = None
+        if stream_supervisor.state != "stopped":
+            await publish_transition(stream_supervisor.stopped())
+    try:
+        metrics_state["probes"] = None
+        stopped = None
+        if engine.running:
+            started = time.perf_counter()
+            await asyncio.to_thread(whep_server.close_all)
+            await asyncio.to_thread(engine.stop, STOP_EOS_TIMEOUT)
+            stopped = (time.perf_counter() - started, "eos")
+
+        stopped = await terminate(PID_FILE) or stopped
+        request_sample()
+        if stopped is None:
+            return {"success": True}
+        last_stop.update({"seconds": round(stopped[0], 3), "how": stopped[1]})
+        return {"success": True, "stop": dict(last_stop)}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+async def restart_stream():
     """Restart streaming"""
     config = load_config()
-    stop_stream()
-    time.sleep(2)
-    return start_stream(config.get("selected_script", "vp9"), config)
+    # stop_stream() returns once the old pipeline has exited
+    await stop_stream(supervised=True)
+    stream_counters["manual_restarts"] += 1
+    return await start_stream(config.get("selected_script", "vp9"), config)
 
 
 def detect_av1_support():
-    """Detect AV1 encoder support"""
+    """Which presets can run: their encoder works (per the capability probe)"""
+    probed = usable_probe(DEFAULT_CONFIG)
     supported = {}
     for script_id, script_info in STREAMING_SCRIPTS.items():
-        script_path = STREAM_DIR / script_info["script"]
-        supported[script_id] = script_path.exists()
+        if probed is not None and script_id in probed["encoders"]:
+            supported[script_id] = probed["encoders"][script_id]["available"]
+        else:
+            # Not probed yet
+            supported[script_id] = (STREAM_DIR / script_info["script"]).exists()
     return supported
 
 
+def probe_capabilities(force=False):
+    """Load or refresh the capability probe; True when the result changed"""
+    previous = capability_state["result"]
+    if (
+        not force
+        and previous is not None
+        and previous["key"] == capabilities.cache_key(VIDEO_DEVICE)
+    ):
+        return False
+    capability_state["result"] = capabilities.get(
+        CAPABILITIES_FILE, HARDWARE_ENCODERS, VIDEO_DEVICE, force=force
+    )
+    return capability_state["result"] is not previous
+
+
 @app.route("/")
-def index():
+async def index():
     config = load_config()
-    stats = get_system_stats()
-    status = get_stream_status()
+    snapshot = current_snapshot()
+    stats = snapshot["stats"]
+    status = snapshot["status"]
     supported_scripts = detect_av1_support()
 
     # Filter scripts for low-power hardware (OptiPlex/mini-pc)
@@ -334,7 +1050,7 @@ def index():
         # Scripts marked with "target": "low-power" are optimized for OptiPlex
         filtered_scripts[script_id] = script_info
 
-    return render_template(
+    return await render_template(
         "control_panel.html",
         config=config,
         stats=stats,
@@ -345,57 +1061,296 @@ def index():
 
 
 @app.route("/api/stats")
-def api_stats():
-    return jsonify(get_system_stats())
+async def api_stats():
+    return jsonify(current_snapshot()["stats"])
 
 
 @app.route("/api/status")
-def api_status():
-    return jsonify(get_stream_status())
+async def api_status():
+    return jsonify(current_snapshot()["status"])
 
 
 @app.route("/api/config", methods=["GET", "POST"])
-def api_config():
+async def api_config():
     if request.method == "GET":
         return jsonify(load_config())
     else:
-        config = request.json
+        config = await request.get_json()
         save_config(config)
         return jsonify({"success": True})
 
 
 @app.route("/api/stream/start", methods=["POST"])
-def api_start_stream():
-    data = request.json
+async def api_start_stream():
+    data = await request.get_json()
     script_id = data.get("script_id")
     config = data.get("config", load_config())
-    return jsonify(start_stream(script_id, config))
+    return jsonify(await start_stream(script_id, config))
 
 
 @app.route("/api/stream/stop", methods=["POST"])
-def api_stop_stream():
-    return jsonify(stop_stream())
+async def api_stop_stream():
+    return jsonify(await stop_stream())
+
+
+@app.route("/api/stream/switch", methods=["POST"])
+async def api_switch_stream():
+    """API: Switch the running stream to another preset"""
+    data = await request.get_json() or {}
+    return jsonify(await switch_stream(data.get("script_id")))
+
+
+@app.route("/api/stream/standby", methods=["POST"])
+async def api_stream_standby():
+    """API: Prepare the next preset's pipeline ahead of a switch"""
+    data = await request.get_json() or {}
+    script_id = data.get("script_id")
+    config = load_config()
+    if script_id not in pipeline_builder.ENCODERS:
+        return jsonify({"success": False, "error": "Invalid script"})
+    if not (engine.running and config.get("warm_standby")):
+        return jsonify(
+            {"success": False, "error": "Needs engine mode with warm_standby"}
+        )
+    try:
+        await prepare_standby(script_id, config)
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+    return jsonify({"success": True})
+
+
+@app.route("/api/stream/params", methods=["GET", "POST"])
+async def api_stream_params():
+    """API: Read or live-update bitrate/fps/resolution"""
+    if request.method == "GET":
+        if engine.running:
+            return jsonify({"live": True, **engine.get_params()})
+        config = load_config()
+        return jsonify(
+            {
+                "live": False,
+                "bitrate": config["bitrate"],
+                "fps": config["fps"],
+                "resolution": config["resolution"],
+            }
+        )
+    return jsonify(await update_stream_params(await request.get_json() or {}))
+
+
+@app.route("/api/capture")
+async def api_capture():
+    """API: Persistent capture stage state"""
+    return jsonify(get_capture_status())
+
+
+@app.route("/api/capture/modes")
+async def api_capture_modes():
+    """API: Capture mode the saved config selects, and every candidate's cost"""
+    config = {**DEFAULT_CONFIG, **load_config(), **request.args.to_dict()}
+    script_id = config.get("script_id", config["selected_script"])
+    if script_id not in pipeline_builder.ENCODERS:
+        return jsonify({"success": False, "error": f"Unknown script: {script_id}"}), 400
+    explained = await asyncio.to_thread(
+        pipeline_builder.explain_capture,
+        script_id,
+        config,
+        device_modes=cached_device_modes(config),
+        device=VIDEO_DEVICE,
+        available=installed_elements(config),
+    )
+    return jsonify({"success": True, "script_id": script_id, **explained})
+
+
+@app.route("/api/capture/stop", methods=["POST"])
+async def api_capture_stop():
+    """API: Stop the capture stage (stops the encoder feeding from it too)"""
+    await stop_stream()
+    return jsonify(await stop_capture_stage())
+
+
+@app.route("/api/latency", methods=["GET", "POST"])
+async def api_latency():
+    """API: Start a glass-to-glass latency probe, or read the last result"""
+    if request.method == "GET":
+        return jsonify(latency_state)
+    if not gst_engine.GST_AVAILABLE:
+        return jsonify({"success": False, "error": "GStreamer bindings unavailable"})
+    if latency_state["running"]:
+        return jsonify({"success": False, "error": "Probe already running"})
+
+    data = await request.get_json() or {}
+    config = load_config()
+    script_id = data.get("script_id", config.get("selected_script", "vp9"))
+    if script_id not in pipeline_builder.ENCODERS:
+        return jsonify({"success": False, "error": "Invalid script"})
+    transport = data.get("transport", latency_probe.DEFAULT_TRANSPORT)
+    if transport not in latency_probe.TRANSPORTS:
+        return jsonify({"success": False, "error": "Invalid transport"}), 400
+    try:
+        seconds = float(data.get("seconds", 10))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "seconds must be a number"}), 400
+    if seconds != seconds:  # NaN
+        return jsonify({"success": False, "error": "seconds must be a number"}), 400
+    seconds = min(max(seconds, 1), latency_probe.MAX_SECONDS)
+
+    # Claimed here, not in the thread, so a second POST right after is refused
+    latency_state["running"] = True
+    probe_thread = Thread(
+        target=run_latency_probe, args=(script_id, config, seconds, transport)
+    )
+    probe_thread.daemon = True
+    probe_thread.start()
+    return jsonify({"success": True})
+
+
+@app.route("/api/capabilities", methods=["GET", "POST"])
+async def api_capabilities():
+    """API: Capability probe result; POST probes again"""
+    if request.method == "POST":
+        await asyncio.to_thread(probe_capabilities, True)
+    probed = capability_state["result"]
+    if probed is None:
+        return jsonify({"probed": False})
+    return jsonify(
+        {"probed": True, **{k: v for k, v in probed.items() if k != "elements"}}
+    )
+
+
+@app.route("/api/supervisor")
+async def api_supervisor():
+    """API: Supervisor state and recent transitions"""
+    return jsonify(stream_supervisor.status())
+
+
+@app.route("/api/abr")
+async def api_abr():
+    """API: Adaptive bitrate controller state"""
+    return jsonify(abr_state)
+
+
+@app.route("/api/governor")
+async def api_governor():
+    """API: Encode governor level, last sample and applied settings"""
+    return jsonify(governor_state)
+
+
+WHEP_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "POST, DELETE, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, Authorization",
+    "Access-Control-Expose-Headers": "Location, Allow",
+}
+
+
+@app.route("/api/whep/<stream_key>", methods=["POST", "OPTIONS"])
+async def api_whep(stream_key):
+    """WHEP: answer a viewer's SDP offer from the built-in server"""
+    if request.method == "OPTIONS":
+        return Response(status=204, headers=WHEP_HEADERS)
+    config = load_config()
+    if not config.get("builtin_whep"):
+        return Response("Built-in WHEP is disabled", status=404, headers=WHEP_HEADERS)
+    if stream_key != config["stream_key"]:
+        return Response("Unknown stream key", status=404, headers=WHEP_HEADERS)
+    if request.content_type != "application/sdp":
+        return Response("Expected application/sdp", status=415, headers=WHEP_HEADERS)
+    whep_server.max_viewers = config.get("whep_max_viewers", 10)
+    whep_server.stream_key = config["stream_key"]
+    offer = (await request.get_data()).decode()
+    try:
+        whep_session, answer = await asyncio.to_thread(
+            whep_server.add, stream_key, offer
+        )
+    except whep_sfu.WhepError as e:
+        return Response(str(e), status=e.status, headers=WHEP_HEADERS)
+    return Response(
+        answer,
+        status=201,
+        content_type="application/sdp",
+        headers={
+            **WHEP_HEADERS,
+            "Location": f"/api/whep/{stream_key}/{whep_session.id}",
+        },
+    )
+
+
+@app.route(
+    "/api/whep/<stream_key>/<session_id>", methods=["DELETE", "PATCH", "OPTIONS"]
+)
+async def api_whep_session(stream_key, session_id):
+    """WHEP: end a viewer's session (trickle ICE PATCH is not supported, and
+    Allow says so: remote-display.html skips its ICE restart then)"""
+    allow = {**WHEP_HEADERS, "Allow": "DELETE, OPTIONS"}
+    if request.method == "OPTIONS":
+        return Response(status=204, headers=allow)
+    if request.method == "PATCH":
+        return Response(status=405, headers=allow)
+    if not await asyncio.to_thread(whep_server.remove, session_id):
+        return Response(status=404, headers=WHEP_HEADERS)
+    return Response(status=200, headers=WHEP_HEADERS)
+
+
+@app.route("/api/whep")
+async def api_whep_sessions():
+    """API: Viewers of the built-in WHEP server"""
+    return jsonify(await asyncio.to_thread(whep_server.list))
+
+
+@app.route("/api/viewers")
+async def api_viewers():
+    """API: Current viewers with their stats, and recently ended sessions"""
+    return jsonify({**viewers.snapshot(), "clients": beacons.summary()})
+
+
+@app.route("/api/viewers/beacon", methods=["POST", "OPTIONS"])
+async def api_viewer_beacon():
+    """API: getStats() summary beaconed by a viewer (remote-display.html)"""
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "POST, OPTIONS",
+        "Access-Control-Allow-Headers": "Content-Type",
+    }
+    if request.method == "OPTIONS":
+        return Response(status=204, headers=headers)
+    # sendBeacon posts text/plain (no CORS preflight), so parse it ourselves
+    body = await request.get_data()
+    try:
+        beacon = json.loads(body[:4096])
+    except ValueError:
+        beacon = None
+    if beacons.add(beacon) is None:
+        return Response("Bad beacon", status=400, headers=headers)
+    return Response(status=204, headers=headers)
+
+
+@app.route("/api/viewers/<viewer_id>/history")
+async def api_viewer_history(viewer_id):
+    """API: One viewer's rolling stats history"""
+    history = viewers.viewer_history(viewer_id)
+    if history is None:
+        return jsonify({"error": "Unknown viewer"}), 404
+    return jsonify({"id": viewer_id, "history": history})
 
 
 @app.route("/api/stream/restart", methods=["POST"])
-def api_restart_stream():
-    return jsonify(restart_stream())
+async def api_restart_stream():
+    return jsonify(await restart_stream())
 
 
 @app.route("/api/stream/toggle", methods=["POST"])
-def api_toggle_stream():
-    status = get_stream_status()
-    if status["streaming"]:
-        return jsonify(stop_stream())
+async def api_toggle_stream():
+    if is_streaming():
+        return jsonify(await stop_stream())
     else:
-        data = request.json
+        data = await request.get_json()
         script_id = data.get("script_id")
         config = data.get("config", load_config())
-        return jsonify(start_stream(script_id, config))
+        return jsonify(await start_stream(script_id, config))
 
 
 @app.route("/api/scripts")
-def api_scripts():
+async def api_scripts():
     # Filter scripts for low-power hardware (OptiPlex/mini-pc)
     filtered_scripts = {}
     for script_id, script_info in STREAMING_SCRIPTS.items():
@@ -403,76 +1358,760 @@ def api_scripts():
     return jsonify({"scripts": filtered_scripts, "supported": detect_av1_support()})
 
 
+@app.route("/api/pipeline")
+async def api_pipeline():
+    """API: Dry run - show the pipeline a start would launch"""
+    config = {**load_config(), **request.args.to_dict()}
+    script_id = config.get("script_id", config.get("selected_script", "vp9"))
+    try:
+        description = await asyncio.to_thread(build_stream_pipeline, script_id, config)
+    except (ValueError, KeyError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify(
+        {
+            "success": True,
+            "script_id": script_id,
+            "pipeline": description,
+            "command": " ".join(pipeline_builder.pipeline_argv(description)),
+        }
+    )
+
+
+@app.route("/api/pipeline/metrics")
+async def api_pipeline_metrics():
+    """API: Per-element latency and queue fill histograms"""
+    try:
+        window = float(request.args.get("window", pipeline_metrics.WINDOW_SECONDS))
+    except ValueError:
+        return jsonify({"success": False, "error": "window must be a number"}), 400
+    if window != window:  # NaN
+        return jsonify({"success": False, "error": "window must be a number"}), 400
+    # The store only keeps WINDOW_SECONDS of samples
+    window = min(max(window, 1), pipeline_metrics.WINDOW_SECONDS)
+    return jsonify(
+        {
+            "enabled": load_config().get("pipeline_metrics", False),
+            **metrics.snapshot(window),
+        }
+    )
+
+
+@app.route("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape target, served from the sampler snapshot"""
+    return Response(current_snapshot()["metrics"], content_type=exporter.CONTENT_TYPE)
+
+
 @app.route("/api/logs")
-def api_logs():
-    """API: Get recent logs"""
+async def api_logs():
+    """API: Get recent logs (from the follower's ring buffer)"""
     try:
-        if LOG_FILE.exists():
-            # Use tail to get last 50 lines efficiently to avoid memory spikes
-            # Reading the entire file into memory (read_text) is dangerous for large logs
-            try:
-                result = subprocess.run(
-                    ["tail", "-n", "50", str(LOG_FILE)],
-                    capture_output=True,
-                    text=True,
-                    timeout=2,
-                )
-                if result.returncode == 0:
-                    lines = result.stdout.splitlines()
-                    return jsonify({"logs": lines})
-            except subprocess.TimeoutExpired:
-                return jsonify({"logs": ["Error: Log read timed out"]})
-            except Exception as e:
-                return jsonify({"logs": [f"Error reading logs with tail: {str(e)}"]})
-
-            # Fallback if tail fails for some reason
-            lines = LOG_FILE.read_text().splitlines()[-50:]
-            return jsonify({"logs": lines})
-        return jsonify({"logs": ["No logs available yet."]})
-    except Exception as e:
-        return jsonify({"logs": [f"Error reading logs: {str(e)}"]})
+        count = int(request.args.get("lines", LOG_BACKLOG))
+    except ValueError:
+        return jsonify({"success": False, "error": "lines must be an integer"}), 400
+    count = min(max(count, 1), stream_log.ring.maxlen)
+    lines = [line for _, line in stream_log.tail(count)]
+    if not lines and not LOG_FILE.exists():
+        lines = ["No logs available yet."]
+    return jsonify({"logs": lines})
 
 
 @app.route("/api/logs/stream")
-def api_logs_stream():
+async def api_logs_stream():
     """Server-Sent Events endpoint for log streaming"""
+    last_id = request.headers.get("Last-Event-ID", "")
 
-    def generate():
-        if LOG_FILE.exists():
-            last_pos = 0
+    async def generate():
+        queue = stream_log.subscribe()
+        try:
+            # A reconnecting EventSource resumes after the last line it got
+            if last_id.isdigit():
+                backlog = stream_log.tail(after=int(last_id))
+            else:
+                backlog = stream_log.tail(LOG_BACKLOG)
+            sent = 0
+            for seq, line in backlog:
+                sent = seq
+                yield f"id: {seq}\ndata: {line}\n\n"
             while True:
                 try:
-                    current_size = LOG_FILE.stat().st_size
-                    if current_size > last_pos:
-                        with open(LOG_FILE, "r") as f:
-                            f.seek(last_pos)
-                            new_lines = f.readlines()
-                            last_pos = f.tell()
-                            for line in new_lines:
-                                yield f"data: {line.strip()}\n\n"
-                except Exception as e:
-                    print(f"Log stream error: {e}")
-                time.sleep(1)  # Check for new logs every second
-
-    return Response(generate(), mimetype="text/event-stream")
-
-
-def background_task():
-    """Emit periodic updates to all connected clients"""
+                    kind, item = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if kind == "reset":
+                    yield "event: reset\ndata: \n\n"
+                elif item[0] > sent:
+                    sent = item[0]
+                    yield f"id: {item[0]}\ndata: {item[1]}\n\n"
+        finally:
+            stream_log.unsubscribe(queue)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.timeout = None  # the stream stays open while the page does
+    return response
+
+
+@app.route("/api/events")
+async def api_events():
+    """API: Structured stream events (?since=<unix time>&type=&limit=)"""
+    try:
+        since = float(request.args.get("since", 0))
+        limit = int(request.args.get("limit", 500))
+    except ValueError:
+        return (
+            jsonify({"success": False, "error": "since and limit must be numbers"}),
+            400,
+        )
+    limit = min(max(limit, 1), stream_events.MAX_EVENTS)
+    found = events.since(since, request.args.get("type"), limit)
+    return jsonify({"events": found, "latest": events.seq})
+
+
+@socketio.on("subscribe_logs")
+async def on_subscribe_logs(sid, data=None):
+    """Socket.IO log viewers: send the backlog, then live lines"""
+    await socketio.enter_room(sid, "logs")
+    lines = [line for _, line in stream_log.tail(LOG_BACKLOG)]
+    await socketio.emit("log_lines", {"lines": lines, "reset": False}, to=sid)
+
+
+@socketio.on("subscribe_viewers")
+async def on_subscribe_viewers(sid, data=None):
+    """Socket.IO viewer list: the full list once, then diffs"""
+    await socketio.enter_room(sid, "viewers")
+    await socketio.emit("viewers", {"snapshot": viewers.snapshot()}, to=sid)
+
+
+async def log_fanout_task():
+    """Forward new log lines to the Socket.IO "logs" room in batches"""
+    queue = stream_log.subscribe()
+    while True:
+        batch = [await queue.get()]
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        reset = any(kind == "reset" for kind, _ in batch)
+        lines = [item[1] for kind, item in batch if kind == "line"]
+        try:
+            await socketio.emit(
+                "log_lines", {"lines": lines, "reset": reset}, room="logs"
+            )
+        except Exception as e:
+            print(f"Error in log fan-out: {e}")
+
+
+async def log_rotation_task():
+    """Rotate live logs that grew too large or too old"""
+    while True:
+        await asyncio.sleep(LOG_ROTATE_INTERVAL)
+        for log_file in (LOG_FILE, CAPTURE_LOG_FILE):
+            try:
+                size = log_file.stat().st_size
+            except FileNotFoundError:
+                continue
+            opened = log_opened.setdefault(log_file, time.time())
+            if size > LOG_MAX_BYTES or (size and time.time() - opened > LOG_MAX_AGE):
+                try:
+                    await rotate_log(log_file, live=True)
+                    log_opened[log_file] = time.time()
+                except OSError as e:
+                    print(f"Error rotating {log_file}: {e}")
+
+
+async def event_task():
+    """Parse new stream.log lines into structured events as they arrive"""
+    parser = stream_events.EventParser()
+    queue = stream_log.subscribe()
     while True:
         try:
-            stats = get_system_stats()
-            status = get_stream_status()
-            socketio.emit("combined_update", {"stats": stats, "status": status})
+            batch = [await asyncio.wait_for(queue.get(), EVENT_FLUSH_DELAY)]
+        except asyncio.TimeoutError:
+            # Nothing followed a held ERROR/WARNING, so it is complete
+            batch = []
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        found = []
+        for kind, item in batch:
+            found += parser.flush() if kind == "reset" else parser.feed(item[1])
+        if not batch:
+            found = parser.flush()
+        if not found:
+            continue
+        try:
+            stamped = events.append(found)
+            await socketio.emit("stream_events", {"events": stamped})
+        except Exception as e:
+            print(f"Error recording stream events: {e}")
+
+
+async def capability_task():
+    """Probe capabilities at startup and whenever plugins or the device change"""
+    while True:
+        try:
+            if await asyncio.to_thread(probe_capabilities):
+                probed = capability_state["result"]
+                await socketio.emit(
+                    "capabilities",
+                    {
+                        "supported": detect_av1_support(),
+                        "vaapi": probed["vaapi"],
+                        "nvenc": probed["nvenc"],
+                    },
+                )
+        except Exception as e:
+            print(f"Error probing capabilities: {e}")
+        await asyncio.sleep(CAPABILITY_CHECK_INTERVAL)
+
+
+async def supervisor_task():
+    """Stall detection: the pipeline runs but no media reaches the server"""
+    while True:
+        await asyncio.sleep(SUPERVISOR_INTERVAL)
+        if stream_supervisor.state != "running":
+            continue
+        try:
+            if engine.running:
+                stats = await asyncio.to_thread(engine.get_webrtc_stats)
+                counter = supervisor.webrtc_progress(stats)
+            else:
+                status = current_snapshot()["status"]
+                counter = supervisor.server_progress(
+                    status.get("stream_info"), load_config().get("stream_key")
+                )
+            if stream_supervisor.progress(counter):
+                await pipeline_failed("stalled", media_counter=counter)
+        except Exception as e:
+            print(f"Error in supervisor task: {e}")
+
+
+def builtin_viewer_records():
+    """Records for the built-in WHEP server's sessions (blocks on get-stats)"""
+    whep_server.prune()
+    return [
+        viewer_sessions.from_webrtc_stats(
+            session.id, session.stream_key, session.stats(), session.created
+        )
+        for session in list(whep_server.sessions.values())
+    ]
+
+
+async def viewer_task():
+    """Track viewer sessions and push what changed to the "viewers" room"""
+    while True:
+        await asyncio.sleep(VIEWER_INTERVAL)
+        try:
+            records = await asyncio.to_thread(builtin_viewer_records)
+            sources = {"builtin"}
+            cache = getattr(get_stream_status, "broadcast_cache", {})
+            if cache.get("timestamp") != viewer_state["status_time"]:
+                viewer_state["status_time"] = cache.get("timestamp")
+                stream_info = (cache.get("data") or {}).get("info")
+                records += viewer_sessions.from_broadcast_box(stream_info)
+                sources.add("broadcast-box")
+            diff = viewers.update(records, sources=sources)
+            if diff["added"] or diff["updated"] or diff["removed"]:
+                await socketio.emit("viewers", {"diff": diff}, room="viewers")
+        except Exception as e:
+            print(f"Error tracking viewers: {e}")
+
+
+async def abr_task():
+    """Feed WebRTC sender stats to the bitrate controller and apply its output"""
+    controller = None
+    started_at = None
+    while True:
+        await asyncio.sleep(ABR_INTERVAL)
+        try:
+            config = load_config()
+            if not (engine.running and config.get("adaptive_bitrate")):
+                controller = None
+                abr_state["active"] = False
+                continue
+
+            # Fresh controller for every new pipeline
+            if controller is None or started_at != engine.started_at:
+                started_at = engine.started_at
+                params = engine.get_params()
+                controller = abr.BitrateController(
+                    {
+                        "min_bitrate": config["abr_min_bitrate"],
+                        "max_bitrate": config["abr_max_bitrate"],
+                        "max_resolution": config["resolution"],
+                        "fps": params.get("fps", config["fps"]),
+                    },
+                    bitrate=params.get("bitrate"),
+                    resolution=params.get("resolution"),
+                )
+
+            stats = await asyncio.to_thread(engine.get_webrtc_stats)
+            sample = abr.extract_sample(stats)
+            if sample is None:
+                continue
+            if config.get("abr_record_trace"):
+                with open(ABR_TRACE_FILE, "a") as f:
+                    f.write(json.dumps(sample) + "\n")
+
+            target = controller.update(sample)
+            if target:
+                await asyncio.to_thread(engine.set_params, **target)
+                await socketio.emit("abr_update", {"sample": sample, "target": target})
+            abr_state.update(
+                {
+                    "active": True,
+                    "sample": sample,
+                    "target": {
+                        "bitrate": controller.bitrate,
+                        "resolution": controller.resolution,
+                    },
+                    "updated": time.time(),
+                }
+            )
+        except Exception as e:
+            print(f"Error in ABR task: {e}")
+
+
+def governor_sample(previous):
+    """CPU, hottest thermal zone and encoded/target FPS since previous"""
+    stats = current_snapshot()["stats"]
+    zones = governor.read_thermal()
+    now = time.monotonic()
+    frames = engine.counters().get("frames_encoded")
+    fps = engine.get_params().get("fps")
+    sample = {
+        "t": round(time.time(), 3),
+        "cpu": stats["cpu"],
+        "cpu_core": max(stats["cpu_per_core"] or [0]),
+        "temp": max(zones.values()) if zones else None,
+        "fps_ratio": None,
+        "frames": frames,
+        "at": now,
+    }
+    if previous and frames is not None and previous["frames"] is not None and fps:
+        encoded = (frames - previous["frames"]) / (now - previous["at"])
+        sample["fps_ratio"] = round(encoded / fps, 3)
+    return sample
+
+
+async def governor_task():
+    """Step the running encoder down/up its ladder under CPU/thermal pressure"""
+    controller = None
+    started_at = None
+    previous = None
+    while True:
+        await asyncio.sleep(GOVERNOR_INTERVAL)
+        try:
+            config = load_config()
+            if not (engine.running and config.get("governor")):
+                controller = None
+                governor_state.update({"active": False, "level": 0})
+                continue
+
+            # Fresh governor for every new pipeline, at the configured quality
+            if controller is None or started_at != engine.started_at:
+                started_at = engine.started_at
+                previous = None
+                ladder = STREAMING_SCRIPTS[engine.script_id].get("ladder") or []
+                if config.get("adaptive_bitrate"):
+                    # ABR owns the resolution
+                    ladder = [rung for rung in ladder if set(rung) != {"resolution"}]
+                controls = await asyncio.to_thread(engine.live_controls)
+                if controls is None:
+                    controller = None
+                    continue
+                usable = governor.usable_ladder(ladder, controls)
+                if len(usable) < len(ladder):
+                    engine.log(
+                        f"Governor: {len(ladder) - len(usable)} ladder rung(s) "
+                        "cannot change while playing, skipped"
+                    )
+                controller = governor.Governor(usable)
+
+            sample = await asyncio.to_thread(governor_sample, previous)
+            previous = sample
+            change = controller.update(sample)
+            if change:
+                direction, reason = change
+                base = {
+                    "fps": int(config["fps"]),
+                    "resolution": config["resolution"],
+                    "encoder": pipeline_builder.ENCODERS[engine.script_id][
+                        "properties"
+                    ],
+                }
+                target = governor.level_settings(
+                    controller.ladder, controller.level, base
+                )
+                applied, skipped = await asyncio.to_thread(
+                    engine.set_encoder_properties, target["encoder"]
+                )
+                params = {"fps": target["fps"]}
+                if not config.get("adaptive_bitrate"):
+                    params["resolution"] = target["resolution"]
+                applied.update(await asyncio.to_thread(engine.set_params, **params))
+                step = {
+                    "type": "governor",
+                    "direction": direction,
+                    "level": controller.level,
+                    "reason": reason,
+                    "applied": applied,
+                    "skipped": skipped,
+                }
+                await socketio.emit("stream_events", {"events": events.append([step])})
+                await socketio.emit("governor", step)
+                governor_state["target"] = target
+            governor_state.update(
+                {
+                    "active": True,
+                    "level": controller.level,
+                    "sample": {
+                        key: sample[key]
+                        for key in ("t", "cpu", "cpu_core", "temp", "fps_ratio")
+                    },
+                }
+            )
+        except Exception as e:
+            print(f"Error in governor task: {e}")
+
+
+async def queue_sample_task():
+    """Poll queue fill levels of the in-process pipeline"""
+    while True:
+        await asyncio.sleep(QUEUE_SAMPLE_INTERVAL)
+        probes = metrics_state["probes"]
+        if probes is None or not engine.running:
+            continue
+        try:
+            probes.sample_queues()
+        except Exception as e:
+            print(f"Error sampling queues: {e}")
+
+
+def collect_metrics(stats, status, previous):
+    """Build the /metrics exposition from one sample.
+
+    previous is the last snapshot, so rates are computed over the sampling
+    interval.
+    """
+    config = load_config()
+    out = exporter.Exposition()
+    now = time.time()
+    elapsed = now - previous.get("taken", 0)
+
+    for index, percent in enumerate(stats["cpu_per_core"]):
+        out.add(
+            "cpu_usage_percent",
+            "gauge",
+            "CPU busy percent per core over the sampling interval",
+            percent,
+            cpu=index,
+        )
+
+    memory = psutil.virtual_memory()
+    out.add("memory_used_bytes", "gauge", "Memory in use", memory.used)
+    out.add("memory_total_bytes", "gauge", "Total memory", memory.total)
+    for nic, counters in psutil.net_io_counters(pernic=True).items():
+        if nic == "lo":
+            continue
+        out.add(
+            "network_sent_bytes_total",
+            "counter",
+            "Bytes sent per interface",
+            counters.bytes_sent,
+            interface=nic,
+        )
+        out.add(
+            "network_received_bytes_total",
+            "counter",
+            "Bytes received per interface",
+            counters.bytes_recv,
+            interface=nic,
+        )
+
+    if stats["gpu"]:
+        out.add(
+            "gpu_utilization_percent",
+            "gauge",
+            "GPU utilization",
+            stats["gpu"]["utilization"],
+            gpu=stats["gpu"]["name"],
+        )
+        out.add(
+            "gpu_temperature_celsius",
+            "gauge",
+            "GPU temperature",
+            stats["gpu"]["temperature"],
+            gpu=stats["gpu"]["name"],
+        )
+
+    script_id = config.get("selected_script", "vp9")
+    out.add(
+        "streaming",
+        "gauge",
+        "1 while the streaming pipeline runs",
+        status["streaming"],
+        script=script_id,
+        mode=config.get("pipeline_mode", "builder"),
+    )
+    out.add(
+        "broadcast_box_up",
+        "gauge",
+        "Broadcast Box API reachable",
+        status["broadcast_box"],
+    )
+    out.add(
+        "stream_uptime_seconds",
+        "gauge",
+        "Seconds since the pipeline started",
+        get_stream_uptime() if status["streaming"] else None,
+    )
+    out.add(
+        "stream_starts_total",
+        "counter",
+        "Times the stream started",
+        stream_counters["starts"],
+    )
+    for stage, key in (("start", "start_failures"), ("running", "crashes")):
+        out.add(
+            "stream_failures_total",
+            "counter",
+            "Times the stream failed: to start, or while running (exited, "
+            "stalled or a pipeline error)",
+            stream_counters[key],
+            stage=stage,
+        )
+    for trigger in ("manual", "automatic"):
+        out.add(
+            "stream_restarts_total",
+            "counter",
+            "Restarts: manual through the control panel API, automatic by "
+            "the supervisor after a failure",
+            stream_counters[f"{trigger}_restarts"],
+            trigger=trigger,
+        )
+    out.add(
+        "stream_last_stop_seconds",
+        "gauge",
+        "How long the last stop took to drain the pipeline",
+        last_stop["seconds"],
+    )
+    out.add(
+        "governor_level",
+        "gauge",
+        "Encode governor steps below the configured quality",
+        governor_state["level"],
+    )
+    sessions = exporter.count_viewers(status["stream_info"])
+    for key, count in whep_server.counts().items():
+        sessions[key] = sessions.get(key, 0) + count
+    for key, count in sessions.items():
+        out.add(
+            "viewers", "gauge", "WHEP sessions per stream key", count, stream_key=key
+        )
+    clients = beacons.summary()
+    out.add(
+        "viewer_clients", "gauge", "Viewers sending stats beacons", clients["clients"]
+    )
+    out.add(
+        "viewer_jitter_buffer_ms",
+        "gauge",
+        "p95 jitter buffer delay reported by viewers (beacon window)",
+        clients["jitter_ms_p95"],
+    )
+    out.add(
+        "viewer_freezes",
+        "gauge",
+        "Video freezes reported by viewers (beacon window)",
+        clients["freezes"],
+    )
+    out.add(
+        "viewer_dropped_ratio",
+        "gauge",
+        "Share of frames viewers dropped (beacon window)",
+        clients["dropped_ratio"],
+    )
+
+    # Encoder output: the engine counts frames itself, gst-launch pipelines
+    # only when the tracers are on
+    params = engine.get_params() if engine.running else {}
+    out.add(
+        "encoder_target_bitrate_kbps",
+        "gauge",
+        "Bitrate the encoder is set to",
+        params.get("bitrate", config.get("bitrate")) if status["streaming"] else None,
+    )
+    buffers, queues = metrics.totals()
+    counters = engine.counters() if engine.running else {}
+    frames = counters.get("frames_encoded", buffers.get("venc"))
+    out.add("encoder_frames_total", "counter", "Frames out of the encoder", frames)
+    if frames is not None and previous.get("frames") is not None and elapsed > 0:
+        delta = frames - previous["frames"]
+        if delta >= 0:
+            out.add(
+                "encoder_fps",
+                "gauge",
+                "Encoded frames per second over the sampling interval",
+                round(delta / elapsed, 2),
+            )
+    out.add(
+        "frames_dropped_total",
+        "counter",
+        "Frames dropped by videorate (engine mode, includes rate decimation)",
+        counters.get("frames_dropped"),
+    )
+    for outcome in ("requested", "forwarded", "coalesced"):
+        out.add(
+            "keyframe_requests_total",
+            "counter",
+            "Viewer keyframe requests (PLI/FIR): requested, let through to "
+            "the encoder, coalesced by the rate limit",
+            counters.get(f"keyframes_{outcome}"),
+            outcome=outcome,
+        )
+    if engine.running:
+        for report in abr.find_stats(engine.get_webrtc_stats(), "outbound-rtp"):
+            out.add(
+                "rtp_sent_bytes_total",
+                "counter",
+                "RTP payload bytes sent per stream",
+                report.get("bytes-sent"),
+                ssrc=report.get("ssrc", ""),
+            )
+
+    for name, level in queues.items():
+        labels = {"queue": name, "setting": pipeline_metrics.queue_setting(name) or ""}
+        out.add(
+            "queue_level_buffers",
+            "gauge",
+            "Buffers queued",
+            level["level_buffers"],
+            **labels,
+        )
+        out.add(
+            "queue_level_seconds",
+            "gauge",
+            "Media time queued",
+            level["level_time_ms"] / 1000,
+            **labels,
+        )
+        out.add(
+            "queue_max_buffers",
+            "gauge",
+            "Queue buffer limit",
+            level["max_buffers"],
+            **labels,
+        )
+
+    return out.render(), frames
+
+
+def take_snapshot(previous):
+    """Collect stats, status and the /metrics payload in one pass"""
+    stats = get_system_stats()
+    status = get_stream_status()
+    metrics_text, frames = collect_metrics(stats, status, previous)
+    return {
+        "taken": time.time(),
+        "stats": stats,
+        "status": status,
+        "metrics": metrics_text,
+        "frames": frames,
+    }
+
+
+def current_snapshot():
+    """Latest published snapshot (the first one is taken before serving)"""
+    return sampler_state["snapshot"]
+
+
+def request_sample():
+    """Have the sampler refresh now (after a start/stop)"""
+    sampler_state["wake"].set()
+
+
+def run_latency_probe(script_id, config, seconds, transport):
+    """Run a latency probe in the background and publish its result
+    (api_latency has already set latency_state["running"])"""
+    try:
+        probe = latency_probe.LatencyProbe(
+            script_id,
+            {
+                "resolution": config["resolution"],
+                "fps": config["fps"],
+                "bitrate": config["bitrate"],
+            },
+            transport,
+        )
+        latency_state["result"] = probe.run(seconds)
+    except Exception as e:
+        latency_state["result"] = {"error": str(e), "finished": time.time()}
+    finally:
+        latency_state["running"] = False
+
+
+async def background_task():
+    """The one stats sampler: publish a snapshot and push it to clients"""
+    wake = sampler_state["wake"]
+    while True:
+        try:
+            snapshot = await asyncio.to_thread(
+                take_snapshot, sampler_state["snapshot"] or {}
+            )
+            sampler_state["snapshot"] = snapshot
+            await socketio.emit(
+                "combined_update",
+                {
+                    "stats": snapshot["stats"],
+                    "status": snapshot["status"],
+                    "latency": latency_state,
+                },
+            )
         except Exception as e:
             print(f"Error in background task: {e}")
-        socketio.sleep(2)  # Update every 2 seconds
+        try:
+            await asyncio.wait_for(wake.wait(), SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        wake.clear()
 
 
-if __name__ == "__main__":
-    # Start background task
-    bg_thread = Thread(target=background_task)
-    bg_thread.daemon = True
-    bg_thread.start()
+async def main():
+    loop = asyncio.get_running_loop()
+    engine.on_failure = lambda reason: loop.call_soon_threadsafe(
+        asyncio.create_task, pipeline_failed("pipeline error", error=reason)
+    )
+    gpu.start()
+    pipeline_metrics.TracerReader(TRACER_FIFO, metrics).start()
+    sampler_state["snapshot"] = await asyncio.to_thread(take_snapshot, {})
+    # Catch up on the existing log first, so its events (recorded before a
+    # panel restart) are not parsed a second time
+    stream_log.read_new(limit=None)
+
+    # Start background tasks
+    tasks = [
+        asyncio.create_task(task())
+        for task in (
+            background_task,
+            abr_task,
+            governor_task,
+            viewer_task,
+            queue_sample_task,
+            log_fanout_task,
+            log_rotation_task,
+            event_task,
+            supervisor_task,
+            capability_task,
+            stream_log.run,
+        )
+    ]
+
+    config = HypercornConfig()
+    config.bind = ["0.0.0.0:8081"]
+    try:
+        await serve(asgi_app, config)
+    finally:
+        for task in tasks:
+            task.cancel()
 
-    socketio.run(app, host="0.0.0.0", port=8081, debug=False)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,229 @@
+"""
+Structured events from the stream log
+
+Turns gst-launch / engine output lines into events (state changes, EOS,
+warnings and errors with their debug info, WHIP signalling, process exits)
+as they arrive, and keeps them in a JSONL file plus an in-memory window for
+/api/events. Parsing is incremental: each log line is looked at once.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+MAX_EVENTS = 5000
+MAX_FILE_BYTES = 5 * 1024 * 1024
+
+# gst-launch-1.0 messages
+_LAUNCH_STATE = re.compile(
+    r"^(Setting pipeline to (?P<target>[A-Z_]+)|Pipeline is (?P<state>[A-Z_]+))"
+)
+_LAUNCH_ISSUE = re.compile(
+    r"^(?P<level>ERROR|WARNING): from element (?P<path>\S+): (?P<message>.*)$"
+)
+_LAUNCH_FAILURE = re.compile(r"^ERROR: (?P<message>.*)$")
+_LAUNCH_EOS = re.compile(r"^(Got EOS from element|EOS on shutdown|Execution ended)")
+# In-process engine (gst_engine.StreamEngine.log)
+_ENGINE_STATE = re.compile(r"^\[engine\] Pipeline state (?P<old>\w+) -> (?P<new>\w+)")
+_ENGINE_ISSUE = re.compile(
+    r"^\[engine\] (?P<level>ERROR|WARNING) from (?P<element>\S+): (?P<message>.*)$"
+)
+# GST_DEBUG output: time pid thread LEVEL category file:line:func:<object> msg
+_GST_DEBUG = re.compile(
+    r"^\d+:\d{2}:\d{2}\.\d+\s+\d+\s+0x[0-9a-f]+\s+(?P<level>ERROR|WARN|FIXME)\s+"
+    r"(?P<category>\S+)\s+\S+:\d+:[^:]*:(?:<(?P<element>[^>]*)>)?\s*(?P<message>.*)$"
+)
+_PANEL_EXIT = re.compile(
+    r"^\[panel\] Process (?P<pid>\d+) exited with code (?P<code>-?\d+)"
+)
+_WHIP = re.compile(r"whip", re.IGNORECASE)
+_WHIP_DETAIL = re.compile(
+    r"(offer|answer|sdp|ice|peer.?connection|session|status|location|"
+    r"\b[1-5]\d\d\b|POST|PATCH|DELETE|connect)",
+    re.IGNORECASE,
+)
+
+
+class EventParser:
+    """Line-at-a-time parser.
+
+    gst-launch prints "Additional debug info:" and the detail on the lines
+    after an ERROR/WARNING, so those events are held until the next
+    unrelated line (or flush()) to attach the detail.
+    """
+
+    def __init__(self):
+        self.pending = None
+        self._detail_next = False
+
+    def flush(self):
+        event, self.pending = self.pending, None
+        self._detail_next = False
+        return [event] if event else []
+
+    def feed(self, line):
+        line = line.strip()
+        if not line:
+            return []
+        if self.pending is not None:
+            if line == "Additional debug info:":
+                self._detail_next = True
+                return []
+            if self._detail_next:
+                # The debug info is a source location line ending in ":"
+                # and the message on the line after it
+                if "detail" in self.pending:
+                    self.pending["detail"] += "\n" + line
+                    return self.flush()
+                self.pending["detail"] = line
+                if not line.endswith(":"):
+                    return self.flush()
+                return []
+        events = self.flush()
+        event = self.parse(line)
+        if event is None:
+            return events
+        if event["type"] in ("error", "warning") and event.pop("hold", False):
+            self.pending = event
+            return events
+        return events + [event]
+
+    @staticmethod
+    def parse(line):
+        """One line -> event dict (without seq/t), or None"""
+        match = _LAUNCH_ISSUE.match(line)
+        if match:
+            return {
+                "type": match.group("level").lower(),
+                "element": match.group("path").rsplit(":", 1)[-1],
+                "message": match.group("message"),
+                "source": "gst-launch",
+                "hold": True,
+            }
+        match = _LAUNCH_FAILURE.match(line)
+        if match:
+            return {
+                "type": "error",
+                "message": match.group("message"),
+                "source": "gst-launch",
+            }
+        match = _ENGINE_ISSUE.match(line)
+        if match:
+            return {
+                "type": match.group("level").lower(),
+                "element": match.group("element"),
+                "message": match.group("message"),
+                "source": "engine",
+            }
+        match = _GST_DEBUG.match(line)
+        if match:
+            whip = _WHIP.search(
+                match.group("category") + (match.group("element") or "")
+            )
+            return {
+                "type": (
+                    "whip"
+                    if whip
+                    else ("error" if match.group("level") == "ERROR" else "warning")
+                ),
+                "level": match.group("level").lower(),
+                "category": match.group("category"),
+                "element": match.group("element"),
+                "message": match.group("message"),
+                "source": "gst-debug",
+            }
+        match = _LAUNCH_STATE.match(line)
+        if match:
+            if match.group("target"):
+                return {"type": "state", "target": match.group("target")}
+            return {"type": "state", "state": match.group("state")}
+        match = _ENGINE_STATE.match(line)
+        if match:
+            return {
+                "type": "state",
+                "from": match.group("old"),
+                "state": match.group("new"),
+                "source": "engine",
+            }
+        if _LAUNCH_EOS.match(line):
+            return {"type": "eos", "message": line}
+        match = _PANEL_EXIT.match(line)
+        if match:
+            return {
+                "type": "exit",
+                "pid": int(match.group("pid")),
+                "code": int(match.group("code")),
+            }
+        if _WHIP.search(line) and _WHIP_DETAIL.search(line):
+            return {"type": "whip", "message": line}
+        return None
+
+
+class EventLog:
+    """Append-only JSONL event file with an in-memory query window"""
+
+    def __init__(self, path, keep=MAX_EVENTS):
+        self.path = str(path)
+        self.events = deque(maxlen=keep)
+        self.seq = 0
+        self._lock = threading.Lock()
+        self._load_tail()
+
+    def _load_tail(self, max_bytes=1024 * 1024):
+        """Pick up recent events from before a panel restart"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - max_bytes))
+                chunk = f.read()
+        except FileNotFoundError:
+            return
+        lines = chunk.split(b"\n")
+        if size > max_bytes:
+            lines = lines[1:]  # first line is probably cut
+        for raw in lines:
+            try:
+                event = json.loads(raw)
+            except ValueError:
+                continue
+            self.events.append(event)
+            self.seq = max(self.seq, event.get("seq", 0))
+
+    def append(self, events):
+        """Stamp, store and persist events; returns them"""
+        if not events:
+            return []
+        now = time.time()
+        with self._lock:
+            stamped = []
+            for event in events:
+                self.seq += 1
+                stamped.append({"seq": self.seq, "t": round(now, 3), **event})
+            self.events.extend(stamped)
+            self._rotate_if_large()
+            with open(self.path, "a") as f:
+                for event in stamped:
+                    f.write(json.dumps(event) + "\n")
+        return stamped
+
+    def _rotate_if_large(self):
+        try:
+            if os.path.getsize(self.path) > MAX_FILE_BYTES:
+                os.replace(self.path, self.path + ".1")
+        except FileNotFoundError:
+            pass
+
+    def since(self, since=0.0, event_type=None, limit=500):
+        """Events newer than the since timestamp, oldest first"""
+        with self._lock:
+            events = [
+                event
+                for event in self.events
+                if event["t"] > since
+                and (event_type is None or event["type"] == event_type)
+            ]
+        return events[-limit:]
@@ -0,0 +1,299 @@
+"""
+Stream supervisor
+
+Decides what happens when the pipeline dies or stops sending media: restart
+with exponential backoff, or give up after too many crashes in a short
+window (crash loop). The panel feeds it exits (noticed the moment they
+happen, via the child's wait() or a pidfd) and a media progress counter;
+every transition comes back as an event dict for Socket.IO clients.
+
+Also stops the pipeline's process group: EOS first, so the WHIP sink
+closes its session with a DELETE, and waits on the exact PIDs.
+"""
+
+import asyncio
+import os
+import signal
+import time
+from collections import deque
+
+import psutil
+
+from abr import find_stats
+
+DEFAULT_SETTINGS = {
+    # Restart delays: initial * factor^(crashes - 1), capped at max
+    "backoff_initial": 1.0,
+    "backoff_factor": 2.0,
+    "backoff_max": 60.0,
+    # Give up after crash_limit failures within crash_window seconds
+    "crash_limit": 5,
+    "crash_window": 300.0,
+    # A run this long forgets earlier crashes
+    "stable_after": 120.0,
+    # Alive but no media for stall_timeout seconds (after start_grace) is a stall
+    "stall_timeout": 15.0,
+    "start_grace": 20.0,
+}
+
+
+class Supervisor:
+    """Restart policy and stall detector for one stream.
+
+    States: stopped, running, backoff (a restart is scheduled), restarting
+    and crash_loop (restarts gave up until the next manual start).
+    """
+
+    def __init__(self, settings=None):
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.state = "stopped"
+        self.wanted = False
+        self.restarts = 0
+        self.started_at = None
+        self.crashes = deque()
+        self.history = deque(maxlen=50)
+        self._progress = None
+        self._progress_at = None
+
+    def _transition(self, state, reason, now, **info):
+        self.state = state
+        event = {
+            "state": state,
+            "reason": reason,
+            "t": round(now, 3),
+            "restarts": self.restarts,
+            **info,
+        }
+        self.history.append(event)
+        return event
+
+    def started(self, now=None, automatic=False):
+        """The pipeline came up; automatic=True for the supervisor's restarts"""
+        now = now or time.time()
+        if not automatic:
+            self.crashes.clear()
+            self.restarts = 0
+        self.wanted = True
+        self.started_at = now
+        self._progress = None
+        self._progress_at = now
+        return self._transition("running", "restarted" if automatic else "started", now)
+
+    def switched(self, now=None):
+        """The running pipeline was replaced in place (warm-standby swap)"""
+        now = now or time.time()
+        self._progress = None
+        self._progress_at = now
+        return self._transition("running", "switched", now)
+
+    def restarting(self, now=None):
+        """The backoff delay is over and the restart begins"""
+        return self._transition("restarting", "backoff elapsed", now or time.time())
+
+    def stopped(self, now=None):
+        """Stopped on request: no more restarts"""
+        self.wanted = False
+        self.started_at = None
+        return self._transition("stopped", "stopped", now or time.time())
+
+    def failed(self, reason, now=None, **info):
+        """The pipeline exited, stalled or could not start.
+
+        Returns (event, delay): delay is the seconds until the restart, or
+        None for a crash loop. (None, None) when nobody wants it running or
+        a restart is already pending (e.g. both stages of a split pipeline
+        exiting).
+        """
+        if not self.wanted or self.state not in ("running", "restarting"):
+            return None, None
+        now = now or time.time()
+        settings = self.settings
+        if self.started_at and now - self.started_at >= settings["stable_after"]:
+            self.crashes.clear()
+        self.started_at = None
+        self.crashes.append(now)
+        while now - self.crashes[0] > settings["crash_window"]:
+            self.crashes.popleft()
+
+        if len(self.crashes) >= settings["crash_limit"]:
+            self.wanted = False
+            event = self._transition(
+                "crash_loop", reason, now, crashes=len(self.crashes), **info
+            )
+            return event, None
+
+        delay = min(
+            settings["backoff_initial"]
+            * settings["backoff_factor"] ** (len(self.crashes) - 1),
+            settings["backoff_max"],
+        )
+        self.restarts += 1
+        event = self._transition(
+            "backoff", reason, now, delay=delay, crashes=len(self.crashes), **info
+        )
+        return event, delay
+
+    def progress(self, counter, now=None):
+        """Feed a media counter (bytes or packets sent); True once stalled.
+
+        None means the counter is unavailable right now and never counts
+        as a stall.
+        """
+        if self.state != "running" or counter is None:
+            return False
+        now = now or time.time()
+        if self._progress is None or counter > self._progress:
+            self._progress = counter
+            self._progress_at = now
+            return False
+        if now - self.started_at < self.settings["start_grace"]:
+            return False
+        return now - self._progress_at >= self.settings["stall_timeout"]
+
+    def status(self):
+        return {
+            "state": self.state,
+            "wanted": self.wanted,
+            "restarts": self.restarts,
+            "recent_crashes": len(self.crashes),
+            "uptime": time.time() - self.started_at if self.started_at else None,
+            "history": list(self.history)[-10:],
+        }
+
+
+def webrtc_progress(stats):
+    """Bytes sent on all outbound RTP streams of a webrtcbin stats dict"""
+    total = None
+    for report in find_stats(stats, "outbound-rtp"):
+        total = (total or 0) + int(report.get("bytes-sent", 0))
+    return total
+
+
+def server_progress(stream_info, stream_key):
+    """Packets Broadcast Box received for stream_key, from its /api/status"""
+    if not isinstance(stream_info, list):
+        return None
+    for stream in stream_info:
+        if not isinstance(stream, dict) or stream.get("streamKey") != stream_key:
+            continue
+        if "videoStreams" not in stream and "audioPacketsReceived" not in stream:
+            return None  # this Broadcast Box does not report packet counts
+        packets = stream.get("audioPacketsReceived") or 0
+        for video in stream.get("videoStreams") or []:
+            packets += video.get("packetsReceived") or 0
+        return packets
+    return 0
+
+
+def write_pid_file(pid_file, pid):
+    """PID plus the process start time, so a reused PID is not mistaken for it"""
+    try:
+        started = psutil.Process(pid).create_time()
+    except psutil.NoSuchProcess:
+        started = 0
+    pid_file.write_text(f"{pid} {started}")
+
+
+def read_pid(pid_file):
+    """The PID in pid_file if that process still runs, else None"""
+    try:
+        fields = pid_file.read_text().split()
+        pid = int(fields[0])
+        started = float(fields[1]) if len(fields) > 1 else None
+    except (OSError, ValueError, IndexError):
+        return None
+    try:
+        process = psutil.Process(pid)
+        if started and abs(process.create_time() - started) > 1:
+            return None  # the PID was reused by something else
+        if process.status() == psutil.STATUS_ZOMBIE:
+            return None
+    except psutil.NoSuchProcess:
+        return None
+    return pid
+
+
+async def wait_pid(pid, timeout=None):
+    """Wait for any process (not only our children) to exit; True if it did.
+
+    Uses a pidfd, which becomes readable on exit, so nothing polls; falls
+    back to psutil in a worker thread where pidfd_open is unavailable.
+    """
+    try:
+        fd = os.pidfd_open(pid)
+    except ProcessLookupError:
+        return True
+    except (AttributeError, OSError):
+        try:
+            await asyncio.to_thread(psutil.Process(pid).wait, timeout)
+        except psutil.NoSuchProcess:
+            pass
+        except psutil.TimeoutExpired:
+            return False
+        return True
+
+    loop = asyncio.get_running_loop()
+    exited = loop.create_future()
+    loop.add_reader(fd, lambda: exited.done() or exited.set_result(True))
+    try:
+        await asyncio.wait_for(exited, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+
+
+def group_members(pgid):
+    """PIDs of every process in process group pgid"""
+    members = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # state, ppid and pgrp follow the ")"-terminated comm field
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[2]) == pgid:
+            members.append(int(entry))
+    return members
+
+
+async def _wait_all(pids, timeout, process=None):
+    waits = [
+        process.wait() if process is not None and pid == process.pid else wait_pid(pid)
+        for pid in pids
+    ]
+    try:
+        await asyncio.wait_for(asyncio.gather(*waits), timeout)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+async def stop_group(pid, process=None, eos_timeout=5, term_timeout=2):
+    """Stop the process group pid leads; returns (seconds, how it ended).
+
+    SIGINT comes first: gst-launch-1.0 -e turns it into an EOS, which
+    drains the pipeline and lets the WHIP sink DELETE its session. SIGTERM
+    and then SIGKILL follow for whatever outlives each timeout. process is
+    the asyncio child for pid, if the panel started it.
+    """
+    started = time.perf_counter()
+    pids = group_members(pid) or [pid]
+    for sig, timeout, how in (
+        (signal.SIGINT, eos_timeout, "eos"),
+        (signal.SIGTERM, term_timeout, "sigterm"),
+        (signal.SIGKILL, term_timeout, "sigkill"),
+    ):
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            how = "exited"
+            break
+        if await _wait_all(pids, timeout, process):
+            break
+    return time.perf_counter() - started, how
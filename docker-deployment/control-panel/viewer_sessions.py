@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Viewer sessions
+
+Turns Broadcast Box's /api/status (its whepSessions) and the built-in WHEP
+server's webrtcbin stats into one record per viewer: when it connected,
+bytes/packets sent, NACK/PLI/FIR counts, loss, RTT and bandwidth (the
+measured send rate, and the congestion controller's estimate where the
+source reports one). Fields a source does not report stay None.
+
+ViewerTracker keeps a rolling history per viewer and hands out diffs
+(added / updated fields / removed), so the panel is pushed only what
+changed instead of the whole status blob.
+
+BeaconAggregator collects what the viewers measure themselves (getStats()
+summaries beaconed by remote-display.html): decoded FPS, dropped frames,
+jitter buffer delay, freezes, reconnects.
+
+Replay a saved /api/status response (or a JSONL of them):
+    python3 viewer_sessions.py status.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from collections import deque
+from pathlib import Path
+
+from abr import find_stats
+
+HISTORY_SECONDS = 300
+# Viewers that left, kept for "who was watching"
+RECENT_VIEWERS = 50
+
+# Fields kept in the rolling history
+HISTORY_FIELDS = [
+    "bitrate_kbps",
+    "packet_rate",
+    "estimate_kbps",
+    "nack_count",
+    "pli_count",
+    "packets_lost",
+    "rtt_ms",
+]
+
+
+# Viewer beacons: fields accepted and their types; a client that has not
+# beaconed for BEACON_TIMEOUT seconds is gone
+BEACON_FIELDS = {
+    "fps": float,
+    "decoded": int,
+    "dropped": int,
+    "jitter_ms": float,
+    "decode_ms": float,
+    "freezes": int,
+    "freeze_ms": float,
+    "lost": int,
+    "rtt_ms": float,
+    "width": int,
+    "height": int,
+    "reconnects": int,
+    "ice_restarts": int,
+}
+BEACON_TEXT_FIELDS = ["id", "stream_key", "session", "state"]
+BEACON_TIMEOUT = 30
+BEACON_WINDOW = 300
+MAX_BEACONS = 10000
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))], 2)
+
+
+def from_broadcast_box(stream_info):
+    """Viewer records from Broadcast Box's /api/status"""
+    records = []
+    if not isinstance(stream_info, list):
+        return records
+    for stream in stream_info:
+        if not isinstance(stream, dict):
+            continue
+        for session in stream.get("whepSessions") or []:
+            if not isinstance(session, dict) or not session.get("id"):
+                continue
+            records.append(
+                {
+                    "id": session["id"],
+                    "stream_key": stream.get("streamKey", ""),
+                    "source": "broadcast-box",
+                    "layer": session.get("currentLayer"),
+                    "packets_sent": session.get("packetsWritten"),
+                }
+            )
+    return records
+
+
+def from_webrtc_stats(session_id, stream_key, stats, connected_at=None):
+    """One viewer record from its webrtcbin get-stats tree"""
+    record = {
+        "id": session_id,
+        "stream_key": stream_key,
+        "source": "builtin",
+        "connected_at": connected_at,
+    }
+    totals = {}
+    for report in find_stats(stats, "outbound-rtp"):
+        for key, field in (
+            ("bytes-sent", "bytes_sent"),
+            ("packets-sent", "packets_sent"),
+            ("nack-count", "nack_count"),
+            ("pli-count", "pli_count"),
+            ("fir-count", "fir_count"),
+        ):
+            if key in report:
+                totals[field] = totals.get(field, 0) + int(report[key])
+    record.update(totals)
+
+    rtts = []
+    for report in find_stats(stats, "remote-inbound-rtp"):
+        if "packets-lost" in report:
+            record["packets_lost"] = record.get("packets_lost", 0) + max(
+                0, int(report["packets-lost"])
+            )
+        if "round-trip-time" in report:
+            rtts.append(float(report["round-trip-time"]) * 1000)
+    if rtts:
+        record["rtt_ms"] = round(max(rtts), 1)
+    for pair in find_stats(stats, "candidate-pair"):
+        if pair.get("available-outgoing-bitrate"):
+            record["estimate_kbps"] = round(
+                float(pair["available-outgoing-bitrate"]) / 1000
+            )
+    return record
+
+
+class ViewerTracker:
+    """Current viewers, their rolling history and diffs between updates"""
+
+    def __init__(self, history_seconds=HISTORY_SECONDS):
+        self.history_seconds = history_seconds
+        self.viewers = {}
+        self.history = {}
+        self.recent = deque(maxlen=RECENT_VIEWERS)
+        self._counters = {}  # id -> (t, bytes_sent, packets_sent)
+
+    def update(self, records, now=None, sources=None):
+        """Fold in a full set of viewer records; returns the diff.
+
+        sources limits the update to viewers from those sources (the
+        others are left as they are), for sources polled at other rates.
+        """
+        now = time.time() if now is None else now
+        diff = {"t": now, "added": [], "updated": {}, "removed": []}
+        seen = set()
+        for raw in records:
+            viewer_id = raw["id"]
+            seen.add(viewer_id)
+            previous = self.viewers.get(viewer_id)
+            record = self._measure(raw, previous, now)
+            if previous is None:
+                self.viewers[viewer_id] = record
+                self.history[viewer_id] = deque()
+                diff["added"].append(record)
+            else:
+                changed = {
+                    key: value
+                    for key, value in record.items()
+                    if previous.get(key) != value
+                }
+                if changed:
+                    previous.update(changed)
+                    diff["updated"][viewer_id] = changed
+            self._remember(viewer_id, now)
+
+        gone = [
+            viewer_id
+            for viewer_id, record in self.viewers.items()
+            if viewer_id not in seen
+            and (sources is None or record["source"] in sources)
+        ]
+        for viewer_id in gone:
+            record = self.viewers.pop(viewer_id)
+            self.history.pop(viewer_id, None)
+            self._counters.pop(viewer_id, None)
+            self.recent.append(
+                {**record, "ended_at": now, "duration": now - record["connected_at"]}
+            )
+            diff["removed"].append(viewer_id)
+        return diff
+
+    def _measure(self, raw, previous, now):
+        record = dict(raw)
+        if record.get("connected_at") is None:
+            # Broadcast Box does not say when a session started: first seen
+            record["connected_at"] = previous["connected_at"] if previous else now
+        last = self._counters.get(record["id"])
+        self._counters[record["id"]] = (
+            now,
+            record.get("bytes_sent"),
+            record.get("packets_sent"),
+        )
+        if last is None or now <= last[0]:
+            return record
+        elapsed = now - last[0]
+        if record.get("bytes_sent") is not None and last[1] is not None:
+            sent = max(0, record["bytes_sent"] - last[1])
+            record["bitrate_kbps"] = round(sent * 8 / elapsed / 1000)
+        if record.get("packets_sent") is not None and last[2] is not None:
+            sent = max(0, record["packets_sent"] - last[2])
+            record["packet_rate"] = round(sent / elapsed)
+        return record
+
+    def _remember(self, viewer_id, now):
+        record = self.viewers[viewer_id]
+        history = self.history[viewer_id]
+        history.append({"t": now, **{key: record.get(key) for key in HISTORY_FIELDS}})
+        while history and history[0]["t"] < now - self.history_seconds:
+            history.popleft()
+
+    def snapshot(self):
+        """Full state, for a newly connected panel or the REST endpoint"""
+        return {
+            "viewers": list(self.viewers.values()),
+            "recent": list(self.recent),
+        }
+
+    def viewer_history(self, viewer_id):
+        if viewer_id not in self.history:
+            return None
+        return list(self.history[viewer_id])
+
+
+class BeaconAggregator:
+    """Viewer-side stats beacons, per client and summed over a window"""
+
+    def __init__(self, window=BEACON_WINDOW, timeout=BEACON_TIMEOUT):
+        self.window = window
+        self.timeout = timeout
+        self.clients = {}
+        self.samples = deque(maxlen=MAX_BEACONS)  # (t, beacon)
+
+    def add(self, beacon, now=None):
+        """Validate and record one beacon; returns it, or None if unusable"""
+        now = time.time() if now is None else now
+        if not isinstance(beacon, dict) or not isinstance(beacon.get("id"), str):
+            return None
+        clean = {"t": now}
+        for key in BEACON_TEXT_FIELDS:
+            if isinstance(beacon.get(key), str):
+                clean[key] = beacon[key][:128]
+        for key, kind in BEACON_FIELDS.items():
+            try:
+                if beacon.get(key) is not None:
+                    clean[key] = max(0, kind(beacon[key]))
+            except (TypeError, ValueError):
+                continue
+        self.clients[clean["id"]] = clean
+        self.samples.append((now, clean))
+        self.prune(now)
+        return clean
+
+    def prune(self, now=None):
+        now = time.time() if now is None else now
+        for client_id in [
+            c for c, beacon in self.clients.items() if beacon["t"] < now - self.timeout
+        ]:
+            del self.clients[client_id]
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+
+    def summary(self, now=None):
+        """Current clients plus window totals and percentiles"""
+        self.prune(now)
+        beacons = [beacon for _, beacon in self.samples]
+
+        def total(key):
+            return sum(beacon.get(key, 0) for beacon in beacons)
+
+        def values(key):
+            return [beacon[key] for beacon in beacons if key in beacon]
+
+        decoded, dropped = total("decoded"), total("dropped")
+        return {
+            "clients": len(self.clients),
+            "window_seconds": self.window,
+            "fps_p5": _percentile(values("fps"), 5),
+            "jitter_ms_p50": _percentile(values("jitter_ms"), 50),
+            "jitter_ms_p95": _percentile(values("jitter_ms"), 95),
+            "decode_ms_p95": _percentile(values("decode_ms"), 95),
+            "rtt_ms_p95": _percentile(values("rtt_ms"), 95),
+            "freezes": total("freezes"),
+            "freeze_ms": round(total("freeze_ms")),
+            "dropped_ratio": (
+                round(dropped / (decoded + dropped), 4) if decoded else None
+            ),
+            "lost": total("lost"),
+            "reconnects": sum(b.get("reconnects", 0) for b in self.clients.values()),
+            "ice_restarts": sum(
+                b.get("ice_restarts", 0) for b in self.clients.values()
+            ),
+            "per_client": list(self.clients.values()),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Viewer sessions")
+    parser.add_argument(
+        "statuses",
+        nargs="+",
+        type=Path,
+        help="Broadcast Box /api/status responses (JSON, or JSONL over time)",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=5, help="seconds between JSONL lines"
+    )
+    args = parser.parse_args()
+
+    tracker = ViewerTracker()
+    now = 0.0
+    for path in args.statuses:
+        text = path.read_text()
+        try:
+            samples = [json.loads(text)]
+        except ValueError:
+            samples = [json.loads(line) for line in text.splitlines() if line.strip()]
+        for stream_info in samples:
+            diff = tracker.update(from_broadcast_box(stream_info), now)
+            print(json.dumps(diff))
+            now += args.interval
+    print(json.dumps(tracker.snapshot(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
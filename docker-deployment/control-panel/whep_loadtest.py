@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Built-in WHEP fan-out load test
+
+Runs a barcode-stamped sender (see latency_probe.py) in the in-process
+engine with the sfu tees, serves WHEP from whep_sfu.WhepServer on a local
+port, and connects N headless whepsrc viewers from a child process at each
+level. Reports the sender process's CPU per viewer (over the CPU with no
+viewers) and the glass-to-glass latency each level adds over one viewer.
+
+    python3 whep_loadtest.py --script vp9 --viewers 1 5 10 20
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import psutil
+
+import latency_probe
+import pipeline_builder
+import whep_sfu
+from gst_engine import GST_AVAILABLE, Gst, StreamEngine
+
+STREAM_KEY = "whep-loadtest"
+DEFAULT_PORT = 8089
+
+
+def build_viewer(url, script_id):
+    """whepsrc -> decode -> GRAY8 appsink reading the barcode"""
+    name = pipeline_builder.ENCODERS[script_id]["encoding_name"]
+    return (
+        f"whepsrc whep-endpoint={url} "
+        f"video-caps=application/x-rtp,media=video,encoding-name={name} "
+        "! decodebin ! videoconvert ! video/x-raw,format=GRAY8 ! "
+        "appsink name=frames emit-signals=true sync=false max-buffers=2 drop=true"
+    )
+
+
+def run_viewers(url, script_id, count, seconds):
+    """Child process: hold `count` viewers open and report their latency"""
+    latencies = [[] for _ in range(count)]
+
+    def on_frame(appsink, samples):
+        received = latency_probe.now_ms()
+        sample = appsink.emit("pull-sample")
+        width = sample.get_caps().get_structure(0).get_value("width")
+        buffer = sample.get_buffer()
+        ok, mapinfo = buffer.map(Gst.MapFlags.READ)
+        if ok:
+            try:
+                stamp = latency_probe.decode_stamp(
+                    mapinfo.data, width, (width + 3) & ~3
+                )
+            finally:
+                buffer.unmap(mapinfo)
+            if stamp is not None:
+                samples.append((received - stamp) & 0xFFFFFFFF)
+        return Gst.FlowReturn.OK
+
+    viewers = []
+    for samples in latencies:
+        pipeline = Gst.parse_launch(build_viewer(url, script_id))
+        pipeline.get_by_name("frames").connect("new-sample", on_frame, samples)
+        pipeline.set_state(Gst.State.PLAYING)
+        viewers.append(pipeline)
+    time.sleep(seconds)
+    for pipeline in viewers:
+        pipeline.set_state(Gst.State.NULL)
+
+    per_viewer = [latency_probe.percentiles(samples) for samples in latencies]
+    return {
+        "viewers": count,
+        "receiving": sum(1 for p in per_viewer if p),
+        "glass_to_glass_ms": latency_probe.percentiles(
+            [value for samples in latencies for value in samples]
+        ),
+        "per_viewer_p50_ms": [p["p50"] if p else None for p in per_viewer],
+    }
+
+
+def run_level(url, script_id, count, seconds):
+    """Sender-side CPU while a child process holds `count` viewers"""
+    process = psutil.Process(os.getpid())
+    process.cpu_percent(None)
+    result = {"viewers": count}
+    if count:
+        child = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--client",
+                url,
+                "--script",
+                script_id,
+                "--viewers",
+                str(count),
+                "--seconds",
+                str(seconds),
+            ],
+            capture_output=True,
+            text=True,
+        )
+        try:
+            result = json.loads(child.stdout)
+        except ValueError:
+            result["error"] = child.stderr.strip()[-500:]
+    else:
+        time.sleep(seconds)
+    result["sender_cpu_percent"] = round(process.cpu_percent(None), 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Built-in WHEP load test")
+    parser.add_argument(
+        "--script", default="vp9", choices=sorted(pipeline_builder.ENCODERS)
+    )
+    parser.add_argument("--viewers", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--resolution", default="1280x720")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--bitrate", type=int, default=4000)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--client", metavar="URL", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if not GST_AVAILABLE:
+        print("ERROR: PyGObject with GStreamer 1.0 introspection is required")
+        return 1
+    if args.client:
+        result = run_viewers(args.client, args.script, args.viewers[0], args.seconds)
+        print(json.dumps(result))
+        return 0
+
+    config = {"resolution": args.resolution, "fps": args.fps, "bitrate": args.bitrate}
+    engine = StreamEngine()
+    engine.start(
+        args.script, latency_probe.build_sender(args.script, config, "sfu"), config
+    )
+    server = whep_sfu.WhepServer(
+        engine, max_viewers=max(args.viewers), stream_key=STREAM_KEY
+    )
+    httpd = whep_sfu.serve(server, args.port)
+    url = f"http://127.0.0.1:{args.port}/whep/{STREAM_KEY}"
+
+    width, _ = pipeline_builder.parse_resolution(args.resolution)
+    latency_probe.CaptureStamper(engine.pipeline, latency_probe.block_size(width))
+    levels = []
+    try:
+        idle = run_level(url, args.script, 0, args.seconds)
+        for count in args.viewers:
+            level = run_level(url, args.script, count, args.seconds)
+            server.close_all()
+            levels.append(level)
+    finally:
+        httpd.shutdown()
+        engine.stop()
+
+    baseline = next(
+        (
+            level["glass_to_glass_ms"]["p50"]
+            for level in levels
+            if level.get("glass_to_glass_ms")
+        ),
+        None,
+    )
+    for level in levels:
+        extra = level["sender_cpu_percent"] - idle["sender_cpu_percent"]
+        level["cpu_percent_per_viewer"] = round(extra / level["viewers"], 2)
+        if baseline is not None and level.get("glass_to_glass_ms"):
+            level["added_latency_p50_ms"] = round(
+                level["glass_to_glass_ms"]["p50"] - baseline, 2
+            )
+    print(
+        json.dumps(
+            {
+                "script_id": args.script,
+                "resolution": args.resolution,
+                "fps": args.fps,
+                "idle_sender_cpu_percent": idle["sender_cpu_percent"],
+                "levels": levels,
+            },
+            indent=2,
+        )
+    )
+    return 0 if baseline is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,363 @@
+"""
+Built-in WHEP fan-out
+
+Serves viewers straight from the in-process pipeline instead of relaying
+through Broadcast Box: the engine pipeline is built with a tee after the
+video encoder (sfu_video) and one after the Opus encoder (sfu_audio), and
+every WHEP session hangs a branch off each tee:
+
+    tee -> leaky queue -> payloader (the viewer's payload type) -> webrtcbin
+
+Nothing is decoded or re-encoded per viewer; each one costs a payloader,
+SRTP and its webrtcbin. Sessions are non-trickle: the answer carries the
+gathered candidates. Runs in worker threads (the webrtcbin promises block).
+"""
+
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pipeline_builder
+from gst_engine import GST_AVAILABLE, Gst, structure_to_dict
+
+try:
+    import gi
+
+    gi.require_version("GstSdp", "1.0")
+    gi.require_version("GstVideo", "1.0")
+    gi.require_version("GstWebRTC", "1.0")
+    from gi.repository import GstSdp, GstVideo, GstWebRTC
+except (ImportError, ValueError):
+    GstSdp = GstVideo = GstWebRTC = None
+
+ICE_GATHER_TIMEOUT = 2.0
+# Encoded frames a slow viewer may fall behind before its queue drops
+VIEWER_QUEUE_BUFFERS = 30
+
+
+class WhepError(Exception):
+    """A request the server cannot serve; status is the HTTP status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def offer_payload_type(sdp, media, encoding_name, clock_rate):
+    """Payload type the offer uses for a codec in its first `media` section.
+
+    For H.264 the packetization-mode=1 variant is preferred, which is what
+    rtph264pay produces. None when the offer does not accept the codec.
+    """
+    section = None
+    seen = False
+    types, fmtp = [], {}
+    for line in sdp.splitlines():
+        if line.startswith("m="):
+            if section == media:
+                seen = True
+            section = line[2:].split()[0]
+            continue
+        if section != media or seen:
+            continue
+        match = re.match(r"a=rtpmap:(\d+) ([\w-]+)/(\d+)", line)
+        if match and match.group(2).upper() == encoding_name.upper():
+            if int(match.group(3)) == clock_rate:
+                types.append(int(match.group(1)))
+        match = re.match(r"a=fmtp:(\d+) (.*)", line)
+        if match:
+            fmtp[int(match.group(1))] = match.group(2)
+    if not types:
+        return None
+    if encoding_name.upper() == "H264":
+        for pt in types:
+            if "packetization-mode=1" in fmtp.get(pt, ""):
+                return pt
+    return types[0]
+
+
+def add_candidates(sdp, candidates):
+    """Put gathered candidates ("on-ice-candidate") into their m-sections"""
+    lines = sdp.rstrip("\r\n").split("\r\n")
+    sections = [i for i, line in enumerate(lines) if line.startswith("m=")]
+    extra = {}
+    for mline, candidate in candidates:
+        line = candidate if candidate.startswith("a=") else f"a={candidate}"
+        if mline < len(sections) and line not in lines:
+            extra.setdefault(mline, []).append(line)
+    # Insert from the last section backwards so indexes stay valid
+    for mline in sorted(extra, reverse=True):
+        end = sections[mline + 1] if mline + 1 < len(sections) else len(lines)
+        lines[end:end] = extra[mline] + ["a=end-of-candidates"]
+    return "\r\n".join(lines) + "\r\n"
+
+
+def _wait_promise(promise, what):
+    if promise.wait() != Gst.PromiseResult.REPLIED:
+        raise WhepError(500, f"{what} failed")
+    return promise.get_reply()
+
+
+class Session:
+    """One viewer: its webrtcbin and the branches off the encoder tees"""
+
+    def __init__(self, stream_key, pipeline, webrtc):
+        self.id = uuid.uuid4().hex
+        self.stream_key = stream_key
+        self.pipeline = pipeline
+        self.webrtc = webrtc
+        self.branches = []  # (tee src pad, bin)
+        self.created = time.time()
+        self.state = "new"
+        self.candidates = []
+        self.gathered = threading.Event()
+
+    def stats(self):
+        """webrtcbin get-stats as a dict"""
+        promise = Gst.Promise.new()
+        self.webrtc.emit("get-stats", None, promise)
+        if promise.wait() != Gst.PromiseResult.REPLIED:
+            return {}
+        return structure_to_dict(promise.get_reply())
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "stream_key": self.stream_key,
+            "state": self.state,
+            "connected_for": round(time.time() - self.created, 1),
+        }
+
+
+class WhepServer:
+    """WHEP sessions on the engine's running pipeline"""
+
+    def __init__(self, engine, max_viewers=10, stream_key=None):
+        self.engine = engine
+        self.max_viewers = max_viewers
+        # The only key viewers may ask for (None: any, for tests)
+        self.stream_key = stream_key
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def prune(self):
+        """Forget sessions of a pipeline that was stopped or swapped out"""
+        with self._lock:
+            current = self.engine.pipeline
+            for session_id in [
+                sid for sid, s in self.sessions.items() if s.pipeline is not current
+            ]:
+                del self.sessions[session_id]
+
+    def list(self):
+        self.prune()
+        return [session.summary() for session in list(self.sessions.values())]
+
+    def counts(self):
+        """Sessions per stream key"""
+        viewers = {}
+        for session in self.list():
+            key = session["stream_key"]
+            viewers[key] = viewers.get(key, 0) + 1
+        return viewers
+
+    def add(self, stream_key, offer):
+        """Answer a viewer's SDP offer; returns (session, answer SDP)"""
+        if not GST_AVAILABLE or GstWebRTC is None:
+            raise WhepError(503, "GStreamer WebRTC bindings are not available")
+        if self.stream_key is not None and stream_key != self.stream_key:
+            raise WhepError(404, "Unknown stream key")
+        self.prune()
+        if len(self.sessions) >= self.max_viewers:
+            raise WhepError(503, "Viewer limit reached")
+        pipeline, script_id = self.engine.pipeline, self.engine.script_id
+        if pipeline is None or pipeline.get_by_name("sfu_video") is None:
+            raise WhepError(404, "Stream is not running with the built-in WHEP server")
+
+        encoder = pipeline_builder.ENCODERS[script_id]
+        video_pt = offer_payload_type(offer, "video", encoder["encoding_name"], 90000)
+        if video_pt is None:
+            raise WhepError(406, f"Offer does not accept {encoder['encoding_name']}")
+        audio_pt = offer_payload_type(offer, "audio", "OPUS", 48000)
+
+        webrtc = Gst.ElementFactory.make("webrtcbin")
+        webrtc.set_property("bundle-policy", GstWebRTC.WebRTCBundlePolicy.MAX_BUNDLE)
+        session = Session(stream_key, pipeline, webrtc)
+        webrtc.connect(
+            "on-ice-candidate",
+            lambda _, mline, candidate: session.candidates.append((mline, candidate)),
+        )
+        webrtc.connect("notify::ice-gathering-state", self._on_gathering, session)
+        webrtc.connect("notify::connection-state", self._on_connection, session)
+        pipeline.add(webrtc)
+        webrtc.sync_state_with_parent()
+
+        try:
+            payloader = self._attach(
+                session,
+                "sfu_video",
+                f"{encoder['payloader']} pt={video_pt}",
+                f"application/x-rtp,media=video,encoding-name="
+                f"{encoder['encoding_name']},payload={video_pt},clock-rate=90000",
+            )
+            if audio_pt is not None and pipeline.get_by_name("sfu_audio"):
+                self._attach(
+                    session,
+                    "sfu_audio",
+                    f"rtpopuspay pt={audio_pt}",
+                    f"application/x-rtp,media=audio,encoding-name=OPUS,"
+                    f"payload={audio_pt},clock-rate=48000",
+                )
+            answer = self._negotiate(session, offer)
+        except Exception:
+            self._teardown(session)
+            raise
+
+        with self._lock:
+            self.sessions[session.id] = session
+        # Start the new viewer on a keyframe instead of waiting for the GOP
+        payloader.get_static_pad("sink").send_event(
+            GstVideo.video_event_new_upstream_force_key_unit(
+                Gst.CLOCK_TIME_NONE, True, 0
+            )
+        )
+        return session, answer
+
+    def _attach(self, session, tee_name, payloader, caps):
+        """tee -> leaky queue -> payloader -> caps -> a new webrtcbin sink pad"""
+        n = len(session.branches)
+        branch = Gst.parse_bin_from_description(
+            f"queue max-size-buffers={VIEWER_QUEUE_BUFFERS} max-size-time=0 "
+            f"max-size-bytes=0 leaky=downstream ! {payloader} name=pay{n} ! "
+            f"capsfilter caps={caps}",
+            True,
+        )
+        session.pipeline.add(branch)
+        sink = session.webrtc.request_pad_simple("sink_%u")
+        branch.get_static_pad("src").link(sink)
+        transceiver = sink.get_property("transceiver")
+        transceiver.set_property(
+            "direction", GstWebRTC.WebRTCRTPTransceiverDirection.SENDONLY
+        )
+        transceiver.set_property("codec-preferences", Gst.Caps.from_string(caps))
+
+        tee_pad = session.pipeline.get_by_name(tee_name).request_pad_simple("src_%u")
+        session.branches.append((tee_pad, branch))
+        branch.sync_state_with_parent()
+        tee_pad.link(branch.get_static_pad("sink"))
+        return branch.get_by_name(f"pay{n}")
+
+    def _negotiate(self, session, offer):
+        result, message = GstSdp.SDPMessage.new_from_text(offer)
+        if result != GstSdp.SDPResult.OK:
+            raise WhepError(400, "Malformed SDP offer")
+        webrtc = session.webrtc
+        promise = Gst.Promise.new()
+        webrtc.emit(
+            "set-remote-description",
+            GstWebRTC.WebRTCSessionDescription.new(
+                GstWebRTC.WebRTCSDPType.OFFER, message
+            ),
+            promise,
+        )
+        _wait_promise(promise, "set-remote-description")
+
+        promise = Gst.Promise.new()
+        webrtc.emit("create-answer", None, promise)
+        answer = _wait_promise(promise, "create-answer").get_value("answer")
+        if answer is None:
+            raise WhepError(406, "No common codecs with the offer")
+        promise = Gst.Promise.new()
+        webrtc.emit("set-local-description", answer, promise)
+        _wait_promise(promise, "set-local-description")
+
+        # Non-trickle: hand out the answer once the candidates are in
+        session.gathered.wait(ICE_GATHER_TIMEOUT)
+        local = webrtc.get_property("local-description") or answer
+        return add_candidates(local.sdp.as_text(), session.candidates)
+
+    @staticmethod
+    def _on_gathering(webrtc, _pspec, session):
+        state = webrtc.get_property("ice-gathering-state")
+        if state == GstWebRTC.WebRTCICEGatheringState.COMPLETE:
+            session.gathered.set()
+
+    def _on_connection(self, webrtc, _pspec, session):
+        state = webrtc.get_property("connection-state")
+        session.state = state.value_nick
+        if state in (
+            GstWebRTC.WebRTCPeerConnectionState.FAILED,
+            GstWebRTC.WebRTCPeerConnectionState.CLOSED,
+        ):
+            # Not from webrtcbin's own thread
+            threading.Thread(
+                target=self.remove, args=(session.id,), daemon=True
+            ).start()
+
+    def remove(self, session_id):
+        """End a session (WHEP DELETE, or its connection failed)"""
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._teardown(session)
+        return True
+
+    @staticmethod
+    def _teardown(session):
+        for tee_pad, branch in session.branches:
+            idle = threading.Event()
+
+            def unlink(pad, _info, branch=branch, idle=idle):
+                pad.unlink(branch.get_static_pad("sink"))
+                idle.set()
+                return Gst.PadProbeReturn.REMOVE
+
+            tee_pad.add_probe(Gst.PadProbeType.IDLE, unlink)
+            idle.wait(1)
+            tee_pad.get_parent_element().release_request_pad(tee_pad)
+        for element in [session.webrtc] + [branch for _, branch in session.branches]:
+            element.set_state(Gst.State.NULL)
+            session.pipeline.remove(element)
+
+    def close_all(self):
+        for session_id in list(self.sessions):
+            self.remove(session_id)
+
+
+def serve(server, port):
+    """Minimal local WHEP endpoint in front of a WhepServer, for the probe
+    and load test: POST /whep/<stream_key> with an offer, DELETE the
+    Location. port 0 picks a free one (httpd.server_address[1])."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            offer = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            stream_key = self.path.rstrip("/").rsplit("/", 1)[-1]
+            try:
+                session, answer = server.add(stream_key, offer.decode())
+            except WhepError as e:
+                self.send_error(e.status, str(e))
+                return
+            body = answer.encode()
+            self.send_response(201)
+            self.send_header("Content-Type", "application/sdp")
+            self.send_header("Location", f"/whep/{stream_key}/{session.id}")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_DELETE(self):
+            found = server.remove(self.path.rsplit("/", 1)[-1])
+            self.send_response(200 if found else 404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd